@@ -1,7 +1,26 @@
+from typing import Any, Dict
+
 import pandas as pd
-import plotly.express as px
 import streamlit as st
-from pathlib import Path
+
+from dashboard import (
+    RENDERED_FIGURES,
+    begin_perf_trace,
+    end_perf_trace,
+    figure_stage,
+    offer_download,
+    render_kpis,
+    render_paged_table,
+)
+from streamlit_utils import (
+    IncrementalDataset,
+    SharedDataset,
+    export_formats,
+    get_incremental_dataset,
+    run_pipeline,
+    span,
+)
+
 
 st.set_page_config(
     page_title="Sales Performance Dashboard",
@@ -10,19 +29,20 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-DATA_PATH = Path(__file__).parent / "data" / "sales_sample.csv"
 
+def load_dataset() -> IncrementalDataset:
+    """The dataset shared by every session, brought up to date on each rerun.
 
-@st.cache_data(show_spinner=False)
-def load_data() -> pd.DataFrame:
-    """Load the demo dataset from disk and enrich with convenience columns."""
-    df = pd.read_csv(DATA_PATH, parse_dates=["order_date"])
-    df["month"] = df["order_date"].dt.to_period("M").dt.to_timestamp()
-    df["year"] = df["order_date"].dt.year
-    return df
+    Only rows appended to the CSV since the previous rerun are parsed; KPIs
+    and charts come from its pre-aggregated rollup cube, whose summaries for
+    popular filter states are memoised across sessions.
+    """
+    dataset = get_incremental_dataset("csv")
+    dataset.refresh()
+    return dataset
 
 
-def filter_data(df: pd.DataFrame) -> pd.DataFrame:
+def sidebar_filters(df: pd.DataFrame) -> Dict[str, Any]:
     with st.sidebar:
         st.header("Filters")
         regions = st.multiselect(
@@ -50,106 +70,91 @@ def filter_data(df: pd.DataFrame) -> pd.DataFrame:
         )
         st.caption("Download or adjust the filters to explore the dataset.")
 
-    filtered = df.copy()
-    if regions:
-        filtered = filtered[filtered["region"].isin(regions)]
-    if categories:
-        filtered = filtered[filtered["category"].isin(categories)]
-    if segments:
-        filtered = filtered[filtered["customer_segment"].isin(segments)]
-
-    if isinstance(date_range, tuple) and len(date_range) == 2:
-        start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
-        filtered = filtered[filtered["order_date"].between(start, end)]
-
-    return filtered
-
-
-def render_kpis(df: pd.DataFrame) -> None:
-    total_sales = float(df["sales"].sum())
-    total_profit = float(df["profit"].sum())
-    avg_margin = (total_profit / total_sales * 100) if total_sales else 0.0
-    avg_order_value = df["sales"].mean() if not df.empty else 0.0
-
-    col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total sales", f"${total_sales:,.0f}")
-    col2.metric("Total profit", f"${total_profit:,.0f}")
-    col3.metric("Average margin", f"{avg_margin:,.1f}%")
-    col4.metric("Avg. order", f"${avg_order_value:,.0f}")
-
-
-def render_charts(df: pd.DataFrame) -> None:
-    sales_trend = df.groupby("order_date", as_index=False)["sales"].sum()
-    category_sales = df.groupby("category", as_index=False)["sales"].sum()
-    segment_profit = df.groupby("customer_segment", as_index=False)["profit"].sum()
-
-    trend_fig = px.line(
-        sales_trend,
-        x="order_date",
-        y="sales",
-        title="Daily sales trend",
-        markers=True,
-    )
-    trend_fig.update_layout(margin=dict(l=10, r=10, t=40, b=10))
-
-    category_fig = px.bar(
-        category_sales,
-        x="category",
-        y="sales",
-        title="Sales by category",
-        color="category",
-        text_auto=True,
-    )
-    category_fig.update_layout(showlegend=False, margin=dict(l=10, r=10, t=40, b=10))
-
-    segment_fig = px.pie(
-        segment_profit,
-        names="customer_segment",
-        values="profit",
-        title="Profit contribution by segment",
-        hole=0.4,
-    )
-    segment_fig.update_layout(margin=dict(l=10, r=10, t=40, b=10))
+    return {
+        "region": regions,
+        "category": categories,
+        "customer_segment": segments,
+        "order_date": (
+            date_range
+            if isinstance(date_range, tuple) and len(date_range) == 2
+            else None
+        ),
+    }
+
 
-    left_col, right_col = st.columns((2, 1))
-    left_col.plotly_chart(trend_fig, use_container_width=True)
-    left_col.plotly_chart(category_fig, use_container_width=True)
-    right_col.plotly_chart(segment_fig, use_container_width=True)
+def render_charts(figures: Dict[str, Any]) -> None:
+    with span("send_figures"):
+        left_col, right_col = st.columns((2, 1))
+        left_col.plotly_chart(figures["trend"], use_container_width=True)
+        left_col.plotly_chart(figures["category"], use_container_width=True)
+        right_col.plotly_chart(figures["segment"], use_container_width=True)
 
 
-def render_details(df: pd.DataFrame) -> None:
+def render_details(snapshot: SharedDataset, filters: Dict[str, Any]) -> None:
     st.subheader("Transaction details")
-    st.dataframe(
-        df.sort_values("order_date", ascending=False),
-        use_container_width=True,
-    )
-    st.download_button(
-        "Download filtered data",
-        data=df.to_csv(index=False).encode("utf-8"),
-        file_name="filtered_sales.csv",
-        mime="text/csv",
+    # only the current page is taken from the precomputed sort order
+    render_paged_table(
+        lambda page, page_size, sort_by, ascending, search: snapshot.table.page(
+            page, page_size, sort_by, ascending, filters, search
+        ),
+        key="details_page",
     )
 
+    # the file is only built on request, then reused for this filter state
+    format_col, button_col = st.columns((1, 3), vertical_alignment="bottom")
+    fmt = format_col.selectbox("File format", export_formats())
+    if button_col.button("Prepare filtered data"):
+        offer_download(
+            "Download filtered data",
+            "filtered_sales",
+            "filtered",
+            snapshot.version,
+            filters,
+            fmt,
+            lambda: snapshot.select(filters),
+        )
 
-def main() -> None:
-    st.title("Sales Performance Dashboard")
-    st.caption(
-        "Use this demo to explore sales, profit, and customer trends on a simple sample dataset. "
-        "Adjust the filters in the sidebar to focus on specific regions or customer segments."
-    )
 
-    data = load_data()
-    filtered_data = filter_data(data)
+def render_dashboard() -> None:
+    with span("refresh") as timing:
+        # one read-only snapshot for the whole rerun, shared with other sessions
+        snapshot = load_dataset().snapshot
+        timing["rows"] = len(snapshot.frame)
+    filters = sidebar_filters(snapshot.frame)
+    # load → aggregate → chart data, each skipped while its inputs are unchanged
+    pipeline = run_pipeline(filters, mode="live", source="csv")
 
-    if filtered_data.empty:
+    if pipeline["rows"].empty:
         st.warning("No records match your filters. Adjust the selections to see data.")
         return
 
-    render_kpis(filtered_data)
+    figures = figure_stage(pipeline, RENDERED_FIGURES["app"])
+    with span("render_kpis"):
+        render_kpis(pipeline["summary"])
     st.divider()
-    render_charts(filtered_data)
+    with span("render_charts"):
+        render_charts(figures)
     st.divider()
-    render_details(filtered_data)
+    with span("render_details"):
+        render_details(snapshot, filters)
+
+
+def main() -> None:
+    # Frames derived from the shared datasets (shallow copies, column subsets)
+    # then copy a column only when it is written to, so sessions read them
+    # without copying and without being able to change them.
+    pd.set_option("mode.copy_on_write", True)
+    st.title("Sales Performance Dashboard")
+    st.caption(
+        "Use this demo to explore sales, profit, and customer trends on a simple sample dataset. "
+        "Adjust the filters in the sidebar to focus on specific regions or customer segments."
+    )
+
+    show_perf = begin_perf_trace("app")
+    try:
+        render_dashboard()
+    finally:
+        end_perf_trace(show_perf)
 
 
 if __name__ == "__main__":
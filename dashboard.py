@@ -0,0 +1,258 @@
+"""Streamlit pieces shared by app.py and streamlit_ass.py.
+
+Figures are built from the chart frames of ``run_pipeline`` and cached by a
+hash of each frame's contents and chart options; the ``render_*`` functions
+only draw what earlier stages produced.
+"""
+
+import os
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from streamlit_utils import (
+    DASHBOARD_COLUMNS,
+    PAGE_SIZES,
+    TREND_TITLES,
+    ExportTooLargeError,
+    PerfTrace,
+    export_file_name,
+    export_mime,
+    frame_digest,
+    get_export,
+    perf_logging_enabled,
+    run_stage,
+    span,
+    stage_key,
+    start_trace,
+    stop_trace,
+)
+
+PERF_PANEL = os.environ.get("PERF_PANEL", "").lower() in ("1", "true", "yes")
+FIGURE_MARGIN = dict(l=10, r=10, t=40, b=10)
+
+# fetch(page, page_size, sort_by, ascending, search) -> (rows, total)
+PageFetcher = Callable[[int, int, str, bool, Optional[str]], Tuple[pd.DataFrame, int]]
+
+
+# Layout changes applied after construction, per figure.
+FIGURE_LAYOUTS = {"category": dict(showlegend=False)}
+
+# The figures each dashboard renders, so figure_stage builds no others.
+RENDERED_FIGURES = {
+    "app": ("trend", "category", "segment"),
+    "streamlit_ass": ("trend", "subcategory", "segment"),
+}
+
+
+def figure_specs(
+    charts: Dict[str, Any],
+) -> Dict[str, Tuple[str, pd.DataFrame, Dict[str, Any]]]:
+    """The plotly express function, frame and options of each figure.
+
+    Covers the ``trend``, ``category``, ``subcategory`` and ``segment``
+    figures of the frames of ``chart_stage``.
+    """
+    subcategory_sales = charts["subcategory_sales"]
+    return {
+        "trend": (
+            "line",
+            charts["trend"],
+            dict(
+                x="order_date",
+                y="sales",
+                title=TREND_TITLES[charts["resolution"]],
+                markers=True,
+            ),
+        ),
+        "category": (
+            "bar",
+            charts["category_sales"],
+            dict(
+                x="category",
+                y="sales",
+                title="Sales by category",
+                color="category",
+                text_auto=True,
+            ),
+        ),
+        "subcategory": (
+            "bar",
+            subcategory_sales,
+            dict(
+                # MongoDB summaries without a subcategory field fall back to categories
+                x="subcategory" if "subcategory" in subcategory_sales else "category",
+                y="sales",
+                color="category",
+                title="Sales by subcategory",
+            ),
+        ),
+        "segment": (
+            "pie",
+            charts["segment_profit"],
+            dict(
+                names="customer_segment",
+                values="profit",
+                title="Profit contribution by segment",
+                hole=0.4,
+            ),
+        ),
+    }
+
+
+def build_figure(
+    kind: str,
+    frame: pd.DataFrame,
+    options: Dict[str, Any],
+    layout: Optional[Dict[str, Any]] = None,
+):
+    # imported on first use: pages render their KPIs and tables without it
+    import plotly.express as px
+
+    figure = getattr(px, kind)(frame, **options)
+    figure.update_layout(margin=FIGURE_MARGIN, **(layout or {}))
+    return figure
+
+
+def build_figures(charts: Dict[str, Any]) -> Dict[str, Any]:
+    """Plotly figures for the frames of ``chart_stage``, see ``figure_specs``."""
+    return {
+        name: build_figure(kind, frame, options, FIGURE_LAYOUTS.get(name))
+        for name, (kind, frame, options) in figure_specs(charts).items()
+    }
+
+
+def figure_key(
+    kind: str,
+    frame: pd.DataFrame,
+    options: Dict[str, Any],
+    layout: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Hash of a figure's inputs: the frame's contents and the chart options."""
+    return stage_key(frame_digest(frame), kind, options, layout, FIGURE_MARGIN)
+
+
+def figure_stage(
+    pipeline: Dict[str, Any], kinds: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """The figures for a ``run_pipeline`` result, or only the ``kinds`` named.
+
+    Each figure is cached by ``figure_key``, so it is only rebuilt when its
+    own frame or options change, whatever else changed in the rerun.
+    """
+    specs = figure_specs(pipeline["charts"])
+    if kinds is not None:
+        specs = {name: specs[name] for name in kinds}
+    figures = {}
+    for name, (kind, frame, options) in specs.items():
+        layout = FIGURE_LAYOUTS.get(name)
+        figures[name] = run_stage(
+            f"figure_{name}",
+            lambda: build_figure(kind, frame, options, layout),
+            figure_key(kind, frame, options, layout),
+        )
+    return figures
+
+
+def render_kpis(summary: Dict[str, Any]) -> None:
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total sales", f"${summary['total_sales']:,.0f}")
+    col2.metric("Total profit", f"${summary['total_profit']:,.0f}")
+    col3.metric("Average margin", f"{summary['avg_margin']:,.1f}%")
+    col4.metric("Avg. order", f"${summary['avg_order']:,.0f}")
+
+
+def render_paged_table(
+    fetch: PageFetcher, key: str, json_view: bool = False
+) -> Tuple[pd.DataFrame, int]:
+    """Search, sort and page controls plus the current page of rows.
+
+    Only the page shown is fetched; ``key`` is the session state key of the
+    page number. Returns the page and the total number of matching rows.
+    """
+    search_col, sort_col, order_col, size_col = st.columns((3, 2, 1, 1))
+    search = search_col.text_input(
+        "Search", placeholder="Region, category, subcategory or segment"
+    )
+    sort_by = sort_col.selectbox("Sort by", DASHBOARD_COLUMNS)
+    ascending = order_col.selectbox("Order", ("Descending", "Ascending")) == "Ascending"
+    page_size = size_col.selectbox("Rows per page", PAGE_SIZES, index=1)
+
+    page = st.session_state.get(key, 1)
+    with span("table_page") as timing:
+        rows, total = fetch(page, page_size, sort_by, ascending, search)
+        pages = max(-(-total // page_size), 1)
+        if page > pages:
+            # the filters shrank the result below the page the user was on
+            page = st.session_state[key] = pages
+            rows, total = fetch(page, page_size, sort_by, ascending, search)
+        timing.measure(rows)
+
+    with span("send_table"):
+        if json_view:
+            st.json(rows.to_dict(orient="records"))
+        else:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+    page_col, info_col = st.columns((1, 3))
+    page_col.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, key=key)
+    first = (page - 1) * page_size
+    info_col.caption(
+        f"Rows {first + min(len(rows), 1):,}–{first + len(rows):,} of {total:,}"
+    )
+    return rows, total
+
+
+def offer_download(
+    label: str,
+    file_stem: str,
+    kind: str,
+    version: Any,
+    filters: Optional[Dict[str, Any]],
+    fmt: str,
+    loader: Callable[[], pd.DataFrame],
+) -> None:
+    """A download button for the cached export of ``loader()``'s rows."""
+    try:
+        data = get_export(kind, version, filters, fmt, loader)
+    except ExportTooLargeError as exc:
+        st.error(str(exc))
+        return
+    st.download_button(
+        label,
+        data=data,
+        file_name=export_file_name(file_stem, fmt),
+        mime=export_mime(fmt),
+    )
+
+
+def render_perf_panel(trace: PerfTrace) -> None:
+    with st.expander("Performance", expanded=True):
+        st.caption(f"Last rerun took {trace.total_ms:,.1f} ms")
+        st.dataframe(
+            trace.frame(),
+            hide_index=True,
+            use_container_width=True,
+            column_config={"ms": st.column_config.NumberColumn(format="%.1f")},
+        )
+
+
+def begin_perf_trace(label: str) -> bool:
+    """Start timing this rerun if the panel or ``PERF_LOG`` wants it.
+
+    Returns whether the panel is shown; its toggle is drawn at the end of the
+    run, but its value from the previous run is already known.
+    """
+    show_perf = st.session_state.get("perf_panel", PERF_PANEL)
+    if show_perf or perf_logging_enabled():
+        start_trace(label)
+    return show_perf
+
+
+def end_perf_trace(show_perf: bool) -> None:
+    """Stop the rerun's trace and draw the panel toggle (and panel) in the sidebar."""
+    trace = stop_trace()
+    with st.sidebar:
+        st.toggle("Performance panel", value=PERF_PANEL, key="perf_panel")
+        if show_perf and trace is not None:
+            render_perf_panel(trace)
@@ -0,0 +1,339 @@
+"""Benchmark the dashboard's load, filter, aggregate and export paths.
+
+For every --rows size a synthetic CSV shaped like data/sales_sample.csv is
+generated (with configurable cardinalities and date span), pointed to as the
+dashboard's DATA_PATH, and each case below is timed best-of --repeat. Peak
+memory is measured with tracemalloc on one extra, untimed run per case.
+
+Cases:
+  - load_csv: parse the CSV and normalise it (columnar cache off)
+  - load_columnar: memory-map the columnar cache
+  - load_partitions / load_partitions_pruned: the same rows split into one
+    file per month and parsed on the process pool (CSV_WORKERS), all of them
+    or only the partitions of the filters' date range
+  - ensure_datetime: derive month/year on a freshly parsed frame
+  - get_dataframe: cold get_dataframe("csv") with the filters below
+  - filter_pandas / filter_index: apply_filters vs FilterIndex.select
+  - summary_pandas / summary_cube: summarize_sales on the filtered rows vs
+    RollupCube.summary
+  - summary_engine: aggregate_sales_in_engine, i.e. DuckDB queries over the
+    CSV (when duckdb is installed)
+  - export_csv / export_csv_gz / export_parquet: export_frame of the rows
+  - figures_build / figures_cached: Plotly express construction of the
+    dashboard's four figures vs figure_stage serving them from its cache
+  - session_views / session_copies: --sessions sessions reading the dataset
+    through views of one SharedDataset vs each holding its own copy; their
+    peak MiB is the per-session memory, which stays flat for views as --rows
+    grows
+
+Usage:
+  - run: python scripts/benchmark.py --rows 10000 100000 1000000
+  - save and compare runs:
+      python scripts/benchmark.py --output before.json
+      python scripts/benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import streamlit_utils  # noqa: E402
+from dashboard import build_figures, figure_stage  # noqa: E402
+from streamlit_utils import (  # noqa: E402
+    DATAFRAME_CACHE,
+    DERIVED_COLUMNS,
+    FilterIndex,
+    RollupCube,
+    SharedDataset,
+    aggregate_sales_in_engine,
+    apply_filters,
+    chart_stage,
+    ensure_datetime,
+    export_formats,
+    export_frame,
+    get_dataframe,
+    load_columnar_data,
+    load_csv_data,
+    summarize_sales,
+    try_import_duckdb,
+    write_columnar_cache,
+)
+
+REGIONS = ["North", "South", "East", "West"]
+CATEGORIES = {
+    "Electronics": ["Mobile Phones", "Laptops", "Accessories"],
+    "Office Supplies": ["Paper", "Binders", "Writing"],
+    "Furniture": ["Chairs", "Tables", "Storage"],
+}
+SEGMENTS = ["Consumer", "Corporate", "Small Business", "Home Office"]
+
+
+def _labels(known, count, prefix):
+    return list(known[:count]) + [
+        f"{prefix} {i}" for i in range(len(known) + 1, count + 1)
+    ]
+
+
+def make_sales_frame(
+    rows,
+    seed=0,
+    regions=4,
+    categories=3,
+    subcategories=3,
+    segments=4,
+    days=3 * 365,
+    start="2022-01-01",
+):
+    """A frame with the CSV's columns; dimensions are categorical to keep
+    10M-row frames small (``to_csv`` writes them as plain strings)."""
+    rng = np.random.default_rng(seed)
+    category_names = _labels(list(CATEGORIES), categories, "Category")
+    # every category gets ``subcategories`` children, named uniquely
+    children = [
+        _labels(CATEGORIES.get(name, []), subcategories, f"{name} sub")
+        for name in category_names
+    ]
+    category = rng.integers(0, categories, rows)
+    subcategory = category * subcategories + rng.integers(0, subcategories, rows)
+    return pd.DataFrame(
+        {
+            "order_date": pd.Timestamp(start)
+            + pd.to_timedelta(rng.integers(0, days, rows), unit="D"),
+            "region": pd.Categorical.from_codes(
+                rng.integers(0, regions, rows), _labels(REGIONS, regions, "Region")
+            ),
+            "category": pd.Categorical.from_codes(category, category_names),
+            "subcategory": pd.Categorical.from_codes(
+                subcategory, [child for names in children for child in names]
+            ),
+            "sales": rng.integers(100, 30000, rows),
+            "quantity": rng.integers(1, 200, rows),
+            "profit": rng.integers(-2000, 6000, rows),
+            "customer_segment": pd.Categorical.from_codes(
+                rng.integers(0, segments, rows), _labels(SEGMENTS, segments, "Segment")
+            ),
+        }
+    )
+
+
+def benchmark_filters(df):
+    """A typical sidebar selection: about half of each dimension, a year of dates."""
+    start = df["order_date"].min()
+    half = lambda column: sorted(df[column].unique())[::2]  # noqa: E731
+    return {
+        "region": half("region"),
+        "category": half("category"),
+        "customer_segment": half("customer_segment"),
+        "order_date": (start, start + pd.Timedelta(days=365)),
+    }
+
+
+def write_partitions(df, directory):
+    """Split ``df`` into one CSV per month, named for partition pruning."""
+    directory.mkdir()
+    rows = df.drop(columns=list(DERIVED_COLUMNS))
+    for month, chunk in rows.groupby(rows["order_date"].dt.to_period("M")):
+        chunk.to_csv(directory / f"sales_{month}.csv", index=False)
+    return directory
+
+
+def load_partitions(directory, date_range=None):
+    data_path = streamlit_utils.DATA_PATH
+    streamlit_utils.DATA_PATH = directory
+    try:
+        return load_csv_data(date_range=date_range)
+    finally:
+        streamlit_utils.DATA_PATH = data_path
+
+
+def time_case(fn, setup=None, repeat=5):
+    """Best and median seconds of ``fn(setup())`` and its tracemalloc peak in MiB."""
+    timings = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        started = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - started)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(timings), statistics.median(timings), peak / 2**20
+
+
+def run_size(rows, args, workdir):
+    csv_path = Path(workdir) / f"sales_{rows}.csv"
+    make_sales_frame(
+        rows,
+        args.seed,
+        args.regions,
+        args.categories,
+        args.subcategories,
+        args.segments,
+        args.days,
+    ).to_csv(csv_path, index=False)
+    streamlit_utils.DATA_PATH = csv_path
+    os.environ["COLUMNAR_CACHE"] = "0"
+
+    df = load_csv_data()
+    filters = benchmark_filters(df)
+    filtered = apply_filters(df, filters)
+    index = FilterIndex(df)
+    cube = RollupCube(df)
+    snapshot = SharedDataset(df, "benchmark")
+    charts = chart_stage(cube.summary(filters))
+    figure_stage({"charts": charts})
+
+    def cold_get_dataframe(_):
+        DATAFRAME_CACHE.clear()
+        get_dataframe("csv", filters=filters)
+
+    cases = {
+        "load_csv": (lambda _: load_csv_data(), None),
+        "ensure_datetime": (ensure_datetime, lambda: pd.read_csv(csv_path)),
+        "get_dataframe": (cold_get_dataframe, None),
+        "filter_pandas": (lambda _: apply_filters(df, filters), None),
+        "filter_index": (lambda _: index.select(filters), None),
+        "summary_pandas": (lambda _: summarize_sales(apply_filters(df, filters)), None),
+        "summary_cube": (lambda _: cube.summary(filters), None),
+        "figures_build": (lambda _: build_figures(charts), None),
+        "figures_cached": (lambda _: figure_stage({"charts": charts}), None),
+        "session_views": (
+            lambda _: [snapshot.view() for _ in range(args.sessions)],
+            None,
+        ),
+        "session_copies": (lambda _: [df.copy() for _ in range(args.sessions)], None),
+    }
+    if try_import_duckdb():
+        cases["summary_engine"] = (lambda _: aggregate_sales_in_engine(filters), None)
+    if write_columnar_cache(df) is not None:
+        cases["load_columnar"] = (lambda _: load_columnar_data(), None)
+    part_dir = write_partitions(df, Path(workdir) / f"parts_{rows}")
+    for case, date_range in (
+        ("load_partitions", None),
+        ("load_partitions_pruned", filters["order_date"]),
+    ):
+        cases[case] = (
+            lambda _, date_range=date_range: load_partitions(part_dir, date_range),
+            None,
+        )
+    for fmt in export_formats():
+        name = "export_" + fmt.replace(".", "_")
+        cases[name] = (
+            lambda _, fmt=fmt: export_frame(filtered, fmt, max_bytes=0),
+            None,
+        )
+
+    results = []
+    for case, (fn, setup) in cases.items():
+        if args.cases and case not in args.cases:
+            continue
+        best, median, peak = time_case(fn, setup, args.repeat)
+        results.append(
+            {
+                "case": case,
+                "rows": rows,
+                "best_s": best,
+                "median_s": median,
+                "rows_per_s": rows / best if best else None,
+                "peak_mb": peak,
+            }
+        )
+        print(
+            f"{case:16}{rows:>12,}{best * 1000:12.2f}{median * 1000:12.2f}"
+            f"{rows / best if best else 0:16,.0f}{peak:10.1f}"
+        )
+    DATAFRAME_CACHE.clear()
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = {(r["case"], r["rows"]): r for r in json.load(fh)["results"]}
+    print(f"\nvs {baseline_path} (best time, >1 is faster now)")
+    for result in results:
+        before = baseline.get((result["case"], result["rows"]))
+        if before and result["best_s"]:
+            speedup = before["best_s"] / result["best_s"]
+            print(f"{result['case']:16}{result['rows']:>12,}{speedup:9.2f}x")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--regions", type=int, default=4)
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--subcategories", type=int, default=3, help="per category")
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--days", type=int, default=3 * 365, help="order date span")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--sessions", type=int, default=10, help="for the session_* cases"
+    )
+    parser.add_argument("--cases", nargs="*", help="only run these cases")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--compare", help="a previous --output file to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # as the dashboards run, so session views share the snapshot's memory
+    pd.set_option("mode.copy_on_write", True)
+    print(
+        f"{'case':16}{'rows':>12}{'best ms':>12}{'median ms':>12}"
+        f"{'rows/s':>16}{'peak MiB':>10}"
+    )
+    data_path, columnar = streamlit_utils.DATA_PATH, os.environ.get("COLUMNAR_CACHE")
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for rows in args.rows:
+                results.extend(run_size(rows, args, workdir))
+    finally:
+        streamlit_utils.DATA_PATH = data_path
+        if columnar is None:
+            os.environ.pop("COLUMNAR_CACHE", None)
+        else:
+            os.environ["COLUMNAR_CACHE"] = columnar
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare memory and filter/groupby time of raw vs schema-normalised frames.
+
+Builds a synthetic frame shaped like data/sales_sample.csv (with the generator
+from scripts/benchmark.py, which times the wider load/filter/export paths),
+then times the dashboard's sidebar filter and category groupby on the raw
+dtypes (object strings, int64) and after normalize_sales_frame.
+
+Usage:
+  - run: python scripts/benchmark_dtypes.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmark import make_sales_frame  # noqa: E402
+from streamlit_utils import (  # noqa: E402
+    apply_filters,
+    ensure_datetime,
+    normalize_sales_frame,
+    sum_by,
+)
+
+
+def make_raw_frame(rows, seed=0):
+    df = make_sales_frame(rows, seed)
+    # object strings, as read_csv returns them
+    for column in ("region", "category", "subcategory", "customer_segment"):
+        df[column] = df[column].astype(object)
+    return ensure_datetime(df)
+
+
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure(df):
+    filters = {
+        "region": ["North", "West"],
+        "category": ["Electronics", "Furniture"],
+        "customer_segment": ["Consumer"],
+        "order_date": ("2022-06-01", "2023-06-30"),
+    }
+    return {
+        "memory_mb": df.memory_usage(deep=True).sum() / 2**20,
+        "filter_ms": best_of(lambda: apply_filters(df, filters)) * 1000,
+        "groupby_ms": best_of(lambda: sum_by(df, ["category", "subcategory"], "sales"))
+        * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    raw = make_raw_frame(args.rows)
+    before = measure(raw)
+    after = measure(normalize_sales_frame(raw.copy()))
+
+    print(f"{args.rows:,} rows")
+    print(f"{'':12}{'raw':>12}{'normalised':>12}{'ratio':>8}")
+    for key in ("memory_mb", "filter_ms", "groupby_ms"):
+        ratio = before[key] / after[key] if after[key] else float("inf")
+        print(f"{key:12}{before[key]:12.1f}{after[key]:12.1f}{ratio:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Convert data/sales_sample.csv into its memory-mappable columnar cache.
+
+The dashboards rebuild the cache on their own whenever the CSV is newer, but
+running this at deploy time means the first visitor never pays for parsing.
+
+Usage:
+  - run: python scripts/build_columnar_cache.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from streamlit_utils import DATA_PATH, write_columnar_cache  # noqa: E402
+
+
+def main():
+    path = write_columnar_cache()
+    if path is None:
+        raise SystemExit(
+            "Could not write the columnar cache (is pyarrow installed, and DATA_PATH a single CSV?)"
+        )
+    print(f"Wrote {path.resolve()} from {DATA_PATH.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
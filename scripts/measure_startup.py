@@ -0,0 +1,115 @@
+"""Measure the dashboards' time to first render in a fresh process.
+
+Each measurement starts a new Python process, imports Streamlit (a running
+server already has it loaded) and then times, with Streamlit's AppTest:
+
+  - warm_up: with the warm-up on, scripts/serve.py's start_warm_up, which
+    runs while the server boots (the first visitor is assumed to arrive
+    after it finished)
+  - first_render: the first session's run; without the warm-up it pays for
+    importing the app modules, loading the data and computing every aggregate
+  - second_render: a second session in the same process, served from the
+    shared caches
+
+Runs are repeated with the warm-up off and on, and the median first render
+with the warm-up is checked against --target-ms.
+
+Usage:
+  - python scripts/measure_startup.py
+  - python scripts/measure_startup.py --apps app.py --repeat 5 --target-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in the child process; prints one JSON line with its timings.
+CHILD = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {scripts!r})
+timings = {{}}
+if {warm_up!r}:
+    from serve import start_warm_up, warm_up_args, warm_up_figures
+
+    started = time.perf_counter()
+    start_warm_up(
+        **warm_up_args({script!r}), after=warm_up_figures({script!r})
+    ).join()
+    timings["warm_up"] = (time.perf_counter() - started) * 1000
+for run in ("first_render", "second_render"):
+    started = time.perf_counter()
+    at = AppTest.from_file({script!r}, default_timeout=120).run()
+    timings[run] = (time.perf_counter() - started) * 1000
+    if at.exception:
+        raise SystemExit(at.exception[0].value)
+print(json.dumps(timings))
+"""
+
+
+def measure(script, warm_up):
+    env = dict(os.environ, WARM_UP="1")
+    code = CHILD.format(
+        root=ROOT,
+        scripts=os.path.join(ROOT, "scripts"),
+        script=os.path.join(ROOT, script),
+        warm_up=warm_up,
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+        env=env,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", nargs="+", default=["app.py", "streamlit_ass.py"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=float(os.environ.get("FIRST_RENDER_TARGET_MS", "1000")),
+        help="median first render allowed with the warm-up on",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(
+        f"{'app':20}{'warm-up':>9}{'warm-up ms':>12}{'first ms':>12}{'second ms':>12}"
+    )
+    missed = []
+    for script in args.apps:
+        for warm_up in (False, True):
+            runs = [measure(script, warm_up) for _ in range(args.repeat)]
+            warm = statistics.median(run.get("warm_up", 0) for run in runs)
+            first = statistics.median(run["first_render"] for run in runs)
+            second = statistics.median(run["second_render"] for run in runs)
+            print(
+                f"{script:20}{'on' if warm_up else 'off':>9}"
+                f"{warm:12.0f}{first:12.0f}{second:12.0f}"
+            )
+            if warm_up and first > args.target_ms:
+                missed.append(script)
+    if missed:
+        print(f"\nOver the {args.target_ms:,.0f} ms target: {', '.join(missed)}")
+        return 1
+    print(f"\nEvery first render is within {args.target_ms:,.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,13 +5,133 @@ Usage:
   - set MONGO_URI environment variable (e.g. mongodb://localhost:27017/)
   - optionally set MONGO_DB and MONGO_COLLECTION, defaults are sales_db and sales
   - run: python scripts/seed_mongo.py
+
+The CSV is read in chunks and written with unordered batched bulk writes, so
+large extracts never have to fit in memory. Modes:
+  - replace (default): drop the existing documents, then insert the file
+  - append: insert the file without touching existing documents
+  - upsert: update-or-insert each row keyed on --key, so reloading a daily
+    file only rewrites the rows it contains. --key must identify one order
+    (e.g. an order id column): the file is checked for repeated keys before
+    anything is written, and the key gets a unique index
+  e.g. python scripts/seed_mongo.py --mode upsert --key order_id \
+         --csv data/sales_2024-06-01.csv
+
+The indexes the dashboards filter on are created on every run.
 """
 
+import argparse
 import os
+import sys
+
+import numpy as np
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from streamlit_utils import close_mongo_clients, get_mongo_client  # noqa: E402
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "data", "sales_sample.csv")
+INDEXED_FIELDS = ("order_date", "region", "category", "customer_segment")
+
+
+def iter_csv_documents(csv_path, chunk_size):
+    """Yield lists of documents, ``chunk_size`` CSV rows at a time."""
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        if "order_date" in chunk.columns:
+            chunk["order_date"] = pd.to_datetime(chunk["order_date"])
+        yield chunk.to_dict(orient="records")
+
+
+def count_duplicate_keys(csv_path, key_fields, chunk_size):
+    """Rows of ``csv_path`` whose ``key_fields`` repeat an earlier row's.
+
+    Only the key columns are read, and each key is kept as a 64-bit hash.
+    """
+    hashes = [
+        pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        for chunk in pd.read_csv(
+            csv_path, usecols=list(key_fields), chunksize=chunk_size
+        )
+    ]
+    if not hashes:
+        return 0
+    hashes = np.concatenate(hashes)
+    return len(hashes) - len(np.unique(hashes))
+
+
+def ensure_indexes(coll, key_fields):
+    for field in INDEXED_FIELDS:
+        coll.create_index(field)
+    if key_fields:
+        # an upsert key that matches several orders would merge them
+        coll.create_index([(field, 1) for field in key_fields], unique=True)
+
 
-def main():
+def seed_collection(coll, csv_path, mode="replace", key_fields=(), chunk_size=10000):
+    """Load ``csv_path`` into ``coll`` chunk by chunk; returns written row count."""
+    from pymongo import UpdateOne
+
+    if mode == "upsert":
+        if not key_fields:
+            raise ValueError("upsert mode needs at least one --key column")
+        duplicates = count_duplicate_keys(csv_path, key_fields, chunk_size)
+        if duplicates:
+            raise ValueError(
+                f"{duplicates:,} rows of {csv_path} repeat the key of an earlier row "
+                f"({', '.join(key_fields)}); upserting would merge them into one "
+                "document. Pass a --key that identifies a single order."
+            )
+
+    if mode == "replace":
+        coll.delete_many({})
+    ensure_indexes(coll, key_fields if mode == "upsert" else ())
+
+    written = 0
+    for docs in iter_csv_documents(csv_path, chunk_size):
+        if not docs:
+            continue
+        if mode == "upsert":
+            ops = [
+                UpdateOne(
+                    {field: doc.get(field) for field in key_fields},
+                    {"$set": doc},
+                    upsert=True,
+                )
+                for doc in docs
+            ]
+            coll.bulk_write(ops, ordered=False)
+        else:
+            coll.insert_many(docs, ordered=False)
+        written += len(docs)
+        print(f"  {written:,} rows written")
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV file to load")
+    parser.add_argument(
+        "--mode", choices=("replace", "append", "upsert"), default="replace"
+    )
+    parser.add_argument(
+        "--key",
+        help="comma-separated columns identifying one order; required by --mode upsert",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="CSV rows per chunk and per bulk write",
+    )
+    args = parser.parse_args(argv)
+    if args.mode == "upsert" and not args.key:
+        parser.error("--mode upsert needs --key, e.g. an order id column")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
     uri = os.environ.get("MONGO_URI")
     if not uri:
         raise SystemExit(
@@ -22,27 +142,37 @@ def main():
     mongo_coll = os.environ.get("MONGO_COLLECTION", "sales")
 
     try:
-        from pymongo import MongoClient
+        import pymongo  # noqa: F401
     except Exception as e:
         raise SystemExit("pymongo not available. Install requirements.txt") from e
 
-    client = MongoClient(uri)
-    db = client[mongo_db]
-    coll = db[mongo_coll]
-
-    csv_path = os.path.join(os.path.dirname(__file__), "..", "data", "sales_sample.csv")
-    df = pd.read_csv(csv_path)
-
-    # Convert to list of dicts and insert
-    docs = df.to_dict(orient="records")
+    try:
+        client = get_mongo_client(uri)
+        if client is None:
+            raise SystemExit(f"Could not reach MongoDB at {uri}")
+        db = client[mongo_db]
+        coll = db[mongo_coll]
 
-    # optional: clear collection first
-    print(
-        f"Seeding collection '{mongo_db}.{mongo_coll}' — dropping existing documents first..."
-    )
-    coll.delete_many({})
-    result = coll.insert_many(docs)
-    print(f"Inserted {len(result.inserted_ids)} documents")
+        key_fields = [
+            field.strip() for field in (args.key or "").split(",") if field.strip()
+        ]
+        if args.mode == "replace":
+            print(
+                f"Seeding collection '{mongo_db}.{mongo_coll}' — dropping existing documents first..."
+            )
+        else:
+            print(
+                f"Seeding collection '{mongo_db}.{mongo_coll}' in {args.mode} mode..."
+            )
+        try:
+            written = seed_collection(
+                coll, args.csv, args.mode, key_fields, args.chunk_size
+            )
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
+        print(f"Wrote {written} documents")
+    finally:
+        close_mongo_clients()
 
 
 if __name__ == "__main__":
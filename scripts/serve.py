@@ -0,0 +1,73 @@
+"""Run a dashboard with its data warmed up before the first visitor.
+
+`streamlit run` only executes an app when a session connects, so the first
+visitor pays for importing the app's modules, loading the data and computing
+every aggregate. This starts the same Streamlit server in-process, after
+starting streamlit_utils.start_warm_up on a background thread: while the
+server boots, it loads the app's default source, runs the pipeline for the
+default filters and builds the figures, so the first session is served from
+the shared caches. WARM_UP=0 turns the warm-up off.
+
+Usage (any `streamlit run` options can follow the app):
+  - python scripts/serve.py app.py
+  - python scripts/serve.py streamlit_ass.py --server.port 8502
+"""
+
+import functools
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+
+from dashboard import RENDERED_FIGURES, figure_stage  # noqa: E402
+from streamlit_utils import pipeline_mode, start_warm_up  # noqa: E402
+
+
+def _flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+def warm_up_args(script):
+    """``start_warm_up`` arguments for the default sidebar state of ``script``."""
+    if os.path.basename(script) == "app.py":
+        return dict(mode="live", source="csv")
+    # streamlit_ass.py reads its defaults from the same variables
+    source = os.environ.get("DATA_SOURCE", "auto").lower()
+    mongo_uri = os.environ.get("MONGO_URI")
+    aggregate_in_db = (
+        _flag("AGGREGATE_IN_DB") and bool(mongo_uri) and source not in ("csv", "engine")
+    )
+    return dict(
+        mode=pipeline_mode(source, _flag("LIVE_REFRESH"), aggregate_in_db),
+        source=source,
+        mongo_uri=mongo_uri,
+        mongo_db=os.environ.get("MONGO_DB"),
+        mongo_collection=os.environ.get("MONGO_COLLECTION"),
+    )
+
+
+def warm_up_figures(script):
+    """Builds the figures ``script`` renders, as ``start_warm_up``'s ``after``."""
+    app = os.path.splitext(os.path.basename(script))[0]
+    return functools.partial(figure_stage, kinds=RENDERED_FIGURES.get(app))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.exit(__doc__)
+    # as the apps' main() does, before the warm-up hands out any views
+    pd.set_option("mode.copy_on_write", True)
+    start_warm_up(**warm_up_args(argv[0]), after=warm_up_figures(argv[0]))
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", *argv]
+    return cli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
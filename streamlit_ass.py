@@ -1,13 +1,36 @@
 import os
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from pathlib import Path
-from typing import Optional
-
+from typing import Any, Dict, Optional
+
+from dashboard import (
+    RENDERED_FIGURES,
+    begin_perf_trace,
+    end_perf_trace,
+    figure_stage,
+    offer_download,
+    render_kpis,
+    render_paged_table,
+)
 from streamlit_utils import (
+    DASHBOARD_COLUMNS,
+    DatasetTooLargeError,
+    DatasetWatcher,
+    diff_edits,
+    editable_frame,
+    export_formats,
     get_dataframe as utils_get_dataframe,
+    get_dataset_watcher,
+    get_filter_options,
+    get_incremental_dataset,
+    get_table_page,
+    invalidate_dataframe_cache,
+    pipeline_mode,
+    run_pipeline,
+    span,
+    write_edits_to_mongo,
     get_mongo_client as utils_get_mongo_client,
+    try_import_duckdb,
     try_import_pymongo as utils_try_import_pymongo,
     load_csv_data as utils_load_csv_data,
 )
@@ -15,17 +38,6 @@ from streamlit_utils import (
 
 st.set_page_config(page_title="Sales Dashboard (Assignment)", layout="wide")
 
-st.title("📊 Sales Performance — extra assignment dashboard")
-
-with st.form("login_form", clear_on_submit=False):
-    username = st.text_input("Enter a display name (optional)")
-    submitted = st.form_submit_button("Continue")
-
-if submitted and username:
-    st.success(f"Hi, {username}! Welcome — filters are on the left.")
-else:
-    st.info("Enter a name (optional) to personalise the dashboard.")
-
 
 try_import_pymongo = utils_try_import_pymongo
 get_mongo_client = utils_get_mongo_client
@@ -38,312 +50,382 @@ DATA_SOURCE = os.environ.get("DATA_SOURCE", "auto").lower()
 MONGO_URI = os.environ.get("MONGO_URI")
 MONGO_DB = os.environ.get("MONGO_DB")
 MONGO_COLLECTION = os.environ.get("MONGO_COLLECTION")
+AGGREGATE_IN_DB = os.environ.get("AGGREGATE_IN_DB", "").lower() in ("1", "true", "yes")
+LIVE_REFRESH = os.environ.get("LIVE_REFRESH", "").lower() in ("1", "true", "yes")
+LIVE_RERUN_INTERVAL = float(os.environ.get("LIVE_RERUN_INTERVAL", "2"))
 
-df = get_dataframe(
-    source=DATA_SOURCE,
-    mongo_uri=MONGO_URI,
-    mongo_db=MONGO_DB,
-    mongo_collection=MONGO_COLLECTION,
-)
 
-# --- Sidebar controls (mirroring your friend's structure) ---
-st.sidebar.header("Filters & Controls")
+@st.fragment
+def login_form() -> None:
+    # a fragment, so submitting the form doesn't rerun the whole dashboard
+    with st.form("login_form", clear_on_submit=False):
+        username = st.text_input("Enter a display name (optional)")
+        submitted = st.form_submit_button("Continue")
+
+    if submitted and username:
+        st.success(f"Hi, {username}! Welcome — filters are on the left.")
+    else:
+        st.info("Enter a name (optional) to personalise the dashboard.")
 
-st.sidebar.markdown(
-    "Choose a data source (auto = MongoDB if MONGO_URI is set, otherwise CSV)"
-)
-source_choice = st.sidebar.selectbox("Data source", ["auto", "csv", "mongo"], index=0)
 
-if source_choice != DATA_SOURCE:
-    # If user explicitly chooses and we can load, reload (informational only — caches will make it cheap)
+def sidebar_controls() -> Dict[str, Any]:
+    """Draw the sidebar and return the chosen source, mode, view and filters."""
+    # --- Sidebar controls (mirroring your friend's structure) ---
+    st.sidebar.header("Filters & Controls")
+
+    st.sidebar.markdown(
+        "Choose a data source (auto = MongoDB if MONGO_URI is set, otherwise CSV; "
+        "engine = DuckDB queries over the local files)"
+    )
+    source_choice = st.sidebar.selectbox(
+        "Data source", ["auto", "csv", "mongo", "engine"], index=0
+    )
+
+    source = DATA_SOURCE
     if source_choice == "csv":
-        df = get_dataframe(source="csv")
+        source = "csv"
     elif source_choice == "mongo":
         if not MONGO_URI:
             st.sidebar.warning(
                 "MONGO_URI not set — continue by setting env var MONGO_URI."
             )
         else:
-            df = get_dataframe(
-                source="mongo",
-                mongo_uri=MONGO_URI,
-                mongo_db=MONGO_DB,
-                mongo_collection=MONGO_COLLECTION,
-            )
+            source = "mongo"
+    elif source_choice == "engine":
+        if not try_import_duckdb():
+            st.sidebar.warning("duckdb is not installed — run pip install duckdb.")
+        else:
+            source = "engine"
 
-view_format = st.sidebar.radio("Select View Format", ["Table View", "JSON View"])
+    aggregate_in_db = (
+        st.sidebar.checkbox(
+            "Aggregate in the database",
+            value=AGGREGATE_IN_DB,
+            help="Compute KPIs and charts with MongoDB aggregation pipelines and only fetch the rows shown below.",
+        )
+        if MONGO_URI and source not in ("csv", "engine")
+        else False
+    )
 
-regions = (
-    st.sidebar.multiselect(
-        "Region",
-        options=sorted(df["region"].unique()),
-        default=sorted(df["region"].unique()),
+    live_refresh = st.sidebar.checkbox(
+        "Live refresh",
+        value=LIVE_REFRESH,
+        help="Keep the data in memory and append new orders as they arrive, instead of re-reading the source on every rerun.",
     )
-    if "region" in df.columns
-    else []
-)
-categories = (
-    st.sidebar.multiselect(
-        "Category",
-        options=sorted(df["category"].unique()),
-        default=sorted(df["category"].unique()),
+
+    source_kwargs = dict(
+        source=source,
+        mongo_uri=MONGO_URI,
+        mongo_db=MONGO_DB,
+        mongo_collection=MONGO_COLLECTION,
     )
-    if "category" in df.columns
-    else []
-)
-segments = (
-    st.sidebar.multiselect(
-        "Customer segment",
-        options=sorted(df["customer_segment"].unique()),
-        default=sorted(df["customer_segment"].unique()),
+
+    # widget choices come from distinct() on MongoDB, so the sidebar can be drawn
+    # before any orders are fetched
+    with span("filter_options"):
+        filter_options = get_filter_options(**source_kwargs)
+
+    view_format = st.sidebar.radio("Select View Format", ["Table View", "JSON View"])
+
+    regions = (
+        st.sidebar.multiselect(
+            "Region",
+            options=filter_options["region"],
+            default=filter_options["region"],
+        )
+        if filter_options["region"]
+        else []
+    )
+    categories = (
+        st.sidebar.multiselect(
+            "Category",
+            options=filter_options["category"],
+            default=filter_options["category"],
+        )
+        if filter_options["category"]
+        else []
+    )
+    segments = (
+        st.sidebar.multiselect(
+            "Customer segment",
+            options=filter_options["customer_segment"],
+            default=filter_options["customer_segment"],
+        )
+        if filter_options["customer_segment"]
+        else []
     )
-    if "customer_segment" in df.columns
-    else []
-)
 
-min_date = df["order_date"].min().date() if "order_date" in df.columns else None
-max_date = df["order_date"].max().date() if "order_date" in df.columns else None
-date_range = (
-    st.sidebar.date_input(
-        "Order date range",
-        value=(min_date, max_date) if min_date and max_date else None,
-        min_value=min_date,
-        max_value=max_date,
+    date_bounds = filter_options["order_date"]
+    min_date = date_bounds[0].date() if date_bounds else None
+    max_date = date_bounds[1].date() if date_bounds else None
+    date_range = (
+        st.sidebar.date_input(
+            "Order date range",
+            value=(min_date, max_date) if min_date and max_date else None,
+            min_value=min_date,
+            max_value=max_date,
+        )
+        if min_date and max_date
+        else None
     )
-    if min_date and max_date
-    else None
-)
 
-st.sidebar.markdown("---")
-download_all = st.sidebar.button("Download full dataset")
-
-# Apply filters
-filtered = df.copy()
-if regions and "region" in filtered.columns:
-    filtered = filtered[filtered["region"].isin(regions)]
-if categories and "category" in filtered.columns:
-    filtered = filtered[filtered["category"].isin(categories)]
-if segments and "customer_segment" in filtered.columns:
-    filtered = filtered[filtered["customer_segment"].isin(segments)]
-if (
-    date_range
-    and isinstance(date_range, tuple)
-    and len(date_range) == 2
-    and "order_date" in filtered.columns
-):
-    start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
-    filtered = filtered[filtered["order_date"].between(start, end)]
-
-if filtered.empty:
-    st.warning("No records match your filters — adjust controls in the sidebar.")
-
-# --- KPIs ---
-st.subheader("Key Performance Indicators")
-col1, col2, col3, col4 = st.columns(4)
-total_sales = (
-    float(filtered["sales"].sum())
-    if not filtered.empty and "sales" in filtered.columns
-    else 0.0
-)
-total_profit = (
-    float(filtered["profit"].sum())
-    if not filtered.empty and "profit" in filtered.columns
-    else 0.0
-)
-avg_margin = (total_profit / total_sales * 100) if total_sales else 0.0
-avg_order = (
-    filtered["sales"].mean()
-    if not filtered.empty and "sales" in filtered.columns
-    else 0.0
-)
+    st.sidebar.markdown("---")
+    download_all = st.sidebar.button("Download full dataset")
+
+    return {
+        "source_choice": source_choice,
+        "source_kwargs": source_kwargs,
+        "mode": pipeline_mode(source, live_refresh, aggregate_in_db),
+        "json_view": view_format != "Table View",
+        "download_all": download_all,
+        "filters": {
+            "region": regions,
+            "category": categories,
+            "customer_segment": segments,
+            "order_date": (
+                date_range
+                if isinstance(date_range, tuple) and len(date_range) == 2
+                else None
+            ),
+        },
+    }
+
+
+def render_live_status(watcher: DatasetWatcher, rendered_generation: int) -> None:
+    @st.fragment(run_every=LIVE_RERUN_INTERVAL)
+    def live_status() -> None:
+        # cheap check of an in-memory counter; a burst of inserts moves it once
+        if watcher.generation != rendered_generation:
+            st.rerun()
+        updated = (
+            pd.Timestamp.fromtimestamp(watcher.last_change).strftime("%H:%M:%S")
+            if watcher.last_change
+            else "—"
+        )
+        st.caption(
+            f"Live: {len(watcher.dataset.frame):,} rows via {watcher.mode}, last change {updated}"
+        )
 
-col1.metric("Total sales", f"${total_sales:,.0f}")
-col2.metric("Total profit", f"${total_profit:,.0f}")
-col3.metric("Avg margin", f"{avg_margin:.1f}%")
-col4.metric("Avg order", f"${avg_order:,.0f}")
+    live_status()
 
-st.divider()
 
-# --- Raw Data View ---
-st.subheader("📂 Raw Data View")
-if view_format == "Table View":
-    st.dataframe(filtered.head(50), use_container_width=True)
-else:
-    st.json(filtered.head(50).to_dict(orient="records"))
+def render_raw_data(controls: Dict[str, Any]) -> None:
+    mode, filters = controls["mode"], controls["filters"]
+    source_kwargs = controls["source_kwargs"]
 
-    # Data editor for on-the-fly edits (in-memory only)
-    if not filtered.empty:
-        st.subheader("📝 Edit filtered rows (in-memory)")
-        original_subset = filtered.reset_index(drop=True).head(20)
-        edited = st.data_editor(
-            original_subset,
-            num_rows="dynamic",
-            use_container_width=True,
+    def fetch(
+        page: int, page_size: int, sort_by: str, ascending: bool, search: Optional[str]
+    ):
+        # only one page is fetched: sort/skip/limit on MongoDB, a kept sort order otherwise
+        if mode == "live":
+            dataset = get_incremental_dataset(**source_kwargs)
+            return dataset.table.page(
+                page, page_size, sort_by, ascending, filters, search
+            )
+        return get_table_page(
+            filters=filters,
+            page=page,
+            page_size=page_size,
+            sort_by=sort_by,
+            ascending=ascending,
+            search=search,
+            **source_kwargs,
         )
 
-        if not edited.equals(original_subset):
-            st.info(
-                "Local edits detected — you can keep them in-memory or persist to the DB (when available)."
-            )
+    st.subheader("📂 Raw Data View")
+    render_paged_table(fetch, key="raw_page", json_view=controls["json_view"])
 
-            # Persist back to MongoDB if possible
-            mongo_client = (
-                get_mongo_client(MONGO_URI)
-                if MONGO_URI and try_import_pymongo()
-                else None
-            )
 
-            if mongo_client and source_choice in ("auto", "mongo"):
-                st.warning(
-                    "A MongoDB connection is available. You can persist these edited rows back to the collection."
-                )
-                persist = st.checkbox("Enable write-back to MongoDB for these edits")
-
-                if persist:
-                    confirm = st.button("Save edits to MongoDB")
-                    if confirm:
-                        # run update for each changed row
-                        from bson import ObjectId  # type: ignore
-
-                        db_name = MONGO_DB or os.environ.get("MONGO_DB", "sales_db")
-                        coll_name = MONGO_COLLECTION or os.environ.get(
-                            "MONGO_COLLECTION", "sales"
-                        )
-                        coll = mongo_client[db_name][coll_name]
-
-                        updates = 0
-                        for idx, row in edited.iterrows():
-                            orig = original_subset.iloc[idx].to_dict()
-                            new = row.to_dict()
-
-                            # identify _id field
-                            if "_id" not in new or not new.get("_id"):
-                                st.error(
-                                    "No _id available for row — cannot persist row to MongoDB (missing _id)."
-                                )
-                                continue
-
-                            _id_str = str(new["_id"])
-                            try:
-                                oid = ObjectId(_id_str)
-                            except Exception:
-                                st.error(
-                                    f"_id {_id_str} is not a valid ObjectId; skipping row."
-                                )
-                                continue
-
-                            # compute changed fields and prepare update payload
-                            changed = {}
-                            for k, v in new.items():
-                                if k == "_id":
-                                    continue
-                                orig_v = orig.get(k)
-                                # pandas timestamps -> python datetime for Mongo
-                                if hasattr(v, "to_pydatetime"):
-                                    v_to_store = v.to_pydatetime()
-                                else:
-                                    v_to_store = v
-
-                                if pd.isna(v_to_store) and pd.isna(orig_v):
-                                    continue
-                                if v_to_store != orig_v:
-                                    changed[k] = v_to_store
-
-                            if changed:
-                                result = coll.update_one(
-                                    {"_id": oid}, {"$set": changed}
-                                )
-                                if result.modified_count > 0:
-                                    updates += 1
-
-                        st.success(
-                            f"Persisted {updates} row(s) to {db_name}.{coll_name}"
-                        )
-            else:
-                st.info(
-                    "No MongoDB client available (or not selected). Edits remain in-memory only."
-                )
-
-st.divider()
-
-# --- Advanced visualizations in tabs ---
-st.subheader("📊 Visual Analysis")
-tab1, tab2, tab3 = st.tabs(
-    ["Sales Trend", "Category / Subcategory", "Profit by Segment"]
-)
+def render_editor(filtered: pd.DataFrame, source_choice: str) -> None:
+    # Data editor for on-the-fly edits (in-memory only)
+    if filtered.empty:
+        return
+    st.subheader("📝 Edit filtered rows (in-memory)")
+    original_subset = editable_frame(filtered.reset_index(drop=True).head(20))
+    edited = st.data_editor(
+        original_subset,
+        num_rows="dynamic",
+        use_container_width=True,
+    )
 
-with tab1:
-    st.markdown("### Sales over time")
-    if not filtered.empty and "order_date" in filtered.columns:
-        sales_trend = filtered.groupby("order_date", as_index=False)["sales"].sum()
-        fig = px.line(
-            sales_trend,
-            x="order_date",
-            y="sales",
-            title="Daily sales trend",
-            markers=True,
-        )
-        st.plotly_chart(fig, use_container_width=True)
-    else:
-        st.info("No data to chart.")
+    if edited.equals(original_subset):
+        return
+    st.info(
+        "Local edits detected — you can keep them in-memory or persist to the DB (when available)."
+    )
+
+    # Persist back to MongoDB if possible
+    mongo_client = (
+        get_mongo_client(MONGO_URI) if MONGO_URI and try_import_pymongo() else None
+    )
 
-with tab2:
-    st.markdown("### Sales by Category & Subcategory")
-    if not filtered.empty and "category" in filtered.columns:
-        cat = (
-            filtered.groupby(["category", "subcategory"], as_index=False)["sales"].sum()
-            if "subcategory" in filtered.columns
-            else filtered.groupby(["category"], as_index=False)["sales"].sum()
+    if not (mongo_client and source_choice in ("auto", "mongo")):
+        st.info(
+            "No MongoDB client available (or not selected). Edits remain in-memory only."
         )
-        fig = px.bar(
-            cat,
-            x=cat.columns[0],
-            y="sales",
-            color="category" if "subcategory" in cat.columns else None,
-            title="Sales by subcategory",
+        return
+    st.warning(
+        "A MongoDB connection is available. You can persist these edited rows back to the collection."
+    )
+    persist = st.checkbox("Enable write-back to MongoDB for these edits")
+
+    if persist and st.button("Save edits to MongoDB"):
+        db_name = MONGO_DB or os.environ.get("MONGO_DB", "sales_db")
+        coll_name = MONGO_COLLECTION or os.environ.get("MONGO_COLLECTION", "sales")
+        coll = mongo_client[db_name][coll_name]
+
+        # one bulk_write for every changed, added or removed row
+        outcomes = pd.DataFrame(
+            write_edits_to_mongo(coll, diff_edits(original_subset, edited)),
+            columns=["row", "action", "_id", "status", "detail"],
         )
-        st.plotly_chart(fig, use_container_width=True)
-    else:
+        persisted = outcomes[outcomes["status"] == "ok"]
+        problems = outcomes[outcomes["status"] != "ok"]
+
+        if not persisted.empty:
+            # in-place updates don't move the _id watermark
+            invalidate_dataframe_cache()
+        st.success(f"Persisted {len(persisted)} row(s) to {db_name}.{coll_name}")
+        if not problems.empty:
+            st.error(f"{len(problems)} row(s) were not persisted.")
+            st.dataframe(problems, use_container_width=True)
+
+
+def render_charts(pipeline: Dict[str, Any]) -> None:
+    # --- Advanced visualizations in tabs ---
+    st.subheader("📊 Visual Analysis")
+    if pipeline["summary"]["row_count"] == 0:
         st.info("No data to chart.")
+        return
+    figures = figure_stage(pipeline, RENDERED_FIGURES["streamlit_ass"])
+    tab1, tab2, tab3 = st.tabs(
+        ["Sales Trend", "Category / Subcategory", "Profit by Segment"]
+    )
+    with tab1, span("trend_chart"):
+        st.markdown("### Sales over time")
+        # bounded to TREND_MAX_POINTS points, coarsening to weeks/months if needed
+        st.plotly_chart(figures["trend"], use_container_width=True)
+    with tab2, span("category_chart"):
+        st.markdown("### Sales by Category & Subcategory")
+        st.plotly_chart(figures["subcategory"], use_container_width=True)
+    with tab3, span("segment_chart"):
+        st.markdown("### Profit contribution by customer segment")
+        st.plotly_chart(figures["segment"], use_container_width=True)
+
+
+def render_downloads(controls: Dict[str, Any], pipeline: Dict[str, Any]) -> None:
+    # --- Download buttons ---
+    st.subheader("📥 Download")
+    mode, filters = controls["mode"], controls["filters"]
+    source_kwargs = controls["source_kwargs"]
+    # files are only built on request, then reused for the same data and filters
+    export_format = st.selectbox("File format", export_formats())
+
+    def load_full() -> pd.DataFrame:
+        if mode == "live":
+            return get_incremental_dataset(**source_kwargs).snapshot.view()
+        return get_dataframe(**source_kwargs)
+
+    def load_filtered() -> pd.DataFrame:
+        if mode == "aggregate":
+            # the pipeline only loaded a preview of the rows
+            return get_dataframe(
+                filters=filters, columns=list(DASHBOARD_COLUMNS), **source_kwargs
+            )
+        return pipeline["rows"]
+
+    if controls["download_all"]:
+        offer_download(
+            "Download full dataset",
+            "sales_sample",
+            "full",
+            pipeline["version"],
+            None,
+            export_format,
+            load_full,
+        )
 
-with tab3:
-    st.markdown("### Profit contribution by customer segment")
-    if (
-        not filtered.empty
-        and "customer_segment" in filtered.columns
-        and "profit" in filtered.columns
-    ):
-        seg = filtered.groupby("customer_segment", as_index=False)["profit"].sum()
-        fig = px.pie(
-            seg,
-            names="customer_segment",
-            values="profit",
-            title="Profit contribution",
-            hole=0.4,
+    if st.button("Prepare filtered data"):
+        offer_download(
+            "Download filtered data",
+            "filtered_sales",
+            "filtered",
+            pipeline["version"],
+            filters,
+            export_format,
+            load_filtered,
         )
-        st.plotly_chart(fig, use_container_width=True)
-    else:
-        st.info("No data to chart.")
 
-st.divider()
 
-# --- Download buttons ---
-st.subheader("📥 Download")
-if download_all:
-    st.download_button(
-        "Download full dataset",
-        data=df.to_csv(index=False).encode("utf-8"),
-        file_name="sales_sample.csv",
-        mime="text/csv",
+def render_dashboard() -> None:
+    controls = sidebar_controls()
+    mode = controls["mode"]
+    if mode == "live":
+        # a background watcher appends new orders to the shared dataset
+        watcher = get_dataset_watcher(**controls["source_kwargs"])
+        rendered_generation = watcher.generation
+
+    # load → aggregate → chart data; stages whose inputs are unchanged are
+    # served from cache
+    load_status = st.empty()
+    try:
+        pipeline = run_pipeline(
+            controls["filters"],
+            mode,
+            progress=lambda rows: load_status.caption(f"Loaded {rows:,} rows…"),
+            **controls["source_kwargs"],
+        )
+    except DatasetTooLargeError as exc:
+        st.error(str(exc))
+        st.stop()
+    load_status.empty()
+    summary = pipeline["summary"]
+
+    if summary["row_count"] == 0:
+        st.warning("No records match your filters — adjust controls in the sidebar.")
+
+    # --- KPIs ---
+    st.subheader("Key Performance Indicators")
+    if mode == "live":
+        render_live_status(watcher, rendered_generation)
+    with span("render_kpis"):
+        render_kpis(summary)
+
+    st.divider()
+
+    # --- Raw Data View ---
+    render_raw_data(controls)
+    if controls["json_view"]:
+        render_editor(pipeline["rows"], controls["source_choice"])
+
+    st.divider()
+    with span("render_charts"):
+        render_charts(pipeline)
+
+    st.divider()
+    render_downloads(controls, pipeline)
+
+
+def main() -> None:
+    # Frames derived from the shared datasets (shallow copies, column subsets)
+    # then copy a column only when it is written to, so sessions read them
+    # without copying and without being able to change them.
+    pd.set_option("mode.copy_on_write", True)
+    st.title("📊 Sales Performance — extra assignment dashboard")
+    login_form()
+
+    # time each stage of this rerun; the toggle is drawn at the end of the sidebar
+    show_perf = begin_perf_trace("streamlit_ass")
+    try:
+        render_dashboard()
+    finally:
+        st.sidebar.markdown("---")
+        end_perf_trace(show_perf)
+
+    st.caption(
+        "This file follows the structure of the example you shared but supports an optional MongoDB backend via MONGO_URI and keeps a CSV fallback so it works out-of-the-box."
     )
 
-st.download_button(
-    "Download filtered data",
-    data=filtered.to_csv(index=False).encode("utf-8"),
-    file_name="filtered_sales.csv",
-    mime="text/csv",
-)
 
-st.caption(
-    "This file follows the structure of the example you shared but supports an optional MongoDB backend via MONGO_URI and keeps a CSV fallback so it works out-of-the-box."
-)
+if __name__ == "__main__":
+    main()
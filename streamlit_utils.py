@@ -1,11 +1,187 @@
+import atexit
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
 import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+# A CSV file, or a directory of date-partitioned CSV files (see csv_partitions).
+DATA_PATH = Path(
+    os.environ.get("DATA_PATH") or Path(__file__).parent / "data" / "sales_sample.csv"
+)
 
-DATA_PATH = Path(__file__).parent / "data" / "sales_sample.csv"
+# Columns the dashboards read; anything else stored alongside the orders stays
+# in the database.
+DASHBOARD_COLUMNS = (
+    "order_date",
+    "region",
+    "category",
+    "subcategory",
+    "sales",
+    "quantity",
+    "profit",
+    "customer_segment",
+)
+# Sidebar multiselect dimensions, in display order.
+FILTER_DIMENSIONS = ("region", "category", "customer_segment")
+# Added by ensure_datetime on load; never written back to the source.
+DERIVED_COLUMNS = ("month", "year")
+# Declared dtypes of a loaded sales frame. "category" columns hold the few
+# distinct dimension values as integer codes; "integer" measures are downcast
+# to the smallest integer type that holds them (see normalize_sales_frame).
+SALES_SCHEMA: Dict[str, str] = {
+    "order_date": "datetime64[ns]",
+    "region": "category",
+    "category": "category",
+    "subcategory": "category",
+    "customer_segment": "category",
+    "sales": "integer",
+    "quantity": "integer",
+    "profit": "integer",
+    "month": "datetime64[ns]",
+    "year": "int16",
+}
+CATEGORICAL_COLUMNS = tuple(c for c, t in SALES_SCHEMA.items() if t == "category")
+
+
+PERF_LOGGER = logging.getLogger("streamlit_utils.perf")
+_PERF = threading.local()
+
+
+class Span:
+    """One timed stage of a ``PerfTrace``; use as a context manager.
+
+    Extra fields (``rows``, ``bytes``, anything JSON-friendly) can be set with
+    ``span["key"] = value`` or taken from a result with ``measure``.
+    """
+
+    __slots__ = ("trace", "name", "fields", "started")
+
+    def __init__(self, trace: "PerfTrace", name: str, fields: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.fields = fields
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.fields[key] = value
+
+    def measure(self, value: Any) -> Any:
+        """Record the row count and in-memory size of ``value``, then return it."""
+        if isinstance(value, pd.DataFrame):
+            self.fields["rows"] = len(value)
+            self.fields["bytes"] = int(value.memory_usage(deep=False).sum())
+        elif isinstance(value, (bytes, bytearray)):
+            self.fields["bytes"] = len(value)
+        return value
+
+    def __enter__(self) -> "Span":
+        self.trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.trace.depth -= 1
+        self.trace.records.append(
+            {
+                "stage": self.name,
+                "ms": elapsed,
+                "depth": self.trace.depth,
+                "start_ms": (self.started - self.trace.started) * 1000,
+                **self.fields,
+            }
+        )
+        return False
+
+
+class _NullSpan:
+    """What ``span`` returns when no trace is active: does nothing, costs nothing."""
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        pass
+
+    def measure(self, value: Any) -> Any:
+        return value
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class PerfTrace:
+    """The spans recorded on one thread (one Streamlit rerun) between
+    ``start_trace`` and ``stop_trace``."""
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.records: List[Dict[str, Any]] = []
+        self.depth = 0
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+
+    def frame(self) -> pd.DataFrame:
+        """Spans in start order, nested stages indented under their parent."""
+        df = pd.DataFrame(self.records)
+        if df.empty:
+            return pd.DataFrame(columns=["stage", "ms", "rows", "bytes"])
+        df = df.sort_values("start_ms", kind="stable", ignore_index=True)
+        df["stage"] = [
+            "  " * depth + stage for depth, stage in zip(df["depth"], df["stage"])
+        ]
+        return df.drop(columns=["depth", "start_ms"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trace": self.label, "total_ms": self.total_ms, "spans": self.records}
+
+
+def perf_logging_enabled() -> bool:
+    return os.environ.get("PERF_LOG", "").lower() in ("1", "true", "yes")
+
+
+def start_trace(label: str = "rerun") -> PerfTrace:
+    """Start recording ``span``s made on this thread."""
+    trace = _PERF.trace = PerfTrace(label)
+    return trace
+
+
+def stop_trace() -> Optional[PerfTrace]:
+    """Stop recording; the trace is logged as one JSON line when ``PERF_LOG`` is set."""
+    trace = getattr(_PERF, "trace", None)
+    _PERF.trace = None
+    if trace is not None:
+        trace.total_ms = (time.perf_counter() - trace.started) * 1000
+        if perf_logging_enabled():
+            PERF_LOGGER.info(json.dumps(trace.to_dict(), default=str))
+    return trace
+
+
+def span(name: str, **fields: Any):
+    """Time a stage of the current trace: ``with span("filter") as s: ...``.
+
+    Without an active trace this returns a shared no-op, so instrumented code
+    pays one attribute lookup.
+    """
+    trace = getattr(_PERF, "trace", None)
+    if trace is None:
+        return _NULL_SPAN
+    return Span(trace, name, fields)
 
 
 def ensure_datetime(df: pd.DataFrame) -> pd.DataFrame:
@@ -16,9 +192,401 @@ def ensure_datetime(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def load_csv_data() -> pd.DataFrame:
-    df = pd.read_csv(DATA_PATH)
-    return ensure_datetime(df)
+def _downcast_integer(values: pd.Series) -> pd.Series:
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.isna().any() or not (numeric == numeric.round()).all():
+        # gaps or fractions: keep full float precision for the KPI totals
+        return numeric.astype("float64")
+    return pd.to_numeric(numeric.astype("int64"), downcast="integer")
+
+
+def normalize_sales_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Coerce the columns present in ``df`` to ``SALES_SCHEMA`` in place.
+
+    Columns outside the schema (``_id``, extra Mongo fields) are left alone.
+    Integer measures may end up as int8/16/32; aggregate them with ``sum_by``
+    (or ``Series.sum``), which accumulate in 64 bits.
+    """
+    for column, kind in SALES_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if kind == "category":
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[column] = values.astype("category")
+        elif kind == "integer":
+            if not pd.api.types.is_integer_dtype(values) or values.dtype.itemsize > 4:
+                df[column] = _downcast_integer(values)
+        elif values.dtype != kind:
+            df[column] = values.astype(kind)
+    return df
+
+
+def schema_violations(df: pd.DataFrame) -> Dict[str, str]:
+    """Columns whose dtype does not match ``SALES_SCHEMA``, with the actual dtype."""
+    problems = {}
+    for column, kind in SALES_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        dtype = df[column].dtype
+        if kind == "category":
+            ok = isinstance(dtype, pd.CategoricalDtype)
+        elif kind == "integer":
+            ok = pd.api.types.is_integer_dtype(dtype) or dtype == "float64"
+        else:
+            ok = dtype == kind
+        if not ok:
+            problems[column] = str(dtype)
+    return problems
+
+
+def concat_sales_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """``pd.concat`` that keeps categorical columns categorical.
+
+    Plain ``concat`` falls back to object dtype when the chunks' categories
+    differ, e.g. when appended rows bring a new region; here the categories
+    are unioned instead.
+    """
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in CATEGORICAL_COLUMNS:
+        if not all(
+            column in frame.columns
+            and isinstance(frame[column].dtype, pd.CategoricalDtype)
+            for frame in frames
+        ):
+            continue
+        # sorted, like a fresh astype("category"), so groupby order matches
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.union(frame[column].cat.categories)
+        for frame in frames:
+            if not frame[column].cat.categories.equals(categories):
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def sum_by(df: pd.DataFrame, keys: List[str], measure: str) -> pd.DataFrame:
+    """``groupby(keys)[measure].sum()`` as a frame, summing integers in int64.
+
+    pandas keeps int32 for grouped sums, which would overflow on downcast
+    measures, and would emit empty groups for unused categories.
+    """
+    values = df[measure]
+    if pd.api.types.is_integer_dtype(values):
+        values = values.astype("int64")
+    return values.groupby([df[key] for key in keys], observed=True).sum().reset_index()
+
+
+def load_csv_data(
+    columns: Optional[Iterable[str]] = None,
+    date_range: Optional[Tuple[Any, Any]] = None,
+) -> pd.DataFrame:
+    """Load the sales CSV, preferring its memory-mapped columnar cache.
+
+    When the cache is missing or older than the CSV, the CSV is parsed and the
+    cache rewritten for the next cold start. ``columns`` limits the read to
+    those columns (plus ``month``/``year`` where derivable).
+
+    When ``DATA_PATH`` is a directory of date-partitioned files, only the
+    partitions that may hold rows in ``date_range`` are read (see
+    ``csv_partitions``); rows are not filtered further.
+    """
+    if DATA_PATH.is_dir():
+        return read_csv_partitions(csv_partitions(date_range), columns)
+    if _columnar_cache_enabled():
+        with span("load_columnar") as timing:
+            df = timing.measure(load_columnar_data(columns))
+        if df is not None:
+            return df
+
+    with span("parse_csv") as timing:
+        df = timing.measure(pd.read_csv(DATA_PATH))
+    with span("normalize"):
+        df = normalize_sales_frame(ensure_datetime(df))
+    if _columnar_cache_enabled():
+        write_columnar_cache(df)
+    if columns:
+        df = df[_with_derived(df.columns, columns)]
+    return df
+
+
+def _with_derived(available: Iterable[str], columns: Iterable[str]) -> List[str]:
+    wanted = set(columns)
+    if "order_date" in wanted:
+        wanted.update(DERIVED_COLUMNS)
+    return [c for c in available if c in wanted]
+
+
+CSV_PARTITION_PATTERNS = ("*.csv", "*.csv.gz")
+# A year, year-month or date in a partition's file name, e.g. sales_2024-06.csv
+_PARTITION_DATE = re.compile(r"(?<!\d)((?:19|20)\d{2})(?:-(\d{2})(?:-(\d{2}))?)?(?!\d)")
+
+
+def partition_date_range(path: Path) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """First and last day a partition file can hold, from the date in its name.
+
+    ``sales_2024-06-01.csv`` holds one day, ``sales_2024-06.csv`` a month and
+    ``2024.csv`` a year. Returns ``None`` for names without a valid date.
+    """
+    match = _PARTITION_DATE.search(path.name)
+    if not match:
+        return None
+    year, month, day = match.groups()
+    try:
+        start = pd.Timestamp(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return None
+    if day:
+        return start, start
+    if month:
+        return start, start + pd.offsets.MonthEnd(0)
+    return start, start + pd.offsets.YearEnd(0)
+
+
+def prune_partitions(
+    paths: List[Path], date_range: Optional[Tuple[Any, Any]] = None
+) -> List[Path]:
+    """The ``paths`` whose name dates may hold rows in ``date_range``.
+
+    Files without a date in their name (see ``partition_date_range``) are
+    always kept.
+    """
+    if not date_range or len(date_range) != 2:
+        return list(paths)
+    start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+    kept = []
+    for path in paths:
+        bounds = partition_date_range(path)
+        if bounds is None or (bounds[0] <= end and bounds[1] >= start.normalize()):
+            kept.append(path)
+    return kept
+
+
+def csv_partitions(date_range: Optional[Tuple[Any, Any]] = None) -> List[Path]:
+    """The CSV files behind ``DATA_PATH`` that may hold rows in ``date_range``.
+
+    A single file is returned as is; a directory's partitions are pruned
+    with ``prune_partitions``.
+    """
+    if not DATA_PATH.is_dir():
+        return [DATA_PATH]
+    paths = sorted(
+        path for pattern in CSV_PARTITION_PATTERNS for path in DATA_PATH.glob(pattern)
+    )
+    return prune_partitions(paths, date_range)
+
+
+_CSV_POOL = None
+_CSV_POOL_LOCK = threading.Lock()
+
+
+def csv_workers() -> int:
+    """Processes used to parse partitions (``CSV_WORKERS``, default: all cores)."""
+    return int(os.environ.get("CSV_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def _csv_pool():
+    global _CSV_POOL
+    with _CSV_POOL_LOCK:
+        if _CSV_POOL is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # forked workers could inherit locks held by the app's threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            _CSV_POOL = ProcessPoolExecutor(csv_workers(), mp_context=context)
+        return _CSV_POOL
+
+
+def shutdown_csv_pool() -> None:
+    global _CSV_POOL
+    with _CSV_POOL_LOCK:
+        pool, _CSV_POOL = _CSV_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_csv_pool)
+
+
+def _map_partitions(fn: Callable[..., Any], paths: List[Path], *args: Any) -> List[Any]:
+    """``fn(path, *args)`` for every partition, on the process pool if it pays off.
+
+    Small reads (under ``CSV_PARALLEL_MIN_MB`` in total, default 4) stay in
+    this process, as does everything when the pool cannot be used.
+    """
+    names = [str(path) for path in paths]
+    min_bytes = float(os.environ.get("CSV_PARALLEL_MIN_MB", "4")) * 2**20
+    if len(names) > 1 and csv_workers() > 1:
+        if sum(path.stat().st_size for path in paths) >= min_bytes:
+            from concurrent.futures.process import BrokenProcessPool
+
+            # only pool failures fall back to this process; a partition that
+            # fails to parse raises its own error from the worker
+            try:
+                results = _csv_pool().map(
+                    fn, names, *[[arg] * len(names) for arg in args]
+                )
+            except (BrokenProcessPool, OSError):
+                # e.g. no permission to start processes
+                shutdown_csv_pool()
+            else:
+                try:
+                    return list(results)
+                except BrokenProcessPool:
+                    # a worker died
+                    shutdown_csv_pool()
+    return [fn(name, *args) for name in names]
+
+
+def _parse_partition(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    wanted = set(columns) if columns else None
+    df = pd.read_csv(path, usecols=(lambda c: c in wanted) if wanted else None)
+    return normalize_sales_frame(ensure_datetime(df))
+
+
+def read_csv_partitions(
+    paths: List[Path], columns: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """Parse and normalise CSV partitions, in parallel on a process pool."""
+    wanted = list(columns) if columns else None
+    with span("parse_partitions", files=len(paths)) as timing:
+        frames = _map_partitions(_parse_partition, paths, wanted)
+        if not frames:
+            empty = pd.DataFrame(columns=wanted or list(DASHBOARD_COLUMNS))
+            frames = [normalize_sales_frame(ensure_datetime(empty))]
+        df = timing.measure(concat_sales_frames(frames))
+    # concatenated measures take the widest partition's type
+    return normalize_sales_frame(df)
+
+
+def _partition_filter_options(path: str) -> Dict[str, Any]:
+    df = pd.read_csv(
+        path,
+        usecols=lambda column: column in FILTER_DIMENSIONS or column == "order_date",
+        parse_dates=["order_date"],
+    )
+    return filter_options_from_frame(df)
+
+
+def partition_filter_options(paths: List[Path]) -> Dict[str, Any]:
+    """``filter_options_from_frame`` over partitions, each summarised in a worker.
+
+    Only the distinct values and date bounds travel back, not the rows.
+    """
+    parts = _map_partitions(_partition_filter_options, paths)
+    options: Dict[str, Any] = {
+        column: sorted({value for part in parts for value in part[column]})
+        for column in FILTER_DIMENSIONS
+    }
+    bounds = [part["order_date"] for part in parts if part["order_date"]]
+    options["order_date"] = (
+        (min(b[0] for b in bounds), max(b[1] for b in bounds)) if bounds else None
+    )
+    return options
+
+
+def try_import_pyarrow():
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.feather  # type: ignore  # noqa: F401
+
+        return pyarrow
+    except Exception:
+        return None
+
+
+def _columnar_cache_enabled() -> bool:
+    return os.environ.get("COLUMNAR_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def columnar_cache_path() -> Path:
+    return DATA_PATH.parent / ".cache" / f"{DATA_PATH.stem}.feather"
+
+
+def _csv_fingerprint() -> Dict[str, Any]:
+    stat = DATA_PATH.stat()
+    return {
+        "source": DATA_PATH.name,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        # caches written under an older SALES_SCHEMA are rebuilt
+        "schema": SALES_SCHEMA,
+    }
+
+
+def write_columnar_cache(df: Optional[pd.DataFrame] = None) -> Optional[Path]:
+    """Write the typed columnar (Feather/Arrow IPC) copy of ``DATA_PATH``.
+
+    The file is uncompressed so it can be memory-mapped, keeps categorical
+    dimensions, the parsed ``order_date`` and the precomputed ``month``/``year``
+    columns, and records the CSV's mtime and size to detect staleness.
+    Returns the cache path, or ``None`` when pyarrow is missing, ``DATA_PATH``
+    is a partition directory or the write fails (e.g. read-only data directory).
+    """
+    pa = try_import_pyarrow()
+    if not pa or DATA_PATH.is_dir():
+        return None
+    from pyarrow import feather  # type: ignore
+
+    tmp_path = None
+    try:
+        fingerprint = _csv_fingerprint()
+        if df is None:
+            df = normalize_sales_frame(ensure_datetime(pd.read_csv(DATA_PATH)))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"sales_source"] = json.dumps(fingerprint).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+
+        path = columnar_cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a file of its own per writer: sessions are threads of one process
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as tmp:
+            tmp_path = tmp.name
+            feather.write_feather(table, tmp, compression="uncompressed")
+        # atomic swap so concurrent workers never map a half-written file
+        os.replace(tmp_path, path)
+        return path
+    except Exception:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+def load_columnar_data(
+    columns: Optional[Iterable[str]] = None,
+) -> Optional[pd.DataFrame]:
+    """Memory-map the columnar cache and read only ``columns``.
+
+    Returns ``None`` if there is no usable cache or it was built from an older
+    version of the CSV.
+    """
+    pa = try_import_pyarrow()
+    path = columnar_cache_path()
+    if not pa or not path.exists():
+        return None
+    from pyarrow import feather  # type: ignore
+
+    try:
+        with pa.memory_map(str(path)) as source:
+            schema = pa.ipc.open_file(source).schema
+        stored = json.loads((schema.metadata or {}).get(b"sales_source", b"{}"))
+        if stored != _csv_fingerprint():
+            return None
+        selected = _with_derived(schema.names, columns) if columns else None
+        table = feather.read_table(str(path), columns=selected, memory_map=True)
+        return table.to_pandas()
+    except Exception:
+        return None
 
 
 def try_import_pymongo():
@@ -30,50 +598,2722 @@ def try_import_pymongo():
         return None
 
 
-def get_mongo_client(uri: str):
+_MONGO_CLIENTS: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], Any] = {}
+_MONGO_LAST_PING: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], float] = {}
+_MONGO_CLIENTS_LOCK = threading.Lock()
+
+
+def mongo_client_options(**overrides: Any) -> Dict[str, Any]:
+    """Connection pool settings, read from the environment unless overridden."""
+    options: Dict[str, Any] = {
+        "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "20")),
+        "serverSelectionTimeoutMS": int(
+            os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000")
+        ),
+        "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "3000")),
+    }
+    options.update(overrides)
+    return options
+
+
+def _create_mongo_client(uri: str, **options: Any):
+    from pymongo import MongoClient  # type: ignore
+
+    return MongoClient(uri, **options)
+
+
+def ping_mongo_client(client) -> bool:
+    try:
+        client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+def get_mongo_client(
+    uri: str, check: bool = True, ping_interval: float = 30.0, **options: Any
+):
+    """Return the process-wide client for ``uri``, creating it on first use.
+
+    One client (and therefore one connection pool) is kept per URI and option
+    set. With ``check`` enabled the client is pinged at most once every
+    ``ping_interval`` seconds, and None is returned while the ping fails. The
+    client itself stays open, as sessions and datasets may hold collections
+    of it, and pymongo reconnects it once the server is reachable again.
+    """
     pymongo = try_import_pymongo()
     if not pymongo:
         return None
-    from pymongo import MongoClient  # type: ignore
 
-    try:
-        client = MongoClient(uri)
+    opts = mongo_client_options(**options)
+    key = (uri, tuple(sorted(opts.items())))
+    with _MONGO_CLIENTS_LOCK:
+        client = _MONGO_CLIENTS.get(key)
+        if client is None:
+            try:
+                client = _create_mongo_client(uri, **opts)
+            except Exception:
+                return None
+            _MONGO_CLIENTS[key] = client
+            _MONGO_LAST_PING.pop(key, None)
+
+    if not check:
         return client
-    except Exception:
+
+    now = time.monotonic()
+    last_ping = _MONGO_LAST_PING.get(key)
+    if last_ping is not None and now - last_ping < ping_interval:
+        return client
+    if ping_mongo_client(client):
+        _MONGO_LAST_PING[key] = now
+        return client
+    # not recorded, so the next call pings again
+    return None
+
+
+def close_mongo_clients() -> None:
+    with _MONGO_CLIENTS_LOCK:
+        clients = list(_MONGO_CLIENTS.values())
+        _MONGO_CLIENTS.clear()
+        _MONGO_LAST_PING.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_mongo_clients)
+
+
+def _iso_bound(value: pd.Timestamp) -> str:
+    # "2024-01-15" sorts before "2024-01-15T00:00:00", so midnight bounds are
+    # written as bare dates to keep them inclusive of date-only strings
+    if value == value.normalize():
+        return value.strftime("%Y-%m-%d")
+    return value.isoformat()
+
+
+def build_mongo_query(filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Translate sidebar filters into a MongoDB query document.
+
+    ``filters`` maps each of ``FILTER_DIMENSIONS`` to the selected values and
+    ``"order_date"`` to a ``(start, end)`` pair. Empty selections are ignored,
+    matching the in-memory filters. Dates are matched both as BSON datetimes
+    and as ISO strings, since a collection seeded straight from the CSV keeps
+    ``order_date`` as text.
+    """
+    query: Dict[str, Any] = {}
+    if not filters:
+        return query
+
+    for column in FILTER_DIMENSIONS:
+        values = filters.get(column)
+        if values:
+            query[column] = {"$in": list(values)}
+
+    date_range = filters.get("order_date")
+    if date_range and len(date_range) == 2:
+        start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+        query["$or"] = [
+            {
+                "order_date": {
+                    "$gte": start.to_pydatetime(),
+                    "$lte": end.to_pydatetime(),
+                }
+            },
+            {"order_date": {"$gte": _iso_bound(start), "$lte": _iso_bound(end)}},
+        ]
+    return query
+
+
+def build_mongo_projection(
+    columns: Optional[Iterable[str]] = None,
+) -> Optional[Dict[str, int]]:
+    if not columns:
         return None
+    return {column: 1 for column in columns}
+
+
+def apply_filters(
+    df: pd.DataFrame, filters: Optional[Dict[str, Any]] = None
+) -> pd.DataFrame:
+    """In-memory counterpart of ``build_mongo_query``."""
+    if not filters or df.empty:
+        return df
+
+    mask = pd.Series(True, index=df.index)
+    for column in FILTER_DIMENSIONS:
+        values = filters.get(column)
+        if values and column in df.columns:
+            mask &= df[column].isin(values)
+
+    date_range = filters.get("order_date")
+    if date_range and len(date_range) == 2 and "order_date" in df.columns:
+        start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+        mask &= df["order_date"].between(start, end)
+
+    return df[mask]
+
+
+def reader_view(df: pd.DataFrame) -> pd.DataFrame:
+    """``df`` for a caller that may write to it without changing ``df``.
+
+    Under pandas copy-on-write, which the dashboards switch on, this is a
+    shallow copy that shares every column until one is written to; without
+    it, a shallow copy would write through, so the data is copied.
+    """
+    return df.copy(deep=pd.get_option("mode.copy_on_write") is not True)
+
+
+class FilterIndex:
+    """Precomputed lookups for resolving sidebar filters without copying.
+
+    Built once per loaded dataset: every value of each ``FILTER_DIMENSIONS``
+    column gets a packed row bitmap, and ``order_date`` gets a sorted index so
+    a date range is two binary searches. ``positions`` ORs the bitmaps within
+    a dimension, ANDs across dimensions and intersects with the date range;
+    ``select`` then takes the matching rows once. Semantics match
+    ``apply_filters`` (empty selections are ignored, dates are inclusive).
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.frame = df
+        self._rows = len(df)
+        self._bitmaps: Dict[str, Dict[Any, np.ndarray]] = {}
+        for column in FILTER_DIMENSIONS:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype("category")
+            codes = values.cat.codes.to_numpy()
+            self._bitmaps[column] = {
+                value: np.packbits(codes == code)
+                for code, value in enumerate(values.cat.categories)
+            }
+
+        self._date_order: Optional[np.ndarray] = None
+        self._sorted_dates: Optional[np.ndarray] = None
+        if "order_date" in df.columns:
+            dates = df["order_date"].to_numpy(dtype="datetime64[ns]")
+            self._date_order = np.argsort(dates, kind="stable")
+            self._sorted_dates = dates[self._date_order]
+
+        self.nbytes = sum(
+            bitmap.nbytes
+            for bitmaps in self._bitmaps.values()
+            for bitmap in bitmaps.values()
+        )
+        if self._date_order is not None:
+            self.nbytes += self._date_order.nbytes + self._sorted_dates.nbytes
+
+    def positions(self, filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Row positions in ``frame`` matching ``filters``, in frame order."""
+        filters = filters or {}
+        packed: Optional[np.ndarray] = None
+        for column in FILTER_DIMENSIONS:
+            values = filters.get(column)
+            if not values or column not in self._bitmaps:
+                continue
+            bitmaps = self._bitmaps[column]
+            selected = np.zeros((self._rows + 7) // 8, dtype=np.uint8)
+            for value in values:
+                bitmap = bitmaps.get(value)
+                if bitmap is not None:
+                    selected |= bitmap
+            packed = selected if packed is None else packed & selected
+
+        date_rows: Optional[np.ndarray] = None
+        date_range = filters.get("order_date")
+        if date_range and len(date_range) == 2 and self._sorted_dates is not None:
+            start = np.datetime64(pd.to_datetime(date_range[0]), "ns")
+            end = np.datetime64(pd.to_datetime(date_range[1]), "ns")
+            lo = np.searchsorted(self._sorted_dates, start, side="left")
+            hi = np.searchsorted(self._sorted_dates, end, side="right")
+            date_rows = self._date_order[lo:hi]
+
+        if packed is None:
+            if date_rows is None:
+                return np.arange(self._rows)
+            return np.sort(date_rows)
+
+        mask = np.unpackbits(packed, count=self._rows).view(bool)
+        if date_rows is not None:
+            in_range = np.zeros(self._rows, dtype=bool)
+            in_range[date_rows] = True
+            mask &= in_range
+        return np.flatnonzero(mask)
+
+    def select(self, filters: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """The filtered frame; a ``reader_view`` when every row matches."""
+        rows = self.positions(filters)
+        if len(rows) == self._rows:
+            return reader_view(self.frame)
+        return self.frame.take(rows)
+
+
+# Columns the table search box matches (case-insensitive substring).
+SEARCH_COLUMNS = CATEGORICAL_COLUMNS
+PAGE_SIZES = (25, 50, 100, 250)
+
+
+class PagedTable:
+    """Serves one page of a frame at a time in any column's sort order.
+
+    Each (column, direction) order is computed once with a stable sort and
+    kept, so a page request is a boolean lookup of the matching rows along
+    that order plus one ``take`` of ``page_size`` rows; nothing is sorted or
+    copied per rerun. Filters are resolved through ``index`` and ``search``
+    matches ``SEARCH_COLUMNS`` like the Mongo ``$regex`` pushdown does.
+    """
+
+    def __init__(self, df: pd.DataFrame, index: Optional[FilterIndex] = None) -> None:
+        self.frame = df
+        self.index = index if index is not None else FilterIndex(df)
+        self._orders: Dict[Tuple[str, bool], np.ndarray] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(order.nbytes for order in self._orders.values())
+
+    def order(self, column: str, ascending: bool = True) -> np.ndarray:
+        """Row positions sorted by ``column``; missing values always last."""
+        key = (column, ascending)
+        order = self._orders.get(key)
+        if order is None:
+            values = self.frame[column].reset_index(drop=True)
+            order = values.sort_values(
+                ascending=ascending, kind="stable", na_position="last"
+            ).index.to_numpy()
+            self._orders[key] = order
+        return order
+
+    def search_mask(self, search: str) -> np.ndarray:
+        term = search.strip().lower()
+        mask = np.zeros(len(self.frame), dtype=bool)
+        for column in SEARCH_COLUMNS:
+            if column not in self.frame.columns:
+                continue
+            values = self.frame[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # match the few categories, then their codes
+                hits = values.cat.categories.str.lower().str.contains(term, regex=False)
+                mask |= np.isin(values.cat.codes.to_numpy(), np.flatnonzero(hits))
+            else:
+                mask |= (
+                    values.astype(str)
+                    .str.lower()
+                    .str.contains(term, regex=False, na=False)
+                    .to_numpy()
+                )
+        return mask
+
+    def page(
+        self,
+        page: int = 1,
+        page_size: int = 50,
+        sort_by: str = "order_date",
+        ascending: bool = False,
+        filters: Optional[Dict[str, Any]] = None,
+        search: Optional[str] = None,
+    ) -> Tuple[pd.DataFrame, int]:
+        """Rows of ``page`` (1-based) and the number of matching rows."""
+        rows = len(self.frame)
+        if sort_by in self.frame.columns:
+            order = self.order(sort_by, ascending)
+        else:
+            order = np.arange(rows)
+
+        mask: Optional[np.ndarray] = None
+        matching = self.index.positions(filters)
+        if len(matching) < rows:
+            mask = np.zeros(rows, dtype=bool)
+            mask[matching] = True
+        if search and search.strip():
+            found = self.search_mask(search)
+            mask = found if mask is None else mask & found
+        if mask is not None:
+            order = order[mask[order]]
+
+        start = max(page - 1, 0) * page_size
+        return self.frame.take(order[start : start + page_size]), len(order)
+
+
+class DatasetTooLargeError(MemoryError):
+    """A streamed load went over its ``max_bytes`` ceiling."""
 
 
-def load_mongo_collection(client, db_name: str, collection_name: str) -> pd.DataFrame:
+def _documents_to_frame(docs: List[Dict[str, Any]]) -> pd.DataFrame:
+    chunk = pd.DataFrame.from_records(docs)
+    if "_id" in chunk.columns:
+        try:
+            chunk["_id"] = chunk["_id"].astype(str)
+        except Exception:
+            pass
+    if "order_date" in chunk.columns:
+        chunk["order_date"] = pd.to_datetime(chunk["order_date"])
+    return normalize_sales_frame(chunk)
+
+
+def stream_mongo_frame(
+    cursor,
+    batch_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> pd.DataFrame:
+    """Build a DataFrame from ``cursor`` one batch at a time.
+
+    Each ``batch_size`` documents are turned into a chunk normalised to
+    ``SALES_SCHEMA`` and the raw dicts are dropped, so at most one batch of
+    documents is alive next to the compact chunks; the chunks are merged once
+    at the end with ``concat_sales_frames``, which unions their categories.
+    Loading stops with ``DatasetTooLargeError`` once the chunks exceed
+    ``max_bytes`` (``MONGO_MAX_FRAME_MB`` by default, 0 disables the
+    ceiling). ``progress`` is called with the running row count after every
+    batch.
+    """
+    if batch_size is None:
+        batch_size = int(os.environ.get("MONGO_BATCH_SIZE", "5000"))
+    if max_bytes is None:
+        max_bytes = int(float(os.environ.get("MONGO_MAX_FRAME_MB", "0")) * 2**20)
+    cursor = cursor.batch_size(batch_size)
+
+    chunks: List[pd.DataFrame] = []
+    rows = 0
+    size = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush() -> None:
+        nonlocal rows, size
+        chunk = _documents_to_frame(batch)
+        batch.clear()
+        chunks.append(chunk)
+        rows += len(chunk)
+        size += int(chunk.memory_usage(deep=True).sum())
+        if max_bytes and size > max_bytes:
+            raise DatasetTooLargeError(
+                f"Loaded {rows:,} rows ({size / 2**20:,.1f} MiB), over the "
+                f"{max_bytes / 2**20:,.1f} MiB limit; narrow the filters."
+            )
+        if progress:
+            progress(rows)
+
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if not chunks:
+        return pd.DataFrame()
+    return concat_sales_frames(chunks)
+
+
+def _read_mongo_collection(
+    coll,
+    query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, int]] = None,
+    limit: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> pd.DataFrame:
+    cursor = coll.find(query or {}, projection)
+    if limit:
+        cursor = cursor.limit(limit)
+    with span("mongo_fetch") as timing:
+        df = timing.measure(stream_mongo_frame(cursor, batch_size, max_bytes, progress))
+    with span("normalize"):
+        return normalize_sales_frame(ensure_datetime(df))
+
+
+def build_search_query(search: Optional[str]) -> Dict[str, Any]:
+    """Case-insensitive substring match on ``SEARCH_COLUMNS``, as ``PagedTable``."""
+    if not search or not search.strip():
+        return {}
+    pattern = re.escape(search.strip())
+    return {
+        "$or": [
+            {column: {"$regex": pattern, "$options": "i"}} for column in SEARCH_COLUMNS
+        ]
+    }
+
+
+def mongo_table_page(
+    coll,
+    page: int = 1,
+    page_size: int = 50,
+    sort_by: str = "order_date",
+    ascending: bool = False,
+    filters: Optional[Dict[str, Any]] = None,
+    search: Optional[str] = None,
+    columns: Optional[Iterable[str]] = DASHBOARD_COLUMNS,
+) -> Tuple[pd.DataFrame, int]:
+    """One page of the filtered collection, sorted and sliced by the server.
+
+    Ties are broken on ``_id`` so pages never overlap; ``sort_by`` should be
+    indexed (``scripts/seed_mongo.py`` indexes ``order_date``) to keep deep
+    pages cheap.
+    """
+    clauses = [c for c in (build_mongo_query(filters), build_search_query(search)) if c]
+    query = clauses[0] if len(clauses) == 1 else ({"$and": clauses} if clauses else {})
+    direction = 1 if ascending else -1
+    cursor = (
+        coll.find(query, build_mongo_projection(columns))
+        .sort([(sort_by, direction), ("_id", direction)])
+        .skip(max(page - 1, 0) * page_size)
+        .limit(page_size)
+    )
+    with span("mongo_page") as timing:
+        df = timing.measure(stream_mongo_frame(cursor))
+        total = coll.count_documents(query)
+    return normalize_sales_frame(ensure_datetime(df)), total
+
+
+def load_mongo_collection(
+    client,
+    db_name: str,
+    collection_name: str,
+    query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
     try:
         coll = client[db_name][collection_name]
-        data = list(coll.find())
-        df = pd.DataFrame(data)
-        if "_id" in df.columns:
-            try:
-                df["_id"] = df["_id"].astype(str)
-            except Exception:
-                pass
-        return ensure_datetime(df)
+        return _read_mongo_collection(coll, query, projection)
     except Exception:
         return pd.DataFrame()
 
 
-def get_dataframe(
+def _uses_mongo(source: str) -> bool:
+    return source not in ("csv", "engine")
+
+
+def get_mongo_collection(
+    mongo_uri: Optional[str],
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+):
+    """Resolve the configured collection, or ``None`` when MongoDB is unavailable."""
+    if not mongo_uri or not try_import_pymongo():
+        return None
+    client = get_mongo_client(mongo_uri)
+    if not client:
+        return None
+    db_name = mongo_db or os.environ.get("MONGO_DB", "sales_db")
+    coll_name = mongo_collection or os.environ.get("MONGO_COLLECTION", "sales")
+    return client[db_name][coll_name]
+
+
+def _collection_has_documents(coll) -> bool:
+    try:
+        return coll.find_one({}, {"_id": 1}) is not None
+    except Exception:
+        return False
+
+
+def _mongo_filter_options(coll) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        column: sorted(v for v in coll.distinct(column) if v is not None)
+        for column in FILTER_DIMENSIONS
+    }
+    dates = pd.to_datetime(pd.Series(coll.distinct("order_date")), errors="coerce")
+    dates = dates.dropna()
+    options["order_date"] = (dates.min(), dates.max()) if not dates.empty else None
+    return options
+
+
+def filter_options_from_frame(df: pd.DataFrame) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        column: sorted(df[column].dropna().unique()) if column in df.columns else []
+        for column in FILTER_DIMENSIONS
+    }
+    if "order_date" in df.columns and not df.empty:
+        options["order_date"] = (df["order_date"].min(), df["order_date"].max())
+    else:
+        options["order_date"] = None
+    return options
+
+
+class DataFrameCache:
+    """Process-wide cache for loaded datasets and the results derived from them.
+
+    Entries expire after ``ttl`` seconds and are evicted least-recently-used
+    first once there are more than ``max_entries`` or they hold more than
+    ``max_bytes``. Each entry also remembers the version token of its source
+    (CSV mtime, Mongo watermark); the token is re-read at most every
+    ``check_interval`` seconds and a changed token forces a reload. Concurrent
+    misses on the same key wait for a single load. Cached frames are shared
+    between callers and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        max_entries: int = 32,
+        max_bytes: int = 512 * 2**20,
+        check_interval: float = 1.0,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: Hashable, version: Optional[Callable[[], Any]]):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or now - entry["loaded_at"] > self.ttl:
+            return None
+        if version is not None and now - entry["checked_at"] >= self.check_interval:
+            if version() != entry["version"]:
+                return None
+            entry["checked_at"] = now
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry
+
+    def get(
+        self,
+        key: Hashable,
+        loader: Callable[[], Any],
+        version: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        entry = self._lookup(key, version)
+        if entry is not None:
+            self.hits += 1
+            return entry["value"]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # another session may have finished the same load while we waited
+            entry = self._lookup(key, version)
+            if entry is not None:
+                self.hits += 1
+                return entry["value"]
+            self.misses += 1
+            token = version() if version is not None else None
+            value = loader()
+            now = time.monotonic()
+            with self._lock:
+                self._entries[key] = {
+                    "value": value,
+                    "version": token,
+                    "loaded_at": now,
+                    "checked_at": now,
+                    "nbytes": _estimate_nbytes(value),
+                }
+                self._entries.move_to_end(key)
+                self._evict()
+        return value
+
+    def _evict(self) -> None:
+        total = sum(entry["nbytes"] for entry in self._entries.values())
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or total > self.max_bytes
+        ):
+            key, entry = self._entries.popitem(last=False)
+            self._key_locks.pop(key, None)
+            total -= entry["nbytes"]
+
+    def invalidate(
+        self, predicate: Optional[Callable[[Hashable], bool]] = None
+    ) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                if predicate is None or predicate(key):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["nbytes"] for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _estimate_nbytes(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, FilterIndex):
+        # the indexed frame is accounted for by its own cache entry
+        return value.nbytes
+    if isinstance(value, (RollupCube, PagedTable)):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_estimate_nbytes(v) for v in value.values())
+    if isinstance(value, tuple):
+        return sum(_estimate_nbytes(v) for v in value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, "to_plotly_json"):
+        # a Plotly figure: about the size of its serialized spec
+        return len(value.to_json())
+    return 0
+
+
+DATAFRAME_CACHE = DataFrameCache(
+    ttl=float(os.environ.get("DATAFRAME_CACHE_TTL", "300")),
+    max_entries=int(os.environ.get("DATAFRAME_CACHE_MAX_ENTRIES", "32")),
+    max_bytes=int(float(os.environ.get("DATAFRAME_CACHE_MAX_MB", "512")) * 2**20),
+    check_interval=float(os.environ.get("DATAFRAME_CACHE_CHECK_INTERVAL", "1.0")),
+)
+
+
+def _csv_version() -> Tuple[Any, ...]:
+    if DATA_PATH.is_dir():
+        return ("csv", str(DATA_PATH), _partition_digest(_partition_stats()))
+    stat = DATA_PATH.stat()
+    return ("csv", str(DATA_PATH), stat.st_mtime_ns, stat.st_size)
+
+
+def _partition_stats() -> Dict[str, Tuple[int, int]]:
+    stats = {}
+    for path in csv_partitions():
+        stat = path.stat()
+        stats[path.name] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def _partition_digest(stats: Dict[str, Tuple[int, int]]) -> str:
+    payload = json.dumps(sorted(stats.items()))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _mongo_watermark(coll) -> Tuple[Any, ...]:
+    newest = coll.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return (
+        "mongo",
+        newest["_id"] if newest else None,
+        coll.estimated_document_count(),
+    )
+
+
+def get_source_version(
     source: str = "auto",
     mongo_uri: Optional[str] = None,
     mongo_db: Optional[str] = None,
     mongo_collection: Optional[str] = None,
-) -> pd.DataFrame:
-    if source == "csv":
-        return load_csv_data()
-
-    if mongo_uri and try_import_pymongo():
-        client = get_mongo_client(mongo_uri)
-        if client:
-            db_name = mongo_db or os.environ.get("MONGO_DB", "sales_db")
-            coll_name = mongo_collection or os.environ.get("MONGO_COLLECTION", "sales")
-            df = load_mongo_collection(client, db_name, coll_name)
+) -> Tuple[Any, ...]:
+    """A token that changes whenever the data behind ``source`` changes.
+
+    For MongoDB this is the newest ``_id`` plus the document count; for the
+    CSV and the engine's files it is their mtimes and sizes.
+    """
+    if source == "engine" and get_engine_connection() is not None:
+        try:
+            return _engine_version()
+        except Exception:
+            pass
+    if _uses_mongo(source):
+        coll = get_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+        if coll is not None:
+            try:
+                return _mongo_watermark(coll)
+            except Exception:
+                pass
+    return _csv_version()
+
+
+def _freeze_filters(filters: Optional[Dict[str, Any]]) -> Tuple[Any, ...]:
+    if not filters:
+        return ()
+    frozen = []
+    for column in FILTER_DIMENSIONS:
+        values = filters.get(column)
+        if values:
+            frozen.append((column, tuple(sorted(str(v) for v in values))))
+    date_range = filters.get("order_date")
+    if date_range and len(date_range) == 2:
+        frozen.append(("order_date", tuple(str(pd.to_datetime(d)) for d in date_range)))
+    return tuple(frozen)
+
+
+def _cached_load(
+    kind: str,
+    source: str,
+    mongo_uri: Optional[str],
+    mongo_db: Optional[str],
+    mongo_collection: Optional[str],
+    loader: Callable[[], Any],
+    *key_parts: Hashable,
+) -> Any:
+    key = (kind, source, mongo_uri, mongo_db, mongo_collection) + key_parts
+    return DATAFRAME_CACHE.get(
+        key,
+        loader,
+        lambda: get_source_version(source, mongo_uri, mongo_db, mongo_collection),
+    )
+
+
+def _cached_csv_frame() -> pd.DataFrame:
+    return DATAFRAME_CACHE.get(("csv", str(DATA_PATH)), load_csv_data, _csv_version)
+
+
+def _cached_csv_index() -> FilterIndex:
+    return DATAFRAME_CACHE.get(
+        ("csv-index", str(DATA_PATH)),
+        lambda: FilterIndex(_cached_csv_frame()),
+        _csv_version,
+    )
+
+
+def _cached_csv_cube() -> "RollupCube":
+    return DATAFRAME_CACHE.get(
+        ("csv-cube", str(DATA_PATH)),
+        lambda: RollupCube(_cached_csv_frame(), version=_csv_version()),
+        _csv_version,
+    )
+
+
+def _cached_csv_table() -> PagedTable:
+    return DATAFRAME_CACHE.get(
+        ("csv-table", str(DATA_PATH)),
+        lambda: PagedTable(_cached_csv_frame(), _cached_csv_index()),
+        _csv_version,
+    )
+
+
+def _pruned_date_range(
+    filters: Optional[Dict[str, Any]],
+) -> Optional[Tuple[Any, Any]]:
+    """The filters' date range if it rules out some of ``DATA_PATH``'s partitions."""
+    date_range = (filters or {}).get("order_date")
+    if not DATA_PATH.is_dir() or not date_range or len(date_range) != 2:
+        return None
+    if len(csv_partitions(date_range)) == len(csv_partitions()):
+        return None
+    return date_range
+
+
+def _csv_rows(filters: Optional[Dict[str, Any]]) -> pd.DataFrame:
+    """The CSV rows matching ``filters``.
+
+    A partitioned ``DATA_PATH`` only parses the partitions in the filters'
+    date range, cached per range; otherwise the whole file is loaded once and
+    filtered through its ``FilterIndex``.
+    """
+    date_range = _pruned_date_range(filters)
+    if date_range is None:
+        return _cached_csv_index().select(filters)
+    frame = DATAFRAME_CACHE.get(
+        ("csv-range", str(DATA_PATH), _freeze_filters({"order_date": date_range})),
+        lambda: load_csv_data(date_range=date_range),
+        _csv_version,
+    )
+    return apply_filters(frame, filters)
+
+
+def invalidate_dataframe_cache() -> None:
+    """Drop every cached dataset, and the summaries and exports derived from
+    it, e.g. after writing edits back to the source."""
+    DATAFRAME_CACHE.invalidate()
+    # in-place updates keep the Mongo watermark, so version-keyed results
+    # would otherwise outlive the data they were computed from
+    FILTER_STATE_CACHE.invalidate()
+    STAGE_CACHE.invalidate()
+    EXPORT_CACHE.invalidate()
+    # in-place edits don't move an incremental dataset's mark either
+    with _INCREMENTAL_DATASETS_LOCK:
+        for dataset in _INCREMENTAL_DATASETS.values():
+            dataset.invalidate()
+
+
+# Results (KPIs, chart frames) per filter combination, shared by all sessions.
+# Keys embed the dataset version, so entries for old data simply age out.
+FILTER_STATE_CACHE = DataFrameCache(
+    ttl=float(os.environ.get("FILTER_STATE_CACHE_TTL", "3600")),
+    max_entries=int(os.environ.get("FILTER_STATE_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(float(os.environ.get("FILTER_STATE_CACHE_MAX_MB", "64")) * 2**20),
+)
+
+# Pipeline stage results and figures (see ``run_stage``), keyed by the hash of
+# their inputs; kept apart so each cache's hit rate means one thing.
+STAGE_CACHE = DataFrameCache(
+    ttl=float(os.environ.get("STAGE_CACHE_TTL", "3600")),
+    max_entries=int(os.environ.get("STAGE_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(float(os.environ.get("STAGE_CACHE_MAX_MB", "64")) * 2**20),
+)
+
+
+def filter_state_key(version: Any, filters: Optional[Dict[str, Any]]) -> str:
+    """Canonical hash of a dataset version and a filter selection.
+
+    Selections are order-insensitive and empty selections are dropped, so the
+    same sidebar state always maps to the same key.
+    """
+    payload = json.dumps([repr(version), _freeze_filters(filters)], default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def memoize_filter_state(
+    kind: str,
+    version: Any,
+    filters: Optional[Dict[str, Any]],
+    compute: Callable[[], Any],
+) -> Any:
+    """Return ``compute()`` for this filter state, computing it at most once."""
+    return FILTER_STATE_CACHE.get((kind, filter_state_key(version, filters)), compute)
+
+
+def filter_state_cache_stats() -> Dict[str, Any]:
+    return FILTER_STATE_CACHE.stats()
+
+
+def stage_cache_stats() -> Dict[str, Any]:
+    return STAGE_CACHE.stats()
+
+
+class ExportTooLargeError(ValueError):
+    """An export went over its ``max_bytes`` cap."""
+
+
+# Download formats: file suffix and MIME type.
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# Generated download files per (format, dataset version, filter state).
+EXPORT_CACHE = DataFrameCache(
+    ttl=float(os.environ.get("EXPORT_CACHE_TTL", "600")),
+    max_entries=int(os.environ.get("EXPORT_CACHE_MAX_ENTRIES", "16")),
+    max_bytes=int(float(os.environ.get("EXPORT_CACHE_MAX_MB", "256")) * 2**20),
+)
+
+
+def export_formats() -> List[str]:
+    """The ``EXPORT_FORMATS`` usable here; Parquet needs pyarrow."""
+    formats = [fmt for fmt in EXPORT_FORMATS if fmt != "parquet"]
+    if try_import_pyarrow() is not None:
+        formats.append("parquet")
+    return formats
+
+
+def export_frame(
+    df: pd.DataFrame,
+    fmt: str = "csv",
+    max_bytes: Optional[int] = None,
+    chunk_rows: Optional[int] = None,
+) -> bytes:
+    """Serialise ``df`` as ``fmt``, ``chunk_rows`` rows at a time.
+
+    Rows are encoded straight into one byte buffer (no intermediate ``str``),
+    and writing stops with ``ExportTooLargeError`` as soon as the file passes
+    ``max_bytes`` (``EXPORT_MAX_MB`` by default, 0 disables the cap).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    if max_bytes is None:
+        max_bytes = int(float(os.environ.get("EXPORT_MAX_MB", "200")) * 2**20)
+    if chunk_rows is None:
+        chunk_rows = int(os.environ.get("EXPORT_CHUNK_ROWS", "50000"))
+    buffer = io.BytesIO()
+
+    def check() -> None:
+        if max_bytes and buffer.tell() > max_bytes:
+            raise ExportTooLargeError(
+                f"The export is over the {max_bytes / 2**20:,.1f} MiB limit; "
+                "narrow the filters or pick a compressed format."
+            )
+
+    starts = range(0, max(len(df), 1), chunk_rows)
+    if fmt == "parquet":
+        pa = try_import_pyarrow()
+        if pa is None:
+            raise ValueError("Parquet export needs pyarrow")
+        import pyarrow.parquet as pq
+
+        writer = None
+        for start in starts:
+            table = pa.Table.from_pandas(
+                df.iloc[start : start + chunk_rows], preserve_index=False
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table)
+            check()
+        writer.close()
+    else:
+        # mtime=0 keeps the gzip bytes identical for identical data
+        raw = (
+            gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0)
+            if fmt == "csv.gz"
+            else buffer
+        )
+        text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        for start in starts:
+            df.iloc[start : start + chunk_rows].to_csv(
+                text, header=start == 0, index=False
+            )
+            text.flush()
+            check()
+        text.detach()
+        if raw is not buffer:
+            raw.close()
+    check()
+    return buffer.getvalue()
+
+
+def get_export(
+    kind: str,
+    version: Any,
+    filters: Optional[Dict[str, Any]],
+    fmt: str,
+    loader: Callable[[], pd.DataFrame],
+) -> bytes:
+    """The ``fmt`` export of ``loader()``, built once per dataset version and filter state.
+
+    ``loader`` only runs on a cache miss, so the data behind a repeated
+    download is not even fetched again.
+    """
+    key = (kind, fmt, filter_state_key(version, filters))
+
+    def build() -> bytes:
+        df = loader()
+        with span("export", format=fmt) as timing:
+            return timing.measure(export_frame(df, fmt))
+
+    return EXPORT_CACHE.get(key, build)
+
+
+def export_file_name(stem: str, fmt: str) -> str:
+    return stem + EXPORT_FORMATS[fmt][0]
+
+
+def export_mime(fmt: str) -> str:
+    return EXPORT_FORMATS[fmt][1]
+
+
+def get_filter_options(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Sidebar choices for each filter dimension plus the ``order_date`` bounds.
+
+    For MongoDB these come from ``distinct()`` so the collection is never
+    scanned into memory just to populate the widgets; a partition directory
+    has each file summarised on the worker pool. Results are cached in
+    ``DATAFRAME_CACHE`` until the source changes.
+    """
+
+    def load() -> Dict[str, Any]:
+        if _uses_mongo(source):
+            coll = get_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+            if coll is not None and _collection_has_documents(coll):
+                try:
+                    return _mongo_filter_options(coll)
+                except Exception:
+                    pass
+        if source == "engine" and get_engine_connection() is not None:
+            try:
+                return engine_filter_options()
+            except Exception:
+                pass
+        if DATA_PATH.is_dir():
+            return partition_filter_options(csv_partitions())
+        return filter_options_from_frame(_cached_csv_frame())
+
+    return _cached_load("options", source, mongo_uri, mongo_db, mongo_collection, load)
+
+
+def get_dataframe(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    columns: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """Load the sales data, optionally restricted to ``filters`` and ``columns``.
+
+    With MongoDB the filters, column projection and ``limit`` are executed by
+    the server so only the matching slice is transferred, and the cursor is
+    streamed in batches (see ``stream_mongo_frame``). ``source="engine"``
+    runs them as a DuckDB query over local files (see ``engine_frame``). The
+    CSV fallback applies the same filters in memory.
+
+    Results are kept in ``DATAFRAME_CACHE`` and reused until the CSV mtime or
+    the Mongo watermark changes, so reruns with unchanged inputs are served
+    from memory. Callers get a ``reader_view`` of the cached frame.
+    """
+
+    def load() -> pd.DataFrame:
+        return _load_dataframe(
+            source,
+            mongo_uri,
+            mongo_db,
+            mongo_collection,
+            filters,
+            columns,
+            limit,
+            batch_size,
+            max_bytes,
+            progress,
+        )
+
+    if not use_cache:
+        return load()
+    frame = _cached_load(
+        "frame",
+        source,
+        mongo_uri,
+        mongo_db,
+        mongo_collection,
+        load,
+        _freeze_filters(filters),
+        tuple(columns or ()),
+        limit,
+    )
+    return reader_view(frame)
+
+
+def _load_dataframe(
+    source: str,
+    mongo_uri: Optional[str],
+    mongo_db: Optional[str],
+    mongo_collection: Optional[str],
+    filters: Optional[Dict[str, Any]],
+    columns: Optional[List[str]],
+    limit: Optional[int],
+    batch_size: Optional[int],
+    max_bytes: Optional[int],
+    progress: Optional[Callable[[int], None]],
+) -> pd.DataFrame:
+    if source == "engine" and get_engine_connection() is not None:
+        try:
+            return engine_frame(filters, columns, limit)
+        except Exception:
+            pass
+    if _uses_mongo(source):
+        coll = get_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+        if coll is not None:
+            try:
+                df = _read_mongo_collection(
+                    coll,
+                    build_mongo_query(filters),
+                    build_mongo_projection(columns),
+                    limit,
+                    batch_size,
+                    max_bytes,
+                    progress,
+                )
+            except DatasetTooLargeError:
+                raise
+            except Exception:
+                df = pd.DataFrame()
             if not df.empty:
                 return df
+            if filters and _collection_has_documents(coll):
+                # the collection is fine, nothing matched the filters
+                empty = pd.DataFrame(columns=list(columns or DASHBOARD_COLUMNS))
+                return normalize_sales_frame(ensure_datetime(empty))
+
+    df = _csv_rows(filters)
+    if columns:
+        df = df[[c for c in df.columns if c in columns or c in ("month", "year")]]
+    if limit:
+        df = df.head(limit)
+    return df
+
+
+def get_table_page(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    page: int = 1,
+    page_size: int = 50,
+    sort_by: str = "order_date",
+    ascending: bool = False,
+    search: Optional[str] = None,
+) -> Tuple[pd.DataFrame, int]:
+    """One page of the filtered transactions and the total matching rows.
+
+    MongoDB and the engine sort and page the rows themselves
+    (``mongo_table_page``, ``engine_table_page``); the CSV is paged through a
+    cached ``PagedTable``. Pages are cached like frames.
+    """
+
+    def load() -> Tuple[pd.DataFrame, int]:
+        if _uses_mongo(source):
+            coll = get_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+            if coll is not None and _collection_has_documents(coll):
+                try:
+                    return mongo_table_page(
+                        coll, page, page_size, sort_by, ascending, filters, search
+                    )
+                except Exception:
+                    pass
+        if source == "engine" and get_engine_connection() is not None:
+            try:
+                return engine_table_page(
+                    page, page_size, sort_by, ascending, filters, search
+                )
+            except Exception:
+                pass
+        if _pruned_date_range(filters) is not None:
+            return PagedTable(_csv_rows(filters)).page(
+                page, page_size, sort_by, ascending, None, search
+            )
+        return _cached_csv_table().page(
+            page, page_size, sort_by, ascending, filters, search
+        )
+
+    return _cached_load(
+        "page",
+        source,
+        mongo_uri,
+        mongo_db,
+        mongo_collection,
+        load,
+        _freeze_filters(filters),
+        page,
+        page_size,
+        sort_by,
+        ascending,
+        (search or "").strip().lower(),
+    )
+
+
+def summarize_sales(df: pd.DataFrame) -> Dict[str, Any]:
+    """KPIs and chart frames for the dashboards, computed in pandas.
+
+    Returns ``row_count``, ``total_sales``, ``total_profit``, ``avg_margin`` and
+    ``avg_order`` plus the ``daily_sales`` (order_date, sales),
+    ``category_sales`` (category[, subcategory], sales) and ``segment_profit``
+    (customer_segment, profit) frames.
+    """
+    has = set(df.columns)
+    total_sales = float(df["sales"].sum()) if "sales" in has else 0.0
+    total_profit = float(df["profit"].sum()) if "profit" in has else 0.0
+    avg_order = float(df["sales"].mean()) if not df.empty and "sales" in has else 0.0
+    return _summary(df, len(df), total_sales, total_profit, avg_order)
+
+
+def _summary(
+    df: pd.DataFrame,
+    row_count: int,
+    total_sales: float,
+    total_profit: float,
+    avg_order: float,
+) -> Dict[str, Any]:
+    has = set(df.columns)
+    summary: Dict[str, Any] = {
+        "row_count": row_count,
+        "total_sales": total_sales,
+        "total_profit": total_profit,
+        "avg_margin": (total_profit / total_sales * 100) if total_sales else 0.0,
+        "avg_order": avg_order,
+        "daily_sales": pd.DataFrame(columns=["order_date", "sales"]),
+        "category_sales": pd.DataFrame(columns=["category", "sales"]),
+        "segment_profit": pd.DataFrame(columns=["customer_segment", "profit"]),
+    }
+    if df.empty:
+        return summary
+
+    if {"order_date", "sales"} <= has:
+        summary["daily_sales"] = sum_by(df, ["order_date"], "sales")
+    if {"category", "sales"} <= has:
+        keys = ["category", "subcategory"] if "subcategory" in has else ["category"]
+        summary["category_sales"] = sum_by(df, keys, "sales")
+    if {"customer_segment", "profit"} <= has:
+        summary["segment_profit"] = sum_by(df, ["customer_segment"], "profit")
+    return summary
+
+
+# Most points the sales trend chart sends to the browser.
+TREND_MAX_POINTS = int(os.environ.get("TREND_MAX_POINTS", "500"))
+TREND_TITLES = {
+    "day": "Daily sales trend",
+    "week": "Weekly sales trend",
+    "month": "Monthly sales trend",
+}
+# A resolution is used when LTTB has to drop at most this share of its points;
+# beyond that the next coarser one is aggregated first.
+_LTTB_MAX_RATIO = 4
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Positions of the points Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept; every bucket in between keeps
+    the point spanning the largest triangle with its neighbours, which
+    preserves the peaks and troughs a line chart makes visible.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x).astype("float64")
+    y = np.asarray(y).astype("float64")
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def downsample_trend(
+    daily: pd.DataFrame, max_points: Optional[int] = None
+) -> Tuple[pd.DataFrame, str]:
+    """Bound the ``daily_sales`` chart frame to ``max_points`` points.
+
+    Picks the finest of day, week and month whose point count is within a
+    small multiple of the budget, sums sales to it, then thins the series with
+    ``lttb``. Returns the frame and the resolution used.
+    """
+    if max_points is None:
+        max_points = TREND_MAX_POINTS
+    trend, resolution = daily, "day"
+    if len(daily) > max_points * _LTTB_MAX_RATIO:
+        dates = pd.to_datetime(daily["order_date"])
+        for resolution, period in (("week", "W"), ("month", "M")):
+            # same bucketing as ensure_datetime's ``month`` column
+            buckets = dates.dt.to_period(period).dt.start_time.rename("order_date")
+            trend = sum_by(daily.assign(order_date=buckets), ["order_date"], "sales")
+            if len(trend) <= max_points * _LTTB_MAX_RATIO:
+                break
+    if len(trend) > max_points:
+        dates = pd.to_datetime(trend["order_date"]).to_numpy("datetime64[ns]")
+        kept = lttb(dates.view("int64"), trend["sales"].to_numpy(), max_points)
+        trend = trend.iloc[kept].reset_index(drop=True)
+    return trend, resolution
+
+
+# Grain of the rollup cube: every chart key plus every filter dimension.
+CUBE_DIMENSIONS = (
+    "order_date",
+    "region",
+    "category",
+    "subcategory",
+    "customer_segment",
+)
+CUBE_MEASURES = ("sales", "profit", "quantity")
+
+
+def _rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Group ``df`` to cube cells; existing ``row_count`` columns are summed."""
+    keys = [c for c in CUBE_DIMENSIONS if c in df.columns]
+    measures = [c for c in CUBE_MEASURES + ("row_count",) if c in df.columns]
+    values = df[measures].astype(
+        {c: "int64" for c in measures if pd.api.types.is_integer_dtype(df[c])}
+    )
+    grouped = values.groupby(
+        [df[key] for key in keys], observed=True, dropna=False, sort=True
+    )
+    cube = grouped.sum()
+    if "row_count" not in df.columns:
+        cube["row_count"] = grouped.size()
+    return cube.reset_index()
+
+
+class RollupCube:
+    """Sales pre-aggregated to one row per date x region x category x
+    subcategory x segment, with measure sums and a ``row_count``.
+
+    Every sidebar filter is expressible on the cube's dimensions, so
+    ``summary(filters)`` returns exactly what ``summarize_sales`` would on the
+    filtered raw rows, while only touching the (much smaller) cube. A cube
+    built with a ``version`` memoises its summaries in ``FILTER_STATE_CACHE``.
+    """
+
+    def __init__(self, df: pd.DataFrame, version: Any = None) -> None:
+        self._install(_rollup(df), len(df), version)
+
+    def _install(self, cells: pd.DataFrame, source_rows: int, version: Any) -> None:
+        self.version = version
+        self.frame = cells
+        self.index = FilterIndex(cells)
+        self.source_rows = source_rows
+        self.nbytes = int(cells.memory_usage(deep=True).sum()) + self.index.nbytes
+
+    def appended(self, rows: pd.DataFrame, version: Any = None) -> "RollupCube":
+        """A new cube with ``rows`` folded in.
+
+        Only ``rows`` and the existing cube cells are grouped, so the cost does
+        not depend on how many raw rows the cube already covers.
+        """
+        cells = self.frame
+        if len(rows):
+            cells = _rollup(concat_sales_frames([cells, _rollup(rows)]))
+        cube = RollupCube.__new__(RollupCube)
+        cube._install(cells, self.source_rows + len(rows), version)
+        return cube
+
+    def summary(self, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self.version is not None:
+            return memoize_filter_state(
+                "cube-summary", self.version, filters, lambda: self._summary(filters)
+            )
+        return self._summary(filters)
+
+    def _summary(self, filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        cells = self.index.select(filters)
+        has = set(cells.columns)
+        row_count = int(cells["row_count"].sum())
+        total_sales = float(cells["sales"].sum()) if "sales" in has else 0.0
+        total_profit = float(cells["profit"].sum()) if "profit" in has else 0.0
+        avg_order = total_sales / row_count if row_count and "sales" in has else 0.0
+        return _summary(cells, row_count, total_sales, total_profit, avg_order)
+
+
+def _group_stage(keys: List[str], measure: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "$group": {
+                "_id": {key: f"${key}" for key in keys},
+                measure: {"$sum": f"${measure}"},
+            }
+        }
+    ]
+
+
+def _facet_frame(rows: List[Dict[str, Any]], keys: List[str], measure: str):
+    frame = pd.DataFrame(
+        [{**row["_id"], measure: row[measure]} for row in rows],
+        columns=keys + [measure],
+    )
+    return frame.sort_values(keys, ignore_index=True) if not frame.empty else frame
+
+
+def aggregate_sales_in_mongo(
+    coll, filters: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Same result as ``summarize_sales`` but computed by an aggregation pipeline.
+
+    One ``$match`` + ``$facet`` round trip returns the KPI totals and the three
+    grouped frames, so only result-sized data crosses the wire.
+    """
+    pipeline = [
+        {"$match": build_mongo_query(filters)},
+        {
+            "$facet": {
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "row_count": {"$sum": 1},
+                            "total_sales": {"$sum": "$sales"},
+                            "total_profit": {"$sum": "$profit"},
+                            "avg_order": {"$avg": "$sales"},
+                        }
+                    }
+                ],
+                "daily_sales": _group_stage(["order_date"], "sales"),
+                "category_sales": _group_stage(["category", "subcategory"], "sales"),
+                "segment_profit": _group_stage(["customer_segment"], "profit"),
+            }
+        },
+    ]
+    with span("mongo_aggregate"):
+        facets = next(iter(coll.aggregate(pipeline)), {})
+    totals = (facets.get("totals") or [{}])[0]
+    total_sales = float(totals.get("total_sales") or 0)
+    total_profit = float(totals.get("total_profit") or 0)
+
+    daily = _facet_frame(facets.get("daily_sales", []), ["order_date"], "sales")
+    if not daily.empty:
+        # string and datetime encodings of the same day collapse here
+        daily["order_date"] = pd.to_datetime(daily["order_date"])
+        daily = daily.groupby("order_date", as_index=False)["sales"].sum()
+
+    return {
+        "row_count": int(totals.get("row_count") or 0),
+        "total_sales": total_sales,
+        "total_profit": total_profit,
+        "avg_margin": (total_profit / total_sales * 100) if total_sales else 0.0,
+        "avg_order": float(totals.get("avg_order") or 0.0),
+        "daily_sales": daily,
+        "category_sales": _facet_frame(
+            facets.get("category_sales", []), ["category", "subcategory"], "sales"
+        ),
+        "segment_profit": _facet_frame(
+            facets.get("segment_profit", []), ["customer_segment"], "profit"
+        ),
+    }
+
+
+def try_import_duckdb():
+    try:
+        import duckdb  # type: ignore
+
+        return duckdb
+    except Exception:
+        return None
+
+
+# SQL types of the dashboard columns, for an empty relation when every
+# partition was pruned.
+ENGINE_COLUMN_TYPES = {
+    "order_date": "DATE",
+    "region": "VARCHAR",
+    "category": "VARCHAR",
+    "subcategory": "VARCHAR",
+    "sales": "BIGINT",
+    "quantity": "BIGINT",
+    "profit": "BIGINT",
+    "customer_segment": "VARCHAR",
+}
+ENGINE_PATTERNS = ("*.parquet",) + CSV_PARTITION_PATTERNS
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine_connection():
+    """The process-wide DuckDB connection, or ``None`` when duckdb is missing.
+
+    ``ENGINE_MEMORY_LIMIT`` (e.g. ``2GB``) and ``ENGINE_THREADS`` bound the
+    engine; operators that outgrow the limit spill to ``ENGINE_TEMP_DIR``.
+    Queries run on their own ``cursor()`` so sessions can share it.
+    """
+    global _ENGINE
+    duckdb = try_import_duckdb()
+    if not duckdb:
+        return None
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            config = {
+                "temp_directory": os.environ.get("ENGINE_TEMP_DIR")
+                or str(Path(tempfile.gettempdir()) / "sales-engine")
+            }
+            if os.environ.get("ENGINE_MEMORY_LIMIT"):
+                config["memory_limit"] = os.environ["ENGINE_MEMORY_LIMIT"]
+            if os.environ.get("ENGINE_THREADS"):
+                config["threads"] = int(os.environ["ENGINE_THREADS"])
+            _ENGINE = duckdb.connect(config=config)
+        return _ENGINE
+
+
+def engine_files(date_range: Optional[Tuple[Any, Any]] = None) -> List[Path]:
+    """The files the "engine" source queries, pruned to ``date_range``.
+
+    ``ENGINE_PATH`` may name a Parquet or CSV file, a directory of them or a
+    glob; without it the engine reads the CSV partitions of ``DATA_PATH``.
+    """
+    setting = os.environ.get("ENGINE_PATH")
+    if not setting:
+        return csv_partitions(date_range)
+    path = Path(setting)
+    if path.is_dir():
+        paths = [p for pattern in ENGINE_PATTERNS for p in path.glob(pattern)]
+    elif path.exists():
+        paths = [path]
+    else:
+        paths = [Path(p) for p in glob.glob(setting)]
+    return prune_partitions(sorted(paths), date_range)
+
+
+def _engine_version() -> Tuple[Any, ...]:
+    stats = {}
+    for path in engine_files():
+        stat = path.stat()
+        stats[str(path)] = (stat.st_mtime_ns, stat.st_size)
+    return ("engine", _partition_digest(stats))
+
+
+def _engine_relation(
+    filters: Optional[Dict[str, Any]],
+) -> Tuple[str, List[Any]]:
+    """SQL for the files that may match ``filters``, and its parameters."""
+    files = [str(path) for path in engine_files((filters or {}).get("order_date"))]
+    if not files:
+        columns = ", ".join(
+            f"NULL::{kind} AS {column}" for column, kind in ENGINE_COLUMN_TYPES.items()
+        )
+        return f"(SELECT {columns} WHERE false)", []
+    if all(name.endswith(".parquet") for name in files):
+        return "read_parquet(?, union_by_name = true)", [files]
+    return "read_csv(?, header = true, union_by_name = true)", [files]
+
+
+def build_engine_where(
+    filters: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, List[Any]]:
+    """SQL counterpart of ``build_mongo_query``: a ``WHERE`` clause and its
+    parameters (empty selections are skipped)."""
+    clauses, params = [], []
+    for column in FILTER_DIMENSIONS:
+        values = (filters or {}).get(column)
+        if values:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(str(value) for value in values)
+    date_range = (filters or {}).get("order_date")
+    if date_range and len(date_range) == 2:
+        clauses.append("order_date BETWEEN ? AND ?")
+        params.extend(pd.to_datetime(d).to_pydatetime() for d in date_range)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+def _engine_query(
+    select: str,
+    filters: Optional[Dict[str, Any]],
+    tail: str = "",
+    extra: Optional[List[Any]] = None,
+    where: Optional[Tuple[str, List[Any]]] = None,
+) -> pd.DataFrame:
+    """Run ``SELECT {select} FROM <files> WHERE <filters> {tail}``."""
+    relation, relation_params = _engine_relation(filters)
+    where_sql, where_params = where or build_engine_where(filters)
+    sql = f"SELECT {select} FROM {relation} {where_sql} {tail}"
+    cursor = get_engine_connection().cursor()
+    try:
+        return cursor.execute(sql, relation_params + where_params + (extra or [])).df()
+    finally:
+        cursor.close()
+
+
+def engine_frame(
+    filters: Optional[Dict[str, Any]] = None,
+    columns: Optional[Iterable[str]] = None,
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """The filtered rows, selected and limited by the engine."""
+    selected = [c for c in ENGINE_COLUMN_TYPES if not columns or c in columns]
+    with span("engine_query") as timing:
+        df = _engine_query(
+            ", ".join(selected),
+            filters,
+            "LIMIT ?" if limit else "",
+            [int(limit)] if limit else None,
+        )
+        timing.measure(df)
+    return normalize_sales_frame(ensure_datetime(df))
+
+
+def aggregate_sales_in_engine(filters: Optional[Dict[str, Any]] = None):
+    """Same result as ``summarize_sales``, computed by engine queries.
+
+    The totals and the three chart group-bys are each one query that returns
+    result-sized frames; the rows never enter pandas.
+    """
+
+    def grouped(keys: List[str], measure: str) -> pd.DataFrame:
+        columns = ", ".join(keys)
+        return _engine_query(
+            f"{columns}, CAST(SUM({measure}) AS BIGINT) AS {measure}",
+            filters,
+            f"GROUP BY {columns} ORDER BY {columns}",
+        )
+
+    with span("engine_aggregate"):
+        totals = _engine_query(
+            "COUNT(*) AS row_count, CAST(SUM(sales) AS DOUBLE) AS total_sales, "
+            "CAST(SUM(profit) AS DOUBLE) AS total_profit, AVG(sales) AS avg_order",
+            filters,
+        ).iloc[0]
+        daily = grouped(["order_date"], "sales")
+        category_sales = grouped(["category", "subcategory"], "sales")
+        segment_profit = grouped(["customer_segment"], "profit")
+    daily["order_date"] = pd.to_datetime(daily["order_date"])
+
+    total_sales = float(totals["total_sales"]) if totals["row_count"] else 0.0
+    total_profit = float(totals["total_profit"]) if totals["row_count"] else 0.0
+    return {
+        "row_count": int(totals["row_count"]),
+        "total_sales": total_sales,
+        "total_profit": total_profit,
+        "avg_margin": (total_profit / total_sales * 100) if total_sales else 0.0,
+        "avg_order": float(totals["avg_order"]) if totals["row_count"] else 0.0,
+        "daily_sales": daily,
+        "category_sales": category_sales,
+        "segment_profit": segment_profit,
+    }
+
+
+def engine_table_page(
+    page: int = 1,
+    page_size: int = 50,
+    sort_by: str = "order_date",
+    ascending: bool = False,
+    filters: Optional[Dict[str, Any]] = None,
+    search: Optional[str] = None,
+) -> Tuple[pd.DataFrame, int]:
+    """One page of the filtered rows, sorted and sliced by the engine.
+
+    Ties are broken on the remaining columns so pages never overlap.
+    """
+    if sort_by not in ENGINE_COLUMN_TYPES:
+        raise ValueError(f"cannot sort by {sort_by!r}")
+    where_sql, params = build_engine_where(filters)
+    term = (search or "").strip().lower()
+    if term:
+        matches = " OR ".join(
+            f"contains(lower({column}), ?)" for column in SEARCH_COLUMNS
+        )
+        where_sql = (
+            f"{where_sql} AND ({matches})" if where_sql else f"WHERE ({matches})"
+        )
+        params = params + [term] * len(SEARCH_COLUMNS)
+    direction = "ASC" if ascending else "DESC"
+    order = ", ".join(
+        [f"{sort_by} {direction} NULLS LAST"]
+        + [c for c in ENGINE_COLUMN_TYPES if c != sort_by]
+    )
+    with span("engine_page") as timing:
+        df = _engine_query(
+            ", ".join(ENGINE_COLUMN_TYPES),
+            filters,
+            f"ORDER BY {order} LIMIT ? OFFSET ?",
+            [page_size, max(page - 1, 0) * page_size],
+            (where_sql, params),
+        )
+        timing.measure(df)
+        total = int(
+            _engine_query("COUNT(*) AS n", filters, where=(where_sql, params))["n"][0]
+        )
+    return normalize_sales_frame(ensure_datetime(df)), total
 
-    return load_csv_data()
+
+def engine_filter_options() -> Dict[str, Any]:
+    """Sidebar choices from ``SELECT DISTINCT`` queries and the date bounds."""
+    options: Dict[str, Any] = {}
+    for column in FILTER_DIMENSIONS:
+        values = _engine_query(f"DISTINCT {column}", None, f"ORDER BY {column}")[column]
+        options[column] = values.dropna().tolist()
+    bounds = _engine_query(
+        "MIN(order_date) AS low, MAX(order_date) AS high", None
+    ).iloc[0]
+    options["order_date"] = (
+        (pd.Timestamp(bounds["low"]), pd.Timestamp(bounds["high"]))
+        if not pd.isna(bounds["low"])
+        else None
+    )
+    return options
+
+
+def get_sales_summary(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Summarise the filtered sales, aggregating inside MongoDB or the engine
+    when possible."""
+
+    def load() -> Dict[str, Any]:
+        if _uses_mongo(source):
+            coll = get_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+            if coll is not None and _collection_has_documents(coll):
+                try:
+                    return aggregate_sales_in_mongo(coll, filters)
+                except Exception:
+                    pass
+        if source == "engine" and get_engine_connection() is not None:
+            try:
+                return aggregate_sales_in_engine(filters)
+            except Exception:
+                pass
+        if _pruned_date_range(filters) is not None:
+            # the cube would need every partition; these rows are few
+            return summarize_sales(_csv_rows(filters))
+        return _cached_csv_cube().summary(filters)
+
+    return _cached_load(
+        "summary",
+        source,
+        mongo_uri,
+        mongo_db,
+        mongo_collection,
+        load,
+        _freeze_filters(filters),
+    )
+
+
+class SharedDataset:
+    """A read-only, versioned snapshot of a dataset, shared by every session.
+
+    The frame is held once per process and ``view`` hands out
+    ``reader_view``s of it: with pandas copy-on-write on, as in the
+    dashboards, a session holds a few hundred bytes whatever the size of the
+    data; without it each view is a copy. Either way no reader can change it. Snapshots are never
+    modified: new data is published as a new snapshot, and a reader keeps a
+    consistent ``frame``, ``version``, ``cube``, ``index`` and ``table``.
+    """
+
+    __slots__ = ("frame", "version", "cube", "_index", "_table")
+
+    def __init__(
+        self, frame: pd.DataFrame, version: Any, cube: Optional["RollupCube"] = None
+    ) -> None:
+        for name, value in (("frame", frame), ("version", version), ("cube", cube)):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "_index", None)
+        object.__setattr__(self, "_table", None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"SharedDataset is read-only, cannot set {name!r}")
+
+    @property
+    def index(self) -> FilterIndex:
+        # built lazily; concurrent first readers may both build it, one wins
+        if self._index is None:
+            object.__setattr__(self, "_index", FilterIndex(self.frame))
+        return self._index
+
+    @property
+    def table(self) -> PagedTable:
+        if self._table is None:
+            object.__setattr__(self, "_table", PagedTable(self.frame, self.index))
+        return self._table
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.frame.memory_usage(deep=True).sum())
+
+    def view(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """A ``reader_view`` of the frame (or of ``columns`` of it)."""
+        if columns is not None:
+            # a column subset is already a copy, or lazily one under CoW
+            return self.frame[[c for c in columns if c in self.frame.columns]]
+        return reader_view(self.frame)
+
+    def select(self, filters: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """Rows matching ``filters``; a ``reader_view`` when every row matches."""
+        return self.index.select(filters)
+
+
+class IncrementalDataset:
+    """A sales dataset that grows by appending new rows instead of reloading.
+
+    The first ``refresh`` loads the whole source. Later calls fetch only the
+    rows past the high-water mark ``watermark`` (the newest Mongo ``_id``, the
+    CSV byte offset read so far, or a digest of the partition files loaded),
+    append them to ``frame`` and fold them into ``cube``; the filter index is
+    rebuilt lazily on the next ``select``. A CSV that was truncated or
+    rewritten, or a loaded partition that changed, triggers a full ``reload``.
+
+    The mark assumes an append-only source: new documents need increasing
+    ``_id`` values (the driver default) and in-place updates or deletes are
+    only picked up by ``reload``. Each load or append publishes a new
+    ``SharedDataset`` as ``snapshot``; ``frame``, ``cube``, ``version``,
+    ``index`` and ``table`` read the current one, and readers that need
+    several of them together should take ``snapshot`` once.
+    """
+
+    def __init__(
+        self,
+        source: str = "auto",
+        mongo_uri: Optional[str] = None,
+        mongo_db: Optional[str] = None,
+        mongo_collection: Optional[str] = None,
+        min_interval: Optional[float] = None,
+    ) -> None:
+        self.source = source
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.mongo_collection = mongo_collection
+        if min_interval is None:
+            min_interval = float(os.environ.get("INCREMENTAL_MIN_INTERVAL", "1.0"))
+        self.min_interval = min_interval
+        self.watermark: Any = None
+        self.last_refresh = 0.0
+        self._coll = None
+        self._stale = False
+        self._loads = 0
+        empty = normalize_sales_frame(
+            ensure_datetime(pd.DataFrame(columns=list(DASHBOARD_COLUMNS)))
+        )
+        self.snapshot = SharedDataset(empty, self._version_of(empty))
+        self._csv_header = b""
+        self._csv_tail = b""
+        self._partitions: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _version_of(self, frame: pd.DataFrame) -> Tuple[Any, ...]:
+        return (
+            "incremental",
+            self.source,
+            self.mongo_uri,
+            self.mongo_db,
+            self.mongo_collection,
+            self.watermark,
+            len(frame),
+            # reloads after in-place edits keep the mark and the row count
+            self._loads,
+        )
+
+    def _publish(self, frame: pd.DataFrame, cube: "RollupCube") -> None:
+        self.snapshot = SharedDataset(frame, cube.version, cube)
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        return self.snapshot.frame
+
+    @property
+    def cube(self) -> Optional["RollupCube"]:
+        return self.snapshot.cube
+
+    @property
+    def version(self) -> Tuple[Any, ...]:
+        return self.snapshot.version
+
+    @property
+    def index(self) -> FilterIndex:
+        return self.snapshot.index
+
+    @property
+    def table(self) -> PagedTable:
+        return self.snapshot.table
+
+    def select(self, filters: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        return self.snapshot.select(filters)
+
+    def summary(self, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self.ensure_loaded()
+        return self.cube.summary(filters)
+
+    def ensure_loaded(self) -> None:
+        """Load the source if it was never loaded or has been invalidated."""
+        if self.cube is None or self._stale:
+            self.refresh()
+
+    def refresh(self, force: bool = False) -> int:
+        """Append rows added since the last call; returns how many were added.
+
+        Calls within ``min_interval`` seconds of the previous one return 0
+        without touching the source unless ``force`` is set.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.cube is None or self._stale:
+                self._reload()
+                return len(self.frame)
+            if not force and now - self.last_refresh < self.min_interval:
+                return 0
+            self.last_refresh = now
+            if self._coll is not None:
+                try:
+                    rows = self._mongo_delta()
+                except Exception:
+                    return 0
+            else:
+                rows = self._csv_delta()
+                if rows is None:
+                    self._reload()
+                    return len(self.frame)
+            if rows.empty:
+                return 0
+            self._append(rows)
+            return len(rows)
+
+    def reload(self) -> None:
+        """Discard the data and the mark, and load the source from scratch."""
+        with self._lock:
+            self._reload()
+
+    def invalidate(self) -> None:
+        """Reload from scratch on the next ``refresh``."""
+        self._stale = True
+
+    @property
+    def collection(self):
+        """The Mongo collection being followed, or ``None`` for the CSV."""
+        return self._coll
+
+    def _reload(self) -> None:
+        self._stale = False
+        self._loads += 1
+        self.last_refresh = time.monotonic()
+        self._coll = None
+        frame = None
+        if _uses_mongo(self.source):
+            coll = get_mongo_collection(
+                self.mongo_uri, self.mongo_db, self.mongo_collection
+            )
+            if coll is not None and _collection_has_documents(coll):
+                try:
+                    frame = self._mongo_initial(coll)
+                    self._coll = coll
+                except DatasetTooLargeError:
+                    raise
+                except Exception:
+                    frame = None
+        if frame is None:
+            frame = self._csv_initial()
+        self._publish(frame, RollupCube(frame, version=self._version_of(frame)))
+
+    def _append(self, rows: pd.DataFrame) -> None:
+        rows = normalize_sales_frame(ensure_datetime(rows))
+        frame = concat_sales_frames([self.frame, rows])
+        self._publish(frame, self.cube.appended(rows, version=self._version_of(frame)))
+
+    def _mongo_initial(self, coll) -> pd.DataFrame:
+        # pin the mark first so documents inserted mid-load arrive as a delta
+        newest = coll.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        self.watermark = newest["_id"] if newest else None
+        return _read_mongo_collection(
+            coll,
+            {"_id": {"$lte": self.watermark}},
+            build_mongo_projection(DASHBOARD_COLUMNS),
+        )
+
+    def _mongo_delta(self) -> pd.DataFrame:
+        coll = self._coll
+        newest = coll.find_one(
+            {"_id": {"$gt": self.watermark}}, {"_id": 1}, sort=[("_id", -1)]
+        )
+        if newest is None:
+            return pd.DataFrame()
+        rows = stream_mongo_frame(
+            coll.find(
+                {"_id": {"$gt": self.watermark, "$lte": newest["_id"]}},
+                build_mongo_projection(DASHBOARD_COLUMNS),
+            )
+        )
+        self.watermark = newest["_id"]
+        return rows
+
+    def _csv_initial(self) -> pd.DataFrame:
+        if DATA_PATH.is_dir():
+            # the stats are taken first, so files added meanwhile come as a delta
+            self._partitions = _partition_stats()
+            self.watermark = _partition_digest(self._partitions)
+            return read_csv_partitions([DATA_PATH / name for name in self._partitions])
+        before = DATA_PATH.stat()
+        frame = load_csv_data()
+        with open(DATA_PATH, "rb") as fh:
+            header = fh.readline()
+            size = os.fstat(fh.fileno()).st_size
+            fh.seek(max(size - 512, 0))
+            tail = fh.read()
+        after = DATA_PATH.stat()
+        unchanged = (before.st_mtime_ns, before.st_size) == (
+            after.st_mtime_ns,
+            after.st_size,
+        )
+        if unchanged and tail.endswith(b"\n"):
+            # the (possibly columnar-cached) load covers the file up to ``size``
+            self._csv_header, self._csv_tail, self.watermark = header, tail, size
+            return frame
+        # the file is mid-write: parse complete lines only and tail from there
+        self._csv_header, self._csv_tail, self.watermark = b"", b"", 0
+        rows = self._csv_delta()
+        if rows is None or rows.empty:
+            rows = pd.DataFrame(columns=list(DASHBOARD_COLUMNS))
+        return normalize_sales_frame(ensure_datetime(rows))
+
+    def _csv_delta(self) -> Optional[pd.DataFrame]:
+        """Rows appended to the CSV past ``watermark``; ``None`` if it was rewritten."""
+        if DATA_PATH.is_dir():
+            return self._partitions_delta()
+        with open(DATA_PATH, "rb") as fh:
+            header = fh.readline()
+            if not self._csv_header:
+                self._csv_header, self.watermark = header, fh.tell()
+            elif header != self._csv_header:
+                return None
+            size = os.fstat(fh.fileno()).st_size
+            if size < self.watermark:
+                return None
+            if self._csv_tail:
+                fh.seek(self.watermark - len(self._csv_tail))
+                if fh.read(len(self._csv_tail)) != self._csv_tail:
+                    return None
+            fh.seek(self.watermark)
+            data = fh.read(size - self.watermark)
+        # a trailing partial line waits until its newline has been written
+        data = data[: data.rfind(b"\n") + 1]
+        if not data:
+            return pd.DataFrame()
+        self.watermark += len(data)
+        self._csv_tail = data[-512:]
+        return pd.read_csv(io.BytesIO(self._csv_header + data))
+
+    def _partitions_delta(self) -> Optional[pd.DataFrame]:
+        """Rows of partition files added since the last load; ``None`` if a
+        loaded partition changed or disappeared."""
+        stats = _partition_stats()
+        if any(stats.get(name) != stat for name, stat in self._partitions.items()):
+            return None
+        added = [name for name in stats if name not in self._partitions]
+        if not added:
+            return pd.DataFrame()
+        rows = read_csv_partitions([DATA_PATH / name for name in added])
+        self._partitions = stats
+        self.watermark = _partition_digest(stats)
+        return rows
+
+
+_INCREMENTAL_DATASETS: Dict[Tuple[Any, ...], IncrementalDataset] = {}
+_INCREMENTAL_DATASETS_LOCK = threading.Lock()
+
+
+def get_incremental_dataset(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+) -> IncrementalDataset:
+    """The process-wide ``IncrementalDataset`` for a source, shared by sessions.
+
+    Call ``refresh()`` on it (cheap when nothing changed) before reading.
+    """
+    key = (source, mongo_uri, mongo_db, mongo_collection)
+    with _INCREMENTAL_DATASETS_LOCK:
+        dataset = _INCREMENTAL_DATASETS.get(key)
+        if dataset is None:
+            dataset = _INCREMENTAL_DATASETS[key] = IncrementalDataset(*key)
+        return dataset
+
+
+class DatasetWatcher:
+    """Background thread that keeps an ``IncrementalDataset`` up to date.
+
+    With MongoDB it follows a change stream; where change streams are not
+    available (standalone servers, local stand-ins, the CSV) it polls the
+    dataset's high-water mark every ``poll_interval`` seconds instead.
+
+    Bursts are coalesced: after the first change event the watcher keeps
+    draining the stream until it has been quiet for ``debounce`` seconds (or
+    ``max_delay`` seconds have passed) and then fetches the whole delta with
+    one ``refresh``. Inserts are appended; updates and deletes reload the
+    dataset. ``generation`` increases once per applied change, so sessions can
+    compare it with the value they rendered and rerun only when it moved, or
+    block on ``wait``.
+    """
+
+    def __init__(
+        self,
+        dataset: IncrementalDataset,
+        poll_interval: Optional[float] = None,
+        debounce: Optional[float] = None,
+        max_delay: Optional[float] = None,
+    ) -> None:
+        self.dataset = dataset
+        if poll_interval is None:
+            poll_interval = float(os.environ.get("LIVE_POLL_INTERVAL", "2.0"))
+        if debounce is None:
+            debounce = float(os.environ.get("LIVE_DEBOUNCE", "0.5"))
+        if max_delay is None:
+            max_delay = float(os.environ.get("LIVE_MAX_DELAY", "5.0"))
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.generation = 0
+        self.mode = "stopped"
+        self.last_change: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._streams_supported = True
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "DatasetWatcher":
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="dataset-watcher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.mode = "stopped"
+
+    def wait(self, generation: int, timeout: Optional[float] = None) -> int:
+        """Block until ``generation`` is outdated (or ``timeout``); returns the current one."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.generation != generation or self._stop.is_set(), timeout
+            )
+            return self.generation
+
+    def _run(self) -> None:
+        try:
+            self.dataset.refresh()
+        except Exception as exc:
+            self.last_error = str(exc)
+        while not self._stop.is_set():
+            stream = self._open_change_stream()
+            if stream is None:
+                self.mode = "poll"
+                self._apply(reload=False)
+                self._stop.wait(self.poll_interval)
+                continue
+            self.mode = "change-stream"
+            try:
+                self._follow(stream)
+            except Exception as exc:
+                # e.g. a dropped connection; reopen (or poll) on the next turn
+                self.last_error = str(exc)
+                self._stop.wait(self.poll_interval)
+            finally:
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+
+    def _open_change_stream(self):
+        coll = self.dataset.collection
+        if coll is None or not self._streams_supported:
+            return None
+        try:
+            return coll.watch(max_await_time_ms=max(int(self.debounce * 1000), 1))
+        except Exception as exc:
+            self._streams_supported = False
+            self.last_error = str(exc)
+            return None
+
+    def _follow(self, stream) -> None:
+        while not self._stop.is_set():
+            change = stream.try_next()
+            if change is None:
+                continue
+            reload = change.get("operationType") != "insert"
+            deadline = time.monotonic() + self.max_delay
+            # try_next returns None once the stream was quiet for ``debounce``
+            while time.monotonic() < deadline and not self._stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    break
+                reload = reload or change.get("operationType") != "insert"
+            self._apply(reload)
+
+    def _apply(self, reload: bool) -> None:
+        try:
+            if reload:
+                self.dataset.reload()
+                changed = True
+            else:
+                changed = self.dataset.refresh(force=True) > 0
+        except Exception as exc:
+            self.last_error = str(exc)
+            return
+        if changed:
+            with self._changed:
+                self.generation += 1
+                self.last_change = time.time()
+                self._changed.notify_all()
+
+
+_DATASET_WATCHERS: Dict[Tuple[Any, ...], DatasetWatcher] = {}
+
+
+def get_dataset_watcher(
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+) -> DatasetWatcher:
+    """The running watcher for ``get_incremental_dataset`` of the same source."""
+    key = (source, mongo_uri, mongo_db, mongo_collection)
+    dataset = get_incremental_dataset(*key)
+    with _INCREMENTAL_DATASETS_LOCK:
+        watcher = _DATASET_WATCHERS.get(key)
+        if watcher is None or watcher.dataset is not dataset:
+            if watcher is not None:
+                watcher.stop(timeout=0)
+            watcher = _DATASET_WATCHERS[key] = DatasetWatcher(dataset)
+        return watcher.start()
+
+
+def stop_dataset_watchers() -> None:
+    with _INCREMENTAL_DATASETS_LOCK:
+        watchers = list(_DATASET_WATCHERS.values())
+        _DATASET_WATCHERS.clear()
+    for watcher in watchers:
+        watcher.stop()
+
+
+atexit.register(stop_dataset_watchers)
+
+
+# How a dashboard run gets its data: "rows" loads the filtered rows and
+# summarises them, "aggregate" summarises inside MongoDB and only loads a
+# preview, "live" reads the shared IncrementalDataset.
+PIPELINE_MODES = ("rows", "aggregate", "live")
+
+
+def pipeline_mode(source: str, live_refresh: bool, aggregate_in_db: bool) -> str:
+    """The ``run_pipeline`` mode for a dashboard's source and sidebar toggles."""
+    if live_refresh:
+        return "live"
+    if aggregate_in_db or source == "engine":
+        # KPIs and charts are answered by queries; only a preview is loaded
+        return "aggregate"
+    return "rows"
+
+
+def stage_key(*inputs: Any) -> str:
+    """Hash of a pipeline stage's inputs, e.g. the upstream key plus options."""
+    payload = json.dumps([repr(value) for value in inputs], default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Hash of a frame's contents, column names and dtypes (not its index)."""
+    digest = hashlib.sha256(repr(list(df.dtypes.astype(str).items())).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def run_stage(name: str, compute: Callable[[], Any], key: Optional[str] = None) -> Any:
+    """Run one pipeline stage inside a ``span`` named after it.
+
+    With a ``key`` (see ``stage_key``) the result is memoised in
+    ``STAGE_CACHE``, so a rerun whose inputs hash the same skips the
+    stage; the span then records ``cached=True``.
+    """
+    with span(name) as timing:
+        if key is None:
+            value = compute()
+        else:
+            computed = []
+
+            def load() -> Any:
+                computed.append(True)
+                return compute()
+
+            value = STAGE_CACHE.get((name, key), load)
+            timing["cached"] = not computed
+        timing.measure(value)
+    return value
+
+
+def pipeline_version(
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+) -> Any:
+    """Version of the data a pipeline run reads; every stage key starts from it."""
+    if mode == "live":
+        dataset = get_incremental_dataset(source, mongo_uri, mongo_db, mongo_collection)
+        dataset.ensure_loaded()
+        return dataset.version
+    return get_source_version(source, mongo_uri, mongo_db, mongo_collection)
+
+
+def load_stage(
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    preview_rows: int = 50,
+    progress: Optional[Callable[[int], None]] = None,
+) -> pd.DataFrame:
+    """Load, normalise and filter the sales rows for ``mode``.
+
+    Filtering is pushed into the load (a MongoDB query, a ``FilterIndex``
+    lookup), and the result is cached in ``DATAFRAME_CACHE`` by source and
+    filters. In "aggregate" mode only ``preview_rows`` rows are loaded. In
+    "live" mode sessions with the same filters share the rows selected from
+    the dataset's current snapshot and each gets a view of them.
+    """
+    if mode == "live":
+        dataset = get_incremental_dataset(source, mongo_uri, mongo_db, mongo_collection)
+        dataset.ensure_loaded()
+        snapshot = dataset.snapshot
+        rows = DATAFRAME_CACHE.get(
+            ("live-rows", snapshot.version, _freeze_filters(filters)),
+            lambda: snapshot.select(filters),
+        )
+        return reader_view(rows)
+    return get_dataframe(
+        source,
+        mongo_uri,
+        mongo_db,
+        mongo_collection,
+        filters=filters,
+        columns=list(DASHBOARD_COLUMNS),
+        limit=preview_rows if mode == "aggregate" else None,
+        progress=progress,
+    )
+
+
+def aggregate_stage(
+    rows: pd.DataFrame,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+) -> Dict[str, Any]:
+    """KPIs and chart frames for the filtered ``rows`` (see ``summarize_sales``).
+
+    Uses the rollup cube of an incremental dataset or of the CSV, or MongoDB's
+    ``$group``, whenever they can answer instead of summarising ``rows``.
+    """
+    if mode == "live":
+        dataset = get_incremental_dataset(source, mongo_uri, mongo_db, mongo_collection)
+        return dataset.summary(filters)
+    if mode == "rows" and mongo_uri and _uses_mongo(source):
+        return summarize_sales(rows)
+    return get_sales_summary(source, mongo_uri, mongo_db, mongo_collection, filters)
+
+
+def chart_stage(
+    summary: Dict[str, Any], max_points: Optional[int] = None
+) -> Dict[str, Any]:
+    """Chart-ready frames from a summary.
+
+    Returns the downsampled ``trend`` and its ``resolution``, sales per
+    category (``category_sales``) and per subcategory (``subcategory_sales``)
+    and ``segment_profit``.
+    """
+    trend, resolution = downsample_trend(summary["daily_sales"], max_points)
+    subcategory_sales = summary["category_sales"]
+    return {
+        "trend": trend,
+        "resolution": resolution,
+        "category_sales": sum_by(subcategory_sales, ["category"], "sales"),
+        "subcategory_sales": subcategory_sales,
+        "segment_profit": summary["segment_profit"],
+    }
+
+
+def run_pipeline(
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    preview_rows: int = 50,
+    max_points: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Any]:
+    """Run the load, aggregate and chart stages for one filter state.
+
+    Returns the data ``version``, the filtered ``rows`` (a preview in
+    "aggregate" mode), the ``summary``, the ``charts`` frames and ``key``, the
+    input hash of the charts, from which render stages derive their own keys.
+    Every stage is timed with ``span``; stages whose input hash is unchanged
+    since an earlier run, in any session, are served from cache.
+    """
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"mode must be one of {PIPELINE_MODES}, got {mode!r}")
+    source_kwargs = dict(
+        source=source,
+        mongo_uri=mongo_uri,
+        mongo_db=mongo_db,
+        mongo_collection=mongo_collection,
+    )
+    with span("version"):
+        version = pipeline_version(mode, **source_kwargs)
+    rows = run_stage(
+        "load",
+        lambda: load_stage(
+            filters, mode, preview_rows=preview_rows, progress=progress, **source_kwargs
+        ),
+    )
+    summary_key = filter_state_key(version, filters)
+    summary = run_stage(
+        "aggregate",
+        lambda: aggregate_stage(rows, filters, mode, **source_kwargs),
+        key=summary_key,
+    )
+    charts_key = stage_key(summary_key, max_points)
+    charts = run_stage(
+        "chart_data", lambda: chart_stage(summary, max_points), charts_key
+    )
+    return {
+        "version": version,
+        "rows": rows,
+        "summary": summary,
+        "charts": charts,
+        "key": charts_key,
+    }
+
+
+def default_filters(options: Dict[str, Any]) -> Dict[str, Any]:
+    """The sidebar's initial selection for ``get_filter_options`` choices:
+    every value and the whole date range."""
+    selection: Dict[str, Any] = {
+        column: list(options.get(column) or []) for column in FILTER_DIMENSIONS
+    }
+    bounds = options.get("order_date")
+    selection["order_date"] = (bounds[0].date(), bounds[1].date()) if bounds else None
+    return selection
+
+
+def warm_up(
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    after: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> Dict[str, Any]:
+    """Load a source and run ``run_pipeline`` for the default filters.
+
+    Fills the caches the first visitor would otherwise fill, with the same
+    keys; in "live" mode the choices come from the incremental dataset, as
+    in ``app.py``'s sidebar. ``after`` receives the pipeline result, e.g. to
+    build its figures.
+    """
+    source_kwargs = dict(
+        source=source,
+        mongo_uri=mongo_uri,
+        mongo_db=mongo_db,
+        mongo_collection=mongo_collection,
+    )
+    if mode == "live":
+        dataset = get_incremental_dataset(**source_kwargs)
+        dataset.refresh()
+        options = filter_options_from_frame(dataset.snapshot.frame)
+    else:
+        options = get_filter_options(**source_kwargs)
+    pipeline = run_pipeline(default_filters(options), mode, **source_kwargs)
+    if after is not None:
+        after(pipeline)
+    return pipeline
+
+
+_WARM_UPS: Dict[Tuple[Any, ...], threading.Thread] = {}
+_WARM_UPS_LOCK = threading.Lock()
+
+
+def warm_up_enabled() -> bool:
+    return os.environ.get("WARM_UP", "1").lower() not in ("0", "false", "no")
+
+
+def start_warm_up(
+    mode: str = "rows",
+    source: str = "auto",
+    mongo_uri: Optional[str] = None,
+    mongo_db: Optional[str] = None,
+    mongo_collection: Optional[str] = None,
+    after: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> Optional[threading.Thread]:
+    """Run ``warm_up`` once per process on a background thread.
+
+    Later calls with the same source and mode return the same thread, so an
+    app can call this on every rerun. Returns ``None`` when ``WARM_UP=0``.
+    A failed warm-up is ignored; sessions then load the data themselves.
+    """
+    if not warm_up_enabled():
+        return None
+    key = (mode, source, mongo_uri, mongo_db, mongo_collection)
+    with _WARM_UPS_LOCK:
+        thread = _WARM_UPS.get(key)
+        if thread is None:
+
+            def run() -> None:
+                try:
+                    warm_up(*key, after=after)
+                except Exception:
+                    pass
+
+            thread = _WARM_UPS[key] = threading.Thread(
+                target=run, name="warm-up", daemon=True
+            )
+            thread.start()
+    return thread
+
+
+def _to_bson_value(value: Any) -> Any:
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return None
+    if hasattr(value, "to_pydatetime"):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        # numpy scalars -> plain Python values BSON can encode
+        return value.item()
+    return value
+
+
+def _changed_cells(before: pd.DataFrame, after: pd.DataFrame, columns: List[str]):
+    changed = pd.DataFrame(False, index=after.index, columns=columns)
+    for column in columns:
+        new = after[column]
+        if column not in before.columns:
+            changed[column] = new.notna()
+            continue
+        old = before[column]
+        try:
+            same = old.eq(new)
+        except TypeError:
+            same = old.astype(object).eq(new.astype(object))
+        changed[column] = ~(same | (old.isna() & new.isna()))
+    return changed
+
+
+def editable_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """A copy of ``df`` that ``st.data_editor`` can write any edit into.
+
+    The editor sets cells in place, which fails for a value outside a
+    downcast integer column (e.g. 40000 in int16) or a new category, so
+    categoricals become object columns and integers int64.
+    """
+    frame = df.copy()
+    for column in frame.columns:
+        dtype = frame[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(object)
+        elif pd.api.types.is_integer_dtype(dtype) and dtype != "int64":
+            frame[column] = frame[column].astype("int64")
+    return frame
+
+
+def diff_edits(
+    original: pd.DataFrame, edited: pd.DataFrame, key: str = "_id"
+) -> Dict[str, List[Any]]:
+    """Work out what ``st.data_editor`` changed, column by column.
+
+    Rows are matched on the index the editor preserves. Returns ``updates``
+    as ``(row, key, {column: value})`` with only the changed cells,
+    ``inserts`` as ``(row, document)`` for rows added in the editor and
+    ``deletes`` as ``(row, key)`` for rows removed from it. Derived columns
+    and the key itself are never part of an update.
+    """
+    columns = [c for c in edited.columns if c != key and c not in DERIVED_COLUMNS]
+    kept = original.index.intersection(edited.index)
+    before = original.loc[kept]
+    after = edited.loc[kept]
+    changed = _changed_cells(before, after, columns)
+
+    updates = []
+    dirty = changed.any(axis=1)
+    for row in dirty.index[dirty.to_numpy()]:
+        row_changes = changed.loc[row]
+        cells = {
+            column: _to_bson_value(after.at[row, column])
+            for column in row_changes.index[row_changes.to_numpy()]
+        }
+        updates.append((row, before.at[row, key] if key in before else None, cells))
+
+    inserts = []
+    for row in edited.index.difference(original.index):
+        document = {
+            column: _to_bson_value(value)
+            for column, value in edited.loc[row].items()
+            if column not in DERIVED_COLUMNS
+        }
+        if not document.get(key):
+            document.pop(key, None)
+        inserts.append((row, document))
+
+    deletes = [
+        (row, original.at[row, key] if key in original else None)
+        for row in original.index.difference(edited.index)
+    ]
+    return {"updates": updates, "inserts": inserts, "deletes": deletes}
+
+
+def write_edits_to_mongo(coll, diff: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Apply a ``diff_edits`` result with a single unordered ``bulk_write``.
+
+    Returns one outcome per edited row with ``row``, ``action``, ``_id``,
+    ``status`` (``ok``, ``error`` or ``skipped``) and ``detail``.
+    """
+    from bson import ObjectId  # type: ignore
+    from pymongo import DeleteOne, InsertOne, UpdateOne  # type: ignore
+    from pymongo.errors import BulkWriteError  # type: ignore
+
+    outcomes: List[Dict[str, Any]] = []
+    ops = []
+    op_outcomes: List[Dict[str, Any]] = []
+    inserted: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+
+    def object_id(row: Any, action: str, raw: Any):
+        try:
+            return ObjectId(str(raw))
+        except Exception:
+            outcomes.append(
+                {
+                    "row": row,
+                    "action": action,
+                    "_id": raw,
+                    "status": "skipped",
+                    "detail": f"_id {raw} is not a valid ObjectId",
+                }
+            )
+            return None
+
+    def queue(op, row: Any, action: str, raw_id: Any) -> None:
+        outcome = {
+            "row": row,
+            "action": action,
+            "_id": raw_id,
+            "status": "ok",
+            "detail": "",
+        }
+        ops.append(op)
+        op_outcomes.append(outcome)
+        outcomes.append(outcome)
+
+    for row, raw_id, cells in diff["updates"]:
+        oid = object_id(row, "update", raw_id)
+        if oid is not None:
+            queue(UpdateOne({"_id": oid}, {"$set": cells}), row, "update", raw_id)
+    for row, document in diff["inserts"]:
+        if "_id" in document:
+            oid = object_id(row, "insert", document["_id"])
+            if oid is None:
+                continue
+            document = dict(document, _id=oid)
+        queue(InsertOne(document), row, "insert", document.get("_id"))
+        inserted.append((op_outcomes[-1], document))
+    for row, raw_id in diff["deletes"]:
+        oid = object_id(row, "delete", raw_id)
+        if oid is not None:
+            queue(DeleteOne({"_id": oid}), row, "delete", raw_id)
+
+    if not ops:
+        return outcomes
+    try:
+        coll.bulk_write(ops, ordered=False)
+    except BulkWriteError as exc:
+        for error in exc.details.get("writeErrors", []):
+            outcome = op_outcomes[error["index"]]
+            outcome["status"] = "error"
+            outcome["detail"] = error.get("errmsg", "")
+    for outcome, document in inserted:
+        # pymongo assigns the generated _id onto the queued document
+        if outcome["status"] == "ok" and document.get("_id") is not None:
+            outcome["_id"] = str(document["_id"])
+    return outcomes
@@ -0,0 +1,48 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import streamlit_utils
+
+SCRIPT = Path(__file__).parent.parent / "scripts" / "benchmark.py"
+spec = importlib.util.spec_from_file_location("benchmark", SCRIPT)
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+
+def test_make_sales_frame_matches_csv_columns_and_cardinalities():
+    df = benchmark.make_sales_frame(
+        5000, regions=6, categories=4, subcategories=5, segments=2, days=30
+    )
+    csv_columns = streamlit_utils.DATA_PATH.read_text().splitlines()[0].split(",")
+    assert list(df.columns) == csv_columns
+    assert df["region"].nunique() == 6
+    assert df["category"].nunique() == 4
+    assert df["subcategory"].nunique() == 20
+    assert df["customer_segment"].nunique() == 2
+    assert (df["order_date"].max() - df["order_date"].min()).days < 30
+    # a subcategory belongs to exactly one category
+    assert (df.groupby("subcategory", observed=True)["category"].nunique() == 1).all()
+
+
+def test_main_writes_json_results_and_restores_data_path(tmp_path, capsys):
+    output = tmp_path / "results.json"
+    data_path = streamlit_utils.DATA_PATH
+    benchmark.main(
+        ["--rows", "2000", "--repeat", "1", "--output", str(output)]
+        + ["--cases", "load_csv", "filter_index", "export_csv"]
+    )
+    assert streamlit_utils.DATA_PATH == data_path
+    report = json.loads(output.read_text())
+    assert {r["case"] for r in report["results"]} == {
+        "load_csv",
+        "filter_index",
+        "export_csv",
+    }
+    assert all(r["rows"] == 2000 and r["best_s"] > 0 for r in report["results"])
+
+    benchmark.main(
+        ["--rows", "2000", "--repeat", "1", "--cases", "load_csv"]
+        + ["--compare", str(output)]
+    )
+    assert "vs " in capsys.readouterr().out
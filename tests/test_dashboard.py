@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+
+import streamlit_utils
+from streamlit_utils import (
+    FILTER_STATE_CACHE,
+    STAGE_CACHE,
+    chart_stage,
+    load_csv_data,
+    summarize_sales,
+)
+
+dashboard = pytest.importorskip("dashboard")
+
+ROOT = Path(__file__).parent.parent
+KPIS = ["$251,690", "$50,085", "19.9%", "$10,487"]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.delenv("MONGO_URI", raising=False)
+    FILTER_STATE_CACHE.clear()
+    STAGE_CACHE.clear()
+    yield
+    streamlit_utils.stop_dataset_watchers()
+    streamlit_utils._INCREMENTAL_DATASETS.clear()
+
+
+def test_build_figures_plots_every_chart_frame():
+    charts = chart_stage(summarize_sales(load_csv_data()))
+    figures = dashboard.build_figures(charts)
+    assert set(figures) == {"trend", "category", "subcategory", "segment"}
+    assert figures["trend"].layout.title.text == "Daily sales trend"
+    assert len(figures["subcategory"].data) == charts["category_sales"].shape[0]
+    assert sum(figures["segment"].data[0]["values"]) == pytest.approx(
+        charts["segment_profit"]["profit"].sum()
+    )
+
+
+def test_figure_stage_reuses_figures_whose_frame_and_options_match():
+    charts = chart_stage(summarize_sales(load_csv_data()))
+    first = dashboard.figure_stage({"charts": charts, "key": "v1"})
+    # same aggregates under another pipeline key: nothing is rebuilt
+    again = dashboard.figure_stage({"charts": dict(charts), "key": "v2"})
+    assert all(again[name] is first[name] for name in first)
+
+    changed = dict(charts, trend=charts["trend"].head(3))
+    rebuilt = dashboard.figure_stage({"charts": changed, "key": "v3"})
+    assert rebuilt["trend"] is not first["trend"]
+    assert rebuilt["segment"] is first["segment"]
+
+
+def test_figure_stage_builds_only_the_kinds_asked_for():
+    charts = chart_stage(summarize_sales(load_csv_data()))
+    figures = dashboard.figure_stage({"charts": charts}, ("trend", "segment"))
+    assert set(figures) == {"trend", "segment"}
+    assert STAGE_CACHE.stats()["entries"] == 2
+
+
+@pytest.mark.parametrize("script", ["app.py", "streamlit_ass.py"])
+def test_dashboards_render_headlessly(script):
+    testing = pytest.importorskip("streamlit.testing.v1")
+    at = testing.AppTest.from_file(str(ROOT / script), default_timeout=60).run()
+    assert not at.exception
+    assert [metric.value for metric in at.metric] == KPIS
+    # a rerun with the same inputs is served from the stage cache
+    hits = STAGE_CACHE.hits
+    at.run()
+    assert not at.exception
+    assert STAGE_CACHE.hits > hits
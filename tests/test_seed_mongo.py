@@ -0,0 +1,82 @@
+import datetime
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).parent.parent / "scripts" / "seed_mongo.py"
+spec = importlib.util.spec_from_file_location("seed_mongo", SCRIPT)
+seed_mongo = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(seed_mongo)
+
+
+@pytest.fixture
+def coll():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient()["sales_db"]["sales"]
+
+
+def test_seed_collection_streams_chunks_and_creates_indexes(coll):
+    coll.insert_one({"stale": True})
+    written = seed_mongo.seed_collection(coll, seed_mongo.DEFAULT_CSV, chunk_size=10)
+    assert written == 24
+    assert coll.count_documents({}) == 24
+    assert coll.count_documents({"stale": True}) == 0
+    indexed = {
+        key for index in coll.index_information().values() for key, _ in index["key"]
+    }
+    assert set(seed_mongo.INDEXED_FIELDS) <= indexed
+    assert isinstance(coll.find_one()["order_date"], datetime.datetime)
+
+
+def test_seed_collection_append_keeps_existing_documents(coll):
+    seed_mongo.seed_collection(coll, seed_mongo.DEFAULT_CSV)
+    seed_mongo.seed_collection(coll, seed_mongo.DEFAULT_CSV, mode="append")
+    assert coll.count_documents({}) == 48
+
+
+def test_seed_collection_upsert_keys_on_natural_key():
+    pytest.importorskip("pymongo")
+    calls, indexes = [], []
+
+    class RecordingCollection:
+        def create_index(self, keys, unique=False):
+            indexes.append((keys, unique))
+
+        def bulk_write(self, ops, ordered=True):
+            calls.append((ops, ordered))
+
+    key = ["order_date", "region"]
+    seed_mongo.seed_collection(
+        RecordingCollection(), seed_mongo.DEFAULT_CSV, "upsert", key, chunk_size=20
+    )
+    assert [len(ops) for ops, _ in calls] == [20, 4]
+    assert all(ordered is False for _, ordered in calls)
+    op = calls[0][0][0]
+    assert op._upsert is True
+    assert set(op._filter) == set(key)
+    assert indexes[-1] == ([("order_date", 1), ("region", 1)], True)
+
+
+def test_seed_collection_upsert_refuses_keys_that_repeat(coll, tmp_path):
+    pytest.importorskip("pymongo")
+    csv_path = tmp_path / "extract.csv"
+    text = Path(seed_mongo.DEFAULT_CSV).read_text()
+    csv_path.write_text(text + text.splitlines()[1] + "\n")
+    with pytest.raises(ValueError, match="1 rows"):
+        seed_mongo.seed_collection(
+            coll, csv_path, "upsert", ["order_date", "region"], chunk_size=10
+        )
+    assert coll.count_documents({}) == 0
+    assert (
+        seed_mongo.count_duplicate_keys(
+            seed_mongo.DEFAULT_CSV, ["order_date", "region"], 10
+        )
+        == 0
+    )
+
+
+def test_upsert_mode_requires_an_explicit_key():
+    with pytest.raises(SystemExit):
+        seed_mongo.parse_args(["--mode", "upsert"])
+    assert seed_mongo.parse_args(["--mode", "upsert", "--key", "order_id"]).key
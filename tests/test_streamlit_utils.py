@@ -1,6 +1,112 @@
+import gzip
+import io
+import json
 import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-from streamlit_utils import ensure_datetime, load_csv_data, get_dataframe
+import pytest
+
+import streamlit_utils
+from streamlit_utils import (
+    DATAFRAME_CACHE,
+    EXPORT_CACHE,
+    FILTER_STATE_CACHE,
+    STAGE_CACHE,
+    FILTER_DIMENSIONS,
+    DataFrameCache,
+    DatasetTooLargeError,
+    DatasetWatcher,
+    ExportTooLargeError,
+    FilterIndex,
+    IncrementalDataset,
+    PagedTable,
+    RollupCube,
+    SharedDataset,
+    apply_filters,
+    build_engine_where,
+    build_mongo_query,
+    concat_sales_frames,
+    close_mongo_clients,
+    columnar_cache_path,
+    csv_partitions,
+    default_filters,
+    diff_edits,
+    editable_frame,
+    downsample_trend,
+    export_frame,
+    filter_state_cache_stats,
+    filter_state_key,
+    ensure_datetime,
+    chart_stage,
+    get_dataframe,
+    get_dataset_watcher,
+    get_export,
+    get_filter_options,
+    get_incremental_dataset,
+    get_mongo_client,
+    get_sales_summary,
+    get_table_page,
+    invalidate_dataframe_cache,
+    load_columnar_data,
+    load_csv_data,
+    lttb,
+    normalize_sales_frame,
+    partition_date_range,
+    run_pipeline,
+    run_stage,
+    schema_violations,
+    shutdown_csv_pool,
+    span,
+    stage_cache_stats,
+    stage_key,
+    start_trace,
+    start_warm_up,
+    stop_dataset_watchers,
+    stop_trace,
+    stream_mongo_frame,
+    sum_by,
+    summarize_sales,
+    warm_up,
+    write_columnar_cache,
+    write_edits_to_mongo,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    DATAFRAME_CACHE.clear()
+    FILTER_STATE_CACHE.clear()
+    STAGE_CACHE.clear()
+    EXPORT_CACHE.clear()
+    streamlit_utils._INCREMENTAL_DATASETS.clear()
+    yield
+    stop_dataset_watchers()
+    DATAFRAME_CACHE.clear()
+    FILTER_STATE_CACHE.clear()
+    STAGE_CACHE.clear()
+    streamlit_utils._INCREMENTAL_DATASETS.clear()
+
+
+@pytest.fixture
+def mock_mongo(monkeypatch):
+    # route the client registry through mongomock instead of a live server
+    mongomock = pytest.importorskip("mongomock")
+    created = []
+
+    def factory(uri, **options):
+        client = mongomock.MongoClient(uri, **options)
+        created.append(client)
+        return client
+
+    monkeypatch.setattr(streamlit_utils, "_create_mongo_client", factory)
+    close_mongo_clients()
+    yield created
+    close_mongo_clients()
 
 
 def test_ensure_datetime_adds_month_year():
@@ -27,3 +133,1041 @@ def test_get_dataframe_csv_mode():
     os.environ.pop("MONGO_URI", None)
     auto_df = get_dataframe(source="auto")
     assert not auto_df.empty
+
+
+def test_get_mongo_client_reuses_one_client_per_uri(mock_mongo):
+    first = get_mongo_client("mongodb://localhost:27017/")
+    second = get_mongo_client("mongodb://localhost:27017/")
+    other = get_mongo_client("mongodb://localhost:27017/", maxPoolSize=5)
+    assert first is second
+    assert other is not first
+    assert len(mock_mongo) == 2
+
+
+def test_get_mongo_client_keeps_shared_client_open_when_ping_fails(
+    mock_mongo, monkeypatch
+):
+    ping = streamlit_utils.ping_mongo_client
+    client = get_mongo_client("mongodb://localhost:27017/")
+    closed = []
+    monkeypatch.setattr(client, "close", lambda: closed.append(client))
+    monkeypatch.setattr(streamlit_utils, "ping_mongo_client", lambda c: False)
+    assert get_mongo_client("mongodb://localhost:27017/", ping_interval=0) is None
+    assert not closed
+    monkeypatch.setattr(streamlit_utils, "ping_mongo_client", ping)
+    # the next call pings again and hands out the same client
+    assert get_mongo_client("mongodb://localhost:27017/") is client
+    assert len(mock_mongo) == 1
+
+
+def test_close_mongo_clients_empties_registry(mock_mongo):
+    get_mongo_client("mongodb://localhost:27017/")
+    close_mongo_clients()
+    assert not streamlit_utils._MONGO_CLIENTS
+
+
+MONGO_URI = "mongodb://localhost:27017/"
+
+
+@pytest.fixture
+def seeded_mongo(mock_mongo):
+    docs = pd.read_csv(streamlit_utils.DATA_PATH).to_dict(orient="records")
+    for doc in docs:
+        doc["internal_note"] = "not for the dashboard"
+    get_mongo_client(MONGO_URI)["sales_db"]["sales"].insert_many(docs)
+    return docs
+
+
+def test_build_mongo_query_skips_empty_selections():
+    query = build_mongo_query(
+        {
+            "region": ["North"],
+            "category": [],
+            "order_date": ("2024-01-01", "2024-02-01"),
+        }
+    )
+    assert query["region"] == {"$in": ["North"]}
+    assert "category" not in query
+    assert len(query["$or"]) == 2
+
+
+def test_get_dataframe_pushes_filters_and_projection_to_mongo(seeded_mongo):
+    filters = {
+        "region": ["North", "West"],
+        "customer_segment": ["Consumer"],
+        "order_date": ("2024-01-01", "2024-03-31"),
+    }
+    df = get_dataframe(
+        source="mongo",
+        mongo_uri=MONGO_URI,
+        filters=filters,
+        columns=list(streamlit_utils.DASHBOARD_COLUMNS),
+    )
+    expected = apply_filters(load_csv_data(), filters)
+    assert len(df) == len(expected) > 0
+    assert "internal_note" not in df.columns
+    assert "_id" in df.columns
+    assert sorted(df["sales"]) == sorted(expected["sales"])
+
+
+def test_get_dataframe_mongo_no_match_does_not_fall_back_to_csv(seeded_mongo):
+    df = get_dataframe(
+        source="mongo", mongo_uri=MONGO_URI, filters={"region": ["Atlantis"]}
+    )
+    assert df.empty
+
+
+def test_get_filter_options_from_mongo_matches_csv(seeded_mongo):
+    mongo_options = get_filter_options(source="mongo", mongo_uri=MONGO_URI)
+    csv_options = get_filter_options(source="csv")
+    assert mongo_options == csv_options
+
+
+def test_mongo_date_filter_includes_boundary_days(seeded_mongo):
+    filters = {"order_date": ("2024-01-15", "2024-02-05")}
+    df = get_dataframe(source="mongo", mongo_uri=MONGO_URI, filters=filters)
+    assert len(df) == len(apply_filters(load_csv_data(), filters)) == 3
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [None, {"region": ["North", "East"], "order_date": ("2024-02-01", "2024-06-30")}],
+)
+def test_mongo_aggregation_matches_pandas_summary(seeded_mongo, filters):
+    in_db = get_sales_summary(source="mongo", mongo_uri=MONGO_URI, filters=filters)
+    in_pandas = summarize_sales(apply_filters(load_csv_data(), filters))
+    for key in ("row_count", "total_sales", "total_profit", "avg_margin", "avg_order"):
+        assert in_db[key] == pytest.approx(in_pandas[key])
+    for key in ("daily_sales", "category_sales", "segment_profit"):
+        # pandas keeps categorical group keys, the pipeline returns plain strings
+        pd.testing.assert_frame_equal(
+            in_db[key], in_pandas[key].astype(in_db[key].dtypes), check_dtype=False
+        )
+
+
+def test_stream_mongo_frame_loads_in_batches(seeded_mongo):
+    coll = get_mongo_client(MONGO_URI)["sales_db"]["sales"]
+    seen = []
+    df = stream_mongo_frame(coll.find(), batch_size=5, progress=seen.append)
+    assert seen == [5, 10, 15, 20, 24]
+    assert len(df) == 24
+    assert df.index.is_unique
+    assert pd.api.types.is_datetime64_any_dtype(df["order_date"])
+    assert df["_id"].map(type).eq(str).all()
+    # chunks are normalised as they arrive and their categories merged
+    assert not schema_violations(df)
+    assert set(df["region"].cat.categories) == set(load_csv_data()["region"])
+
+
+def test_stream_mongo_frame_enforces_memory_ceiling(seeded_mongo):
+    with pytest.raises(DatasetTooLargeError):
+        get_dataframe(source="mongo", mongo_uri=MONGO_URI, batch_size=5, max_bytes=1024)
+
+
+def test_get_dataframe_serves_reruns_from_cache():
+    first = get_dataframe(source="csv", filters={"region": ["North"]})
+    second = get_dataframe(source="csv", filters={"region": ["North"]})
+    assert first.equals(second)
+    assert DATAFRAME_CACHE.stats()["hits"] >= 1
+
+
+def test_get_dataframe_reloads_when_csv_changes(tmp_path, monkeypatch):
+    csv_path = tmp_path / "sales.csv"
+    shutil.copy(streamlit_utils.DATA_PATH, csv_path)
+    monkeypatch.setattr(streamlit_utils, "DATA_PATH", csv_path)
+    monkeypatch.setattr(DATAFRAME_CACHE, "check_interval", 0)
+    assert len(get_dataframe(source="csv")) == 24
+
+    lines = csv_path.read_text().splitlines()
+    csv_path.write_text("\n".join(lines[:11]) + "\n")
+    os.utime(csv_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert len(get_dataframe(source="csv")) == 10
+
+
+def test_get_dataframe_reloads_when_mongo_watermark_moves(seeded_mongo, monkeypatch):
+    monkeypatch.setattr(DATAFRAME_CACHE, "check_interval", 0)
+    assert len(get_dataframe(source="mongo", mongo_uri=MONGO_URI)) == 24
+    coll = get_mongo_client(MONGO_URI)["sales_db"]["sales"]
+    coll.insert_one({k: v for k, v in seeded_mongo[0].items() if k != "_id"})
+    assert len(get_dataframe(source="mongo", mongo_uri=MONGO_URI)) == 25
+
+
+def test_dataframe_cache_ttl_and_lru_eviction():
+    cache = DataFrameCache(ttl=60, max_entries=2)
+    calls = []
+
+    def loader(name):
+        return lambda: calls.append(name) or pd.DataFrame({"x": [name]})
+
+    cache.get("a", loader("a"))
+    cache.get("b", loader("b"))
+    cache.get("a", loader("a"))
+    cache.get("c", loader("c"))  # evicts "b", the least recently used
+    cache.get("a", loader("a"))
+    cache.get("b", loader("b"))
+    assert calls == ["a", "b", "c", "b"]
+
+    cache.ttl = 0
+    cache.get("b", loader("b"))
+    assert calls[-1] == "b" and len(calls) == 5
+
+
+OIDS = [
+    "65a1b2c3d4e5f60718293a4b",
+    "65a1b2c3d4e5f60718293a4c",
+    "65a1b2c3d4e5f60718293a4d",
+]
+
+
+def _edit_fixture():
+    original = ensure_datetime(
+        pd.DataFrame(
+            {
+                "_id": OIDS,
+                "order_date": ["2024-01-01", "2024-01-02", "2024-01-03"],
+                "region": ["North", "South", "East"],
+                "sales": [100, 200, 300],
+            }
+        )
+    )
+    edited = original.copy()
+    edited.loc[0, "sales"] = 150
+    edited.loc[1, "region"] = "West"
+    edited.loc[1, "sales"] = 250
+    edited = edited.drop(index=2)
+    edited.loc[3] = {
+        "_id": "",
+        "order_date": pd.Timestamp("2024-02-01"),
+        "region": "North",
+        "sales": 50,
+        "month": pd.Timestamp("2024-02-01"),
+        "year": 2024,
+    }
+    return original, edited
+
+
+def test_diff_edits_reports_changed_cells_inserts_and_deletes():
+    original, edited = _edit_fixture()
+    diff = diff_edits(original, edited)
+    assert diff["updates"] == [
+        (0, OIDS[0], {"sales": 150}),
+        (1, OIDS[1], {"region": "West", "sales": 250}),
+    ]
+    assert [row for row, _ in diff["inserts"]] == [3]
+    assert "_id" not in diff["inserts"][0][1]
+    assert "month" not in diff["inserts"][0][1]
+    assert diff["deletes"] == [(2, OIDS[2])]
+    assert type(diff["updates"][0][2]["sales"]) is int
+
+
+def test_editable_frame_accepts_out_of_range_numbers_and_new_categories():
+    rows = normalize_sales_frame(load_csv_data().head(5))
+    frame = editable_frame(rows)
+    # st.data_editor writes each edited cell with iat
+    frame.iat[0, frame.columns.get_loc("sales")] = 40000
+    frame.iat[1, frame.columns.get_loc("region")] = "Central"
+    assert frame["sales"].iloc[0] == 40000 and frame["region"].iloc[1] == "Central"
+    assert rows["sales"].iloc[0] != 40000
+    diff = diff_edits(editable_frame(rows), frame, key="order_id")
+    assert [cells for _, _, cells in diff["updates"]] == [
+        {"sales": 40000},
+        {"region": "Central"},
+    ]
+
+
+class _RecordingCollection:
+    def __init__(self, fail_index=None):
+        self.calls = []
+        self.fail_index = fail_index
+
+    def bulk_write(self, ops, ordered=True):
+        from pymongo.errors import BulkWriteError
+
+        self.calls.append((ops, ordered))
+        if self.fail_index is not None:
+            raise BulkWriteError(
+                {"writeErrors": [{"index": self.fail_index, "errmsg": "boom"}]}
+            )
+
+
+def test_write_edits_to_mongo_uses_one_unordered_bulk_write():
+    pytest.importorskip("pymongo")
+    original, edited = _edit_fixture()
+    diff = diff_edits(original, edited)
+    diff["updates"].append((9, "not-an-oid", {"sales": 1}))
+    coll = _RecordingCollection(fail_index=1)
+
+    outcomes = write_edits_to_mongo(coll, diff)
+
+    assert len(coll.calls) == 1
+    ops, ordered = coll.calls[0]
+    assert ordered is False
+    assert [type(op).__name__ for op in ops] == [
+        "UpdateOne",
+        "UpdateOne",
+        "InsertOne",
+        "DeleteOne",
+    ]
+    status = {(o["row"], o["action"]): o["status"] for o in outcomes}
+    assert status == {
+        (0, "update"): "ok",
+        (1, "update"): "error",
+        (9, "update"): "skipped",
+        (3, "insert"): "ok",
+        (2, "delete"): "ok",
+    }
+
+
+@pytest.fixture
+def tmp_csv(tmp_path, monkeypatch):
+    csv_path = tmp_path / "sales.csv"
+    shutil.copy(streamlit_utils.DATA_PATH, csv_path)
+    monkeypatch.setattr(streamlit_utils, "DATA_PATH", csv_path)
+    return csv_path
+
+
+def test_load_csv_data_writes_and_then_maps_columnar_cache(tmp_csv, monkeypatch):
+    pytest.importorskip("pyarrow")
+    parsed = load_csv_data()
+    assert columnar_cache_path().exists()
+
+    def no_csv(*args, **kwargs):
+        raise AssertionError("CSV should not be parsed while the cache is fresh")
+
+    monkeypatch.setattr(pd, "read_csv", no_csv)
+    cached = load_csv_data()
+    pd.testing.assert_frame_equal(cached, parsed)
+    assert isinstance(cached["region"].dtype, pd.CategoricalDtype)
+
+    subset = load_csv_data(columns=["order_date", "sales"])
+    assert list(subset.columns) == ["order_date", "sales", "month", "year"]
+
+
+def test_columnar_cache_is_ignored_once_csv_changes(tmp_csv):
+    pytest.importorskip("pyarrow")
+    load_csv_data()
+    lines = tmp_csv.read_text().splitlines()
+    tmp_csv.write_text("\n".join(lines[:5]) + "\n")
+    assert load_columnar_data() is None
+    assert len(load_csv_data()) == 4
+    assert len(load_columnar_data()) == 4
+
+
+def test_columnar_cache_writers_in_threads_do_not_share_a_temp_file(tmp_csv):
+    pytest.importorskip("pyarrow")
+    df = load_csv_data()
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: write_columnar_cache(df), range(8)))
+    assert paths == [columnar_cache_path()] * 8
+    pd.testing.assert_frame_equal(load_columnar_data(), df)
+    assert not list(columnar_cache_path().parent.glob("*.tmp"))
+
+
+def test_loaded_frames_conform_to_sales_schema(seeded_mongo):
+    csv_df = load_csv_data()
+    mongo_df = get_dataframe(source="mongo", mongo_uri=MONGO_URI)
+    for df in (csv_df, mongo_df):
+        assert schema_violations(df) == {}
+        assert isinstance(df["region"].dtype, pd.CategoricalDtype)
+        assert df["sales"].dtype.itemsize <= 4
+
+
+def test_normalize_sales_frame_keeps_gaps_as_float():
+    df = normalize_sales_frame(pd.DataFrame({"sales": [1.0, None], "quantity": [3, 4]}))
+    assert df["sales"].dtype == "float64"
+    assert df["quantity"].dtype == "int8"
+
+
+def test_sum_by_does_not_overflow_downcast_measures():
+    df = normalize_sales_frame(
+        pd.DataFrame({"region": ["North"] * 3, "sales": [2_000_000_000] * 3})
+    )
+    assert df["sales"].dtype == "int32"
+    out = sum_by(df, ["region"], "sales")
+    assert out["sales"].tolist() == [6_000_000_000]
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"region": ["North", "West"]},
+        {"region": ["North"], "category": ["Electronics", "Furniture"]},
+        {"customer_segment": ["Consumer"], "order_date": ("2024-02-05", "2024-08-31")},
+        {"order_date": ("2024-03-01", "2024-03-31")},
+        {"region": ["Atlantis"]},
+    ],
+)
+def test_filter_index_matches_apply_filters(filters):
+    df = load_csv_data()
+    index = FilterIndex(df)
+    pd.testing.assert_frame_equal(index.select(filters), apply_filters(df, filters))
+
+
+@pytest.mark.parametrize("copy_on_write", [True, False])
+def test_filter_index_select_everything_cannot_change_the_frame(copy_on_write):
+    df = load_csv_data()
+    index = FilterIndex(df)
+    with pd.option_context("mode.copy_on_write", copy_on_write):
+        rows = index.select({"region": sorted(df["region"].unique())})
+        # without copy-on-write the rows are a copy, with it they share memory
+        shared = np.shares_memory(rows["sales"].to_numpy(), df["sales"].to_numpy())
+        assert shared == copy_on_write
+        rows.loc[rows.index[0], "sales"] = -1
+    assert df["sales"].iloc[0] != -1
+
+
+CUBE_FILTERS = [
+    {},
+    {"region": ["North", "West"]},
+    {"category": ["Electronics"], "customer_segment": ["Consumer", "Corporate"]},
+    {"region": ["East"], "order_date": ("2024-03-01", "2024-09-30")},
+    {"region": ["Atlantis"]},
+]
+
+
+@pytest.mark.parametrize("filters", CUBE_FILTERS)
+def test_rollup_cube_summary_equals_raw_rows(filters):
+    df = load_csv_data()
+    from_cube = RollupCube(df).summary(filters)
+    from_rows = summarize_sales(apply_filters(df, filters))
+    for key in ("row_count", "total_sales", "total_profit", "avg_margin", "avg_order"):
+        assert from_cube[key] == from_rows[key]
+    for key in ("daily_sales", "category_sales", "segment_profit"):
+        pd.testing.assert_frame_equal(from_cube[key], from_rows[key])
+
+
+def test_rollup_cube_keeps_rows_with_missing_dimensions():
+    df = normalize_sales_frame(
+        pd.DataFrame(
+            {
+                "order_date": pd.to_datetime(["2024-01-01"] * 3),
+                "region": ["North", None, "North"],
+                "sales": [10, 20, 30],
+            }
+        )
+    )
+    cube = RollupCube(df)
+    assert len(cube.frame) == 2
+    assert cube.summary()["total_sales"] == 60
+    assert cube.summary()["row_count"] == 3
+
+
+def test_filter_state_key_is_canonical():
+    a = filter_state_key(
+        ("csv", 1), {"region": ["West", "North"], "category": [], "order_date": None}
+    )
+    b = filter_state_key(("csv", 1), {"region": ["North", "West"]})
+    assert a == b
+    assert filter_state_key(("csv", 2), {"region": ["North", "West"]}) != a
+    assert filter_state_key(("csv", 1), {"region": ["North"]}) != a
+
+
+def test_versioned_cube_memoises_summaries_across_calls():
+    cube = RollupCube(load_csv_data(), version=("csv", "v1"))
+    first = cube.summary({"region": ["North", "West"]})
+    second = cube.summary({"region": ["West", "North"]})
+    assert first is second
+    assert filter_state_cache_stats()["hits"] == 1
+    assert filter_state_cache_stats()["misses"] == 1
+
+    other = RollupCube(load_csv_data(), version=("csv", "v2"))
+    assert other.summary({"region": ["North", "West"]}) is not first
+    assert filter_state_cache_stats()["misses"] == 2
+
+
+NEW_ROWS = (
+    "2024-12-30,Central,Technology,Phones,500,2,120,Corporate\n"
+    "2024-12-31,Central,Furniture,Desks,300,1,-40,Home Office\n"
+)
+
+
+def _assert_same_summary(actual, expected):
+    for key in ("row_count", "total_sales", "total_profit", "avg_margin", "avg_order"):
+        assert actual[key] == pytest.approx(expected[key])
+    for key in ("daily_sales", "category_sales", "segment_profit"):
+        pd.testing.assert_frame_equal(
+            actual[key], expected[key], check_dtype=False, check_categorical=False
+        )
+
+
+def test_rollup_cube_appended_equals_rebuilt_cube():
+    df = load_csv_data()
+    half = len(df) // 2
+    head = df.iloc[:half]
+    # the appended rows include orders in cells the head already filled
+    tail = concat_sales_frames([df.iloc[half:], df.iloc[:3]])
+    head_cube = RollupCube(head)
+    merged = head_cube.appended(tail)
+    rebuilt = RollupCube(concat_sales_frames([head, tail]))
+    assert len(tail) > 3 and merged.source_rows == len(df) + 3
+    assert len(merged.frame) < len(head_cube.frame) + len(RollupCube(tail).frame)
+    _assert_same_summary(merged.summary(), rebuilt.summary())
+    for filters in CUBE_FILTERS:
+        _assert_same_summary(merged.summary(filters), rebuilt.summary(filters))
+
+
+def test_concat_sales_frames_keeps_new_categories_categorical():
+    df = load_csv_data()
+    extra = normalize_sales_frame(ensure_datetime(df.head(1).astype({"region": str})))
+    extra["region"] = pd.Categorical(["Atlantis"])
+    combined = concat_sales_frames([df, extra])
+    assert isinstance(combined["region"].dtype, pd.CategoricalDtype)
+    assert combined["region"].iloc[-1] == "Atlantis"
+    assert len(combined) == len(df) + 1
+
+
+@pytest.mark.parametrize("copy_on_write", [True, False])
+def test_shared_dataset_views_stay_read_only(copy_on_write):
+    df = load_csv_data()
+    snapshot = SharedDataset(df, "v1")
+    # the dashboards switch copy-on-write on in main(); views share memory then
+    with pd.option_context("mode.copy_on_write", copy_on_write):
+        view = snapshot.view()
+        shared = np.shares_memory(view["sales"].to_numpy(), df["sales"].to_numpy())
+        assert shared == copy_on_write
+
+        view.loc[view.index[0], "sales"] = -1
+        view["note"] = "mine"
+        rows = snapshot.select({})
+        rows.loc[rows.index[0], "profit"] = -1
+    assert df["sales"].iloc[0] != -1 and df["profit"].iloc[0] != -1
+    assert "note" not in snapshot.frame
+    assert rows is not df
+    with pytest.raises(AttributeError):
+        snapshot.frame = view
+
+
+def test_incremental_dataset_publishes_new_snapshots(tmp_csv):
+    dataset = IncrementalDataset("csv", min_interval=0)
+    dataset.refresh()
+    before = dataset.snapshot
+    with open(tmp_csv, "a") as fh:
+        fh.write(NEW_ROWS)
+    assert dataset.refresh() == 2
+    assert dataset.snapshot is not before
+    assert len(dataset.frame) == len(before.frame) + 2
+    assert before.version != dataset.version == dataset.cube.version
+
+
+def test_incremental_csv_dataset_parses_only_appended_rows(tmp_csv, monkeypatch):
+    dataset = IncrementalDataset("csv", min_interval=0)
+    assert dataset.refresh() == len(load_csv_data())
+    assert dataset.refresh() == 0
+
+    with open(tmp_csv, "a") as fh:
+        fh.write(NEW_ROWS + "2025-01-01,Central,Tech")
+    monkeypatch.setattr(streamlit_utils, "load_csv_data", None)  # no full reads
+    assert dataset.refresh() == 2
+    assert dataset.frame["region"].iloc[-1] == "Central"
+    assert not schema_violations(dataset.frame)
+
+    # the partial last line is picked up once it is complete
+    with open(tmp_csv, "a") as fh:
+        fh.write("nology,Phones,50,1,5,Consumer\n")
+    assert dataset.refresh() == 1
+
+    expected = normalize_sales_frame(ensure_datetime(pd.read_csv(tmp_csv)))
+    assert len(dataset.frame) == len(expected)
+    filters = {"region": ["Central", "East"]}
+    _assert_same_summary(
+        dataset.summary(filters), summarize_sales(apply_filters(expected, filters))
+    )
+    assert len(dataset.select(filters)) == len(apply_filters(expected, filters))
+
+
+def test_incremental_csv_dataset_reloads_rewritten_file(tmp_csv):
+    dataset = IncrementalDataset("csv", min_interval=0)
+    dataset.refresh()
+    rows = tmp_csv.read_text().splitlines(keepends=True)
+    tmp_csv.write_text("".join(rows[:5]) + NEW_ROWS)
+    assert dataset.refresh() == 6
+    assert dataset.frame["region"].iloc[-1] == "Central"
+
+
+def _new_order_docs():
+    header = streamlit_utils.DATA_PATH.read_text().splitlines()[0]
+    new_docs = pd.read_csv(io.StringIO(header + "\n" + NEW_ROWS))
+    new_docs["order_date"] = pd.to_datetime(new_docs["order_date"])
+    return new_docs.to_dict(orient="records")
+
+
+def test_incremental_mongo_dataset_fetches_documents_past_watermark(seeded_mongo):
+    dataset = get_incremental_dataset("mongo", MONGO_URI)
+    assert dataset is get_incremental_dataset("mongo", MONGO_URI)
+    dataset.min_interval = 0
+    assert dataset.refresh() == len(seeded_mongo)
+    mark = dataset.watermark
+
+    coll = get_mongo_client(MONGO_URI)["sales_db"]["sales"]
+    coll.insert_many(_new_order_docs())
+    assert dataset.refresh() == 2
+    assert dataset.watermark > mark
+    assert "internal_note" not in dataset.frame.columns
+
+    expected = get_dataframe("mongo", MONGO_URI, use_cache=False)
+    _assert_same_summary(dataset.summary(), summarize_sales(expected))
+
+
+def test_dataset_watcher_polls_when_change_streams_are_unavailable(
+    seeded_mongo, monkeypatch
+):
+    monkeypatch.setenv("LIVE_POLL_INTERVAL", "0.05")
+    watcher = get_dataset_watcher("mongo", MONGO_URI)
+    assert watcher is get_dataset_watcher("mongo", MONGO_URI)
+    deadline = time.monotonic() + 5
+    while watcher.mode != "poll" and time.monotonic() < deadline:
+        time.sleep(0.01)  # mongomock has no change streams
+    assert watcher.mode == "poll"
+    generation = watcher.generation
+
+    get_mongo_client(MONGO_URI)["sales_db"]["sales"].insert_many(_new_order_docs())
+    assert watcher.wait(generation, timeout=5) == generation + 1
+    assert len(watcher.dataset.frame) == len(seeded_mongo) + 2
+
+
+class _FakeChangeStream:
+    def __init__(self, events):
+        self.events = list(events)
+
+    def try_next(self):
+        if self.events:
+            return self.events.pop(0)
+        time.sleep(0.01)
+        return None
+
+    def close(self):
+        pass
+
+
+class _FakeDataset:
+    def __init__(self, events):
+        self.collection = self
+        self.events = events
+        self.refreshes = 0
+        self.reloads = 0
+
+    def watch(self, **kwargs):
+        return _FakeChangeStream(self.events)
+
+    def refresh(self, force=False):
+        self.refreshes += 1
+        return 1
+
+    def reload(self):
+        self.reloads += 1
+
+
+def test_dataset_watcher_coalesces_a_burst_of_changes():
+    dataset = _FakeDataset([{"operationType": "insert"}] * 200)
+    watcher = DatasetWatcher(dataset, debounce=0.01, max_delay=5).start()
+    assert watcher.wait(0, timeout=5) == 1
+    time.sleep(0.1)
+    watcher.stop()
+    assert watcher.generation == 1
+    assert dataset.refreshes == 2  # the initial load plus one for the burst
+
+    dataset = _FakeDataset([{"operationType": "insert"}, {"operationType": "update"}])
+    watcher = DatasetWatcher(dataset, debounce=0.01).start()
+    watcher.wait(0, timeout=5)
+    watcher.stop()
+    assert dataset.reloads == 1
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    y[437] = 25.0
+    kept = lttb(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert 437 in kept
+    assert (np.diff(kept) > 0).all()
+
+
+def test_downsample_trend_picks_a_resolution_within_budget():
+    days = pd.date_range("2000-01-01", periods=4000)
+    daily = pd.DataFrame({"order_date": days, "sales": np.ones(4000, dtype="int16")})
+
+    trend, resolution = downsample_trend(daily.head(300), max_points=500)
+    assert resolution == "day" and len(trend) == 300
+
+    trend, resolution = downsample_trend(daily.head(1500), max_points=500)
+    assert resolution == "day" and len(trend) == 500
+
+    trend, resolution = downsample_trend(daily, max_points=500)
+    assert resolution == "week" and len(trend) == 500
+
+    trend, resolution = downsample_trend(daily, max_points=100)
+    assert resolution == "month" and len(trend) == 100
+    assert trend["order_date"].iloc[0] == pd.Timestamp("2000-01-01")
+
+
+def test_paged_table_matches_sorting_the_filtered_frame():
+    df = load_csv_data()
+    table = PagedTable(df)
+    filters = {"region": ["North", "East"]}
+    expected = apply_filters(df, filters)
+    expected = expected[
+        expected["subcategory"].str.contains("a", case=False)
+        | expected["category"].str.contains("a", case=False)
+        | expected["region"].str.contains("a", case=False)
+        | expected["customer_segment"].str.contains("a", case=False)
+    ].sort_values("sales", ascending=False, kind="stable")
+
+    page, total = table.page(2, 3, "sales", False, filters, " A ")
+    assert total == len(expected)
+    pd.testing.assert_frame_equal(page, expected.iloc[3:6])
+    assert table.page(100, 3, "sales", False, filters)[0].empty
+    assert table.nbytes > 0
+
+
+def test_get_table_page_sorts_and_pages_on_mongo(seeded_mongo):
+    filters = {"category": ["Furniture", "Electronics"]}
+    rows, total = get_table_page(
+        "mongo", MONGO_URI, filters=filters, page=2, page_size=4, sort_by="sales"
+    )
+    expected = apply_filters(load_csv_data(), filters).sort_values(
+        "sales", ascending=False
+    )
+    assert total == len(expected)
+    assert rows["sales"].tolist() == expected["sales"].iloc[4:8].tolist()
+    assert "internal_note" not in rows.columns
+
+    # the $regex pushdown matches what the in-memory search matches
+    rows, total = get_table_page("mongo", MONGO_URI, search="offi", page_size=100)
+    assert total == PagedTable(load_csv_data()).page(search="offi")[1] == len(rows)
+
+
+def test_export_frame_writes_chunks_identical_to_to_csv():
+    df = load_csv_data()
+    expected = df.to_csv(index=False).encode("utf-8")
+    assert export_frame(df, "csv", chunk_rows=5) == expected
+    assert gzip.decompress(export_frame(df, "csv.gz", chunk_rows=5)) == expected
+
+
+def test_export_frame_parquet_round_trips():
+    pytest.importorskip("pyarrow")
+    df = load_csv_data()
+    restored = pd.read_parquet(io.BytesIO(export_frame(df, "parquet", chunk_rows=5)))
+    pd.testing.assert_frame_equal(restored, df)
+
+
+def test_export_frame_stops_at_size_cap():
+    with pytest.raises(ExportTooLargeError):
+        export_frame(load_csv_data(), "csv", max_bytes=200, chunk_rows=5)
+
+
+def test_get_export_builds_each_filter_state_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return load_csv_data()
+
+    first = get_export("filtered", ("csv", 1), {"region": ["North"]}, "csv", loader)
+    again = get_export("filtered", ("csv", 1), {"region": ["North"]}, "csv", loader)
+    assert first is again and len(calls) == 1
+    get_export("filtered", ("csv", 2), {"region": ["North"]}, "csv", loader)
+    get_export("filtered", ("csv", 2), {"region": ["North"]}, "csv.gz", loader)
+    assert len(calls) == 3
+
+
+def test_span_is_a_no_op_without_a_trace():
+    assert stop_trace() is None
+    with span("load") as timing:
+        timing["rows"] = 10
+        assert timing.measure(b"abc") == b"abc"
+    assert span("a") is span("b")
+
+
+def test_trace_records_nested_spans_with_rows_and_bytes(tmp_csv, monkeypatch):
+    monkeypatch.setenv("COLUMNAR_CACHE", "0")
+    start_trace("test")
+    with span("load") as timing:
+        df = timing.measure(load_csv_data())
+    with span("export", format="csv") as timing:
+        timing.measure(df.to_csv().encode())
+    trace = stop_trace()
+    assert [r["stage"] for r in trace.records] == [
+        "parse_csv",
+        "normalize",
+        "load",
+        "export",
+    ]
+    assert trace.records[2]["rows"] == len(df) and trace.records[2]["depth"] == 0
+    assert trace.records[0]["depth"] == 1
+    assert trace.records[3]["format"] == "csv" and trace.records[3]["bytes"] > 0
+    frame = trace.frame()
+    assert frame["stage"].tolist() == ["load", "  parse_csv", "  normalize", "export"]
+    assert trace.total_ms >= sum(r["ms"] for r in trace.records if r["depth"] == 0)
+    # the trace is per thread and ends with stop_trace
+    assert span("after") is span("again")
+
+
+def test_stop_trace_logs_one_json_line(monkeypatch, caplog):
+    monkeypatch.setenv("PERF_LOG", "1")
+    start_trace("logged")
+    with span("filter"):
+        pass
+    with caplog.at_level("INFO", logger="streamlit_utils.perf"):
+        stop_trace()
+    (record,) = caplog.records
+    payload = json.loads(record.getMessage())
+    assert payload["trace"] == "logged"
+    assert [s["stage"] for s in payload["spans"]] == ["filter"]
+
+
+def test_run_stage_skips_stages_whose_input_hash_is_unchanged():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pd.DataFrame({"sales": [1, 2]})
+
+    start_trace("test")
+    first = run_stage("chart_data", compute, stage_key("v1", {"region": ["North"]}))
+    again = run_stage("chart_data", compute, stage_key("v1", {"region": ["North"]}))
+    run_stage("chart_data", compute, stage_key("v2", {"region": ["North"]}))
+    trace = stop_trace()
+    assert again is first and len(calls) == 2
+    assert stage_cache_stats()["hits"] == 1
+    assert filter_state_cache_stats()["entries"] == 0
+    assert [r["cached"] for r in trace.records] == [False, True, False]
+    assert trace.records[0]["rows"] == 2
+
+
+@pytest.mark.parametrize("filters", CUBE_FILTERS)
+def test_run_pipeline_csv_modes_match_pandas(filters):
+    df = load_csv_data()
+    expected = summarize_sales(apply_filters(df, filters))
+    for mode in ("rows", "live"):
+        pipeline = run_pipeline(filters, mode, source="csv")
+        assert len(pipeline["rows"]) == expected["row_count"]
+        _assert_same_summary(pipeline["summary"], expected)
+    assert pipeline["charts"]["resolution"] == "day"
+
+
+def test_run_pipeline_mongo_aggregate_mode_loads_only_a_preview(seeded_mongo):
+    source = dict(source="mongo", mongo_uri=MONGO_URI)
+    filters = {"region": ["North", "West"]}
+    rows = run_pipeline(filters, "rows", preview_rows=5, **source)
+    aggregated = run_pipeline(filters, "aggregate", preview_rows=5, **source)
+    assert len(aggregated["rows"]) == 5 < len(rows["rows"])
+    assert aggregated["summary"]["row_count"] == rows["summary"]["row_count"]
+    assert aggregated["summary"]["total_sales"] == rows["summary"]["total_sales"]
+    with pytest.raises(ValueError):
+        run_pipeline(filters, "stream", **source)
+
+
+@pytest.mark.parametrize("mode", ["rows", "live"])
+def test_warm_up_fills_the_caches_of_the_default_view(mode):
+    built = []
+    warm_up(mode, source="csv", after=built.append)
+    filters = default_filters(get_filter_options("csv"))
+    assert filters["order_date"] and all(filters[c] for c in FILTER_DIMENSIONS)
+
+    start_trace("test")
+    pipeline = run_pipeline(filters, mode, source="csv")
+    trace = stop_trace()
+    cached = {r["stage"]: r.get("cached") for r in trace.records}
+    assert cached["aggregate"] and cached["chart_data"]
+    assert built[0]["key"] == pipeline["key"]
+
+
+def test_start_warm_up_runs_once_per_source(monkeypatch):
+    monkeypatch.setattr(streamlit_utils, "_WARM_UPS", {})
+    thread = start_warm_up("rows", source="csv")
+    assert start_warm_up("rows", source="csv") is thread
+    thread.join()
+    assert STAGE_CACHE.stats()["entries"]
+    monkeypatch.setenv("WARM_UP", "0")
+    assert start_warm_up("live", source="csv") is None
+
+
+@pytest.mark.parametrize("mode", ["rows", "aggregate", "live"])
+def test_pipeline_summary_follows_in_place_edits_after_invalidation(seeded_mongo, mode):
+    source = dict(source="mongo", mongo_uri=MONGO_URI)
+    before = run_pipeline({}, mode, **source)["summary"]
+    coll = get_mongo_client(MONGO_URI)["sales_db"]["sales"]
+    first = coll.find_one({}, sort=[("_id", 1)])
+    coll.update_one({"_id": first["_id"]}, {"$inc": {"sales": 1_000_000}})
+
+    invalidate_dataframe_cache()
+    after = run_pipeline({}, mode, **source)["summary"]
+    assert after["total_sales"] == before["total_sales"] + 1_000_000
+    assert after["row_count"] == before["row_count"]
+
+
+def test_chart_stage_sums_subcategories_to_categories():
+    summary = summarize_sales(load_csv_data())
+    charts = chart_stage(summary, max_points=5)
+    assert len(charts["trend"]) == 5
+    assert charts["category_sales"]["sales"].sum() == summary["total_sales"]
+    assert set(charts["category_sales"]["category"]) == set(
+        charts["subcategory_sales"]["category"]
+    )
+
+
+SAMPLE_CSV = streamlit_utils.DATA_PATH
+
+
+@pytest.fixture
+def partition_dir(tmp_path, monkeypatch):
+    # the sample split into one file per month
+    df = pd.read_csv(SAMPLE_CSV)
+    months = pd.to_datetime(df["order_date"]).dt.to_period("M")
+    for month, rows in df.groupby(months):
+        rows.to_csv(tmp_path / f"sales_{month}.csv", index=False)
+    monkeypatch.setattr(streamlit_utils, "DATA_PATH", tmp_path)
+    return tmp_path
+
+
+def test_partition_date_range_reads_day_month_and_year_names():
+    assert partition_date_range(Path("sales_2024-06-01.csv")) == (
+        pd.Timestamp("2024-06-01"),
+        pd.Timestamp("2024-06-01"),
+    )
+    assert partition_date_range(Path("sales_2024-02.csv"))[1] == pd.Timestamp(
+        "2024-02-29"
+    )
+    assert partition_date_range(Path("2023.csv.gz"))[1] == pd.Timestamp("2023-12-31")
+    assert partition_date_range(Path("sales_2024-13.csv")) is None
+    assert partition_date_range(Path("extract_10000.csv")) is None
+
+
+@pytest.mark.parametrize("filters", CUBE_FILTERS)
+def test_partitioned_csv_matches_single_file(partition_dir, filters):
+    expected_df = apply_filters(
+        normalize_sales_frame(ensure_datetime(pd.read_csv(SAMPLE_CSV))), filters
+    )
+    rows = get_dataframe("csv", filters=filters)
+    assert len(rows) == len(expected_df)
+    _assert_same_summary(
+        get_sales_summary("csv", filters=filters), summarize_sales(expected_df)
+    )
+    assert get_table_page("csv", filters=filters, page_size=5)[1] == len(expected_df)
+
+
+def test_partitioned_csv_parses_only_partitions_in_the_date_range(partition_dir):
+    filters = {"order_date": ("2024-03-10", "2024-04-30")}
+    assert [p.name for p in csv_partitions(filters["order_date"])] == [
+        "sales_2024-03.csv",
+        "sales_2024-04.csv",
+    ]
+    (partition_dir / "notes.csv").write_text(SAMPLE_CSV.read_text().splitlines()[0])
+    start_trace("test")
+    get_dataframe("csv", filters=filters)
+    trace = stop_trace()
+    parsed = [r for r in trace.records if r["stage"] == "parse_partitions"]
+    # the undated file is always read
+    assert [r["files"] for r in parsed] == [3]
+
+
+def test_partitions_are_parsed_on_a_process_pool(partition_dir, monkeypatch):
+    monkeypatch.setenv("CSV_WORKERS", "2")
+    monkeypatch.setenv("CSV_PARALLEL_MIN_MB", "0")
+    try:
+        df = load_csv_data()
+        assert streamlit_utils._CSV_POOL is not None
+        options = get_filter_options("csv")
+    finally:
+        shutdown_csv_pool()
+    assert len(df) == len(pd.read_csv(SAMPLE_CSV))
+    assert schema_violations(df) == {}
+    assert options == streamlit_utils.filter_options_from_frame(df)
+
+
+def test_partition_errors_propagate_from_the_pool(partition_dir, monkeypatch):
+    monkeypatch.setenv("CSV_WORKERS", "2")
+    monkeypatch.setenv("CSV_PARALLEL_MIN_MB", "0")
+    (partition_dir / "sales_2024-12.csv").write_text("order_date,sales\n1,2\n1,2,3,4\n")
+    try:
+        with pytest.raises(pd.errors.ParserError):
+            load_csv_data()
+        # the worker's error is not mistaken for a broken pool
+        assert streamlit_utils._CSV_POOL is not None
+    finally:
+        shutdown_csv_pool()
+
+
+def test_incremental_dataset_appends_new_partitions(partition_dir):
+    dataset = IncrementalDataset("csv", min_interval=0)
+    dataset.refresh()
+    rows = len(dataset.frame)
+    (partition_dir / "sales_2025-01-02.csv").write_text(
+        SAMPLE_CSV.read_text().splitlines()[0] + "\n" + NEW_ROWS
+    )
+    assert dataset.refresh() == 2
+    assert len(dataset.frame) == rows + 2
+    (partition_dir / "sales_2025-01-02.csv").unlink()
+    dataset.refresh()
+    assert len(dataset.frame) == rows
+
+
+def test_build_engine_where_binds_every_value():
+    where, params = build_engine_where(
+        {
+            "region": ["North", "West"],
+            "category": [],
+            "order_date": ("2024-01-01", "2024-02-01"),
+        }
+    )
+    assert where == "WHERE region IN (?, ?) AND order_date BETWEEN ? AND ?"
+    assert params[:2] == ["North", "West"] and len(params) == 4
+    assert build_engine_where({}) == ("", [])
+
+
+@pytest.mark.parametrize("filters", CUBE_FILTERS)
+def test_engine_source_matches_pandas(filters):
+    pytest.importorskip("duckdb")
+    expected_df = apply_filters(load_csv_data(), filters)
+    expected = summarize_sales(expected_df)
+    summary = get_sales_summary("engine", filters=filters)
+    if expected["row_count"]:
+        _assert_same_summary(summary, expected)
+    else:
+        assert summary["row_count"] == 0 and summary["daily_sales"].empty
+    assert len(get_dataframe("engine", filters=filters)) == len(expected_df)
+    for search in (None, "offi"):
+        assert get_table_page("engine", filters=filters, search=search)[1] == (
+            get_table_page("csv", filters=filters, search=search)[1]
+        )
+
+
+def test_engine_pages_and_options_match_csv():
+    pytest.importorskip("duckdb")
+    page, total = get_table_page(
+        "engine", page=2, page_size=5, sort_by="sales", ascending=True
+    )
+    csv_page, csv_total = get_table_page(
+        "csv", page=2, page_size=5, sort_by="sales", ascending=True
+    )
+    assert total == csv_total
+    assert page["sales"].tolist() == csv_page["sales"].tolist()
+    assert get_filter_options("engine") == get_filter_options("csv")
+    assert get_dataframe("engine", limit=3).shape[0] == 3
+
+
+def test_engine_reads_parquet_partitions_in_the_date_range(tmp_path, monkeypatch):
+    pytest.importorskip("duckdb")
+    pytest.importorskip("pyarrow")
+    df = pd.read_csv(SAMPLE_CSV, parse_dates=["order_date"])
+    for quarter, rows in df.groupby(df["order_date"].dt.to_period("Q")):
+        # one file per month holding the quarter's first month only
+        month = quarter.start_time.strftime("%Y-%m")
+        rows = rows[rows["order_date"].dt.strftime("%Y-%m") == month]
+        rows.to_parquet(tmp_path / f"sales_{month}.parquet", index=False)
+    monkeypatch.setenv("ENGINE_PATH", str(tmp_path))
+    filters = {"order_date": ("2024-04-01", "2024-06-30")}
+    assert [p.name for p in streamlit_utils.engine_files(filters["order_date"])] == [
+        "sales_2024-04.parquet"
+    ]
+    expected = df[df["order_date"].dt.strftime("%Y-%m") == "2024-04"]
+    summary = get_sales_summary("engine", filters=filters)
+    assert summary["row_count"] == len(expected) > 0
+    assert summary["total_sales"] == expected["sales"].sum()
+    empty = get_sales_summary(
+        "engine", filters={"order_date": ("2030-01-01", "2030-02-01")}
+    )
+    assert empty["row_count"] == 0